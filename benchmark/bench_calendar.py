@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Nov 25 14:02:17 2023
+
+@author: Diego
+"""
+
+# times the epoch based calendar engine against the original string formatted
+# melt / merge implementation for the timezone part of DateGenerator
+#
+# $ python ./benchmark/bench_calendar.py --years 10 30 50
+# $ python ./benchmark/bench_calendar.py --years 10 --legacy
+
+import os
+import sys
+import time
+import string
+import argparse
+import pandas as pd
+import datetime as dt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import CalendarEngine
+
+ZONES = ["NYC", "Chicago", "London", "Tokyo", "Frankfurt"]
+
+# original DateGenerator timezone handling up to df_date_combined kept for comparison
+def legacy_calendar(start_date: dt.datetime, end_date: dt.datetime) -> pd.DataFrame:
+
+    dates = [
+        start_date + dt.timedelta(minutes=x) for x in range(
+            0, int((end_date - start_date).total_seconds() / 60) + 1, 5)]
+
+    contract_names = ["{}1".format(zone) for zone in ZONES]
+    translation_table = str.maketrans('', '', string.digits)
+
+    df_time = (pd.DataFrame(
+        columns = contract_names,
+        index = dates).
+        reset_index().
+        melt(id_vars = "index", var_name = "contract_name").
+        drop(columns = ["value"]).
+        rename(columns = {"index": "utc_time"}).
+        assign(
+            zone = lambda x: x.contract_name.str.translate(translation_table),
+            utc_time = lambda x: x.utc_time.dt.tz_localize("UTC"),
+            nyc_time = lambda x: x.utc_time.dt.tz_convert("America/New_York").dt.strftime("%Y-%m-%d %H:%M")).
+        groupby(["contract_name", "nyc_time"]).
+        head(1))
+
+    df_timezones_add = (pd.DataFrame({
+        "utc_time": df_time.utc_time.drop_duplicates().sort_values().to_list()}).
+        assign(**{
+            zone: lambda x, tz = tz: x.utc_time.dt.tz_convert(tz).dt.strftime("%Y-%m-%d %H:%M")
+            for zone, tz in CalendarEngine.ZONE_TZ.items()}).
+        melt(id_vars = "utc_time", var_name = "zone", value_name = "local_time"))
+
+    return (df_time.merge(
+        right = df_timezones_add, how = "inner", on = ["utc_time", "zone"]).
+        drop(columns = ["utc_time"]).
+        assign(
+            nyc_time = lambda x: pd.to_datetime(x.nyc_time),
+            local_time = lambda x: pd.to_datetime(x.local_time),
+            weekday = lambda x: x.local_time.dt.weekday,
+            date = lambda x: pd.to_datetime(x.local_time.dt.strftime("%Y-%m-%d")),
+            year = lambda x: x.date.dt.year).
+        query("year >= @min_year & year < @max_year").
+        drop(columns = ["year"]))
+
+# same output as legacy_calendar using the calendar engine
+def engine_calendar(start_date: dt.datetime, end_date: dt.datetime) -> int:
+
+    utc_ns = CalendarEngine.utc_grid(start_date, end_date)
+    row_count = 0
+    for zone in ZONES:
+
+        nyc_ns, local_ns = CalendarEngine.zone_times(utc_ns, zone, start_date.year, end_date.year)
+        days, weekday, hour = CalendarEngine.calendar_fields(local_ns)
+        row_count += len(local_ns)
+
+    return row_count
+
+def time_it(func, *args) -> float:
+
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type = int, nargs = "+", default = [10, 30, 50])
+    parser.add_argument("--legacy", action = "store_true", help = "also time the original implementation (slow)")
+    args = parser.parse_args()
+
+    end_date = dt.datetime(year = 2023, month = 1, day = 1)
+    for year_lookback in args.years:
+
+        start_date = dt.datetime(year = end_date.year - year_lookback, month = 1, day = 1)
+        engine_time = time_it(engine_calendar, start_date, end_date)
+        line = "{}y engine: {:.2f}s".format(year_lookback, engine_time)
+
+        if args.legacy == True:
+
+            legacy_time = time_it(legacy_calendar, start_date, end_date)
+            line += " legacy: {:.2f}s speedup: {:.0f}x".format(legacy_time, legacy_time / engine_time)
+
+        print(line)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Nov 27 09:15:52 2023
+
+@author: Diego
+"""
+
+# times the vectorized holiday sampler against the original groupby / apply that
+# shuffled every (zone, year) group and took the head
+#
+# $ python ./benchmark/bench_holidays.py --years 10 30 50
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import datetime as dt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import CalendarEngine
+
+# original DateGenerator._gen_rand_holidays kept for comparison
+def _gen_rand_holidays(df: pd.DataFrame) -> pd.DataFrame:
+
+    df_shuffled = df.sample(frac = 1)
+    df_market_open = df_shuffled.head(250).assign(market_day = "open")
+    good_dates = df_market_open.date.drop_duplicates().to_list()
+    df_market_holiday = df_shuffled[~df_shuffled.date.isin(good_dates)].assign(market_day = "holiday")
+
+    df_out = pd.concat([df_market_open, df_market_holiday])
+    return df_out
+
+def legacy_holidays(df_weekdays: pd.DataFrame) -> pd.DataFrame:
+
+    return (df_weekdays.groupby(
+        ["zone", "year"]).
+        apply(_gen_rand_holidays).
+        reset_index(drop = True))
+
+def weekday_tables(year_lookback: int) -> pd.DataFrame:
+
+    # hourly bars are enough to get every local day
+    end_date = dt.datetime(year = 2023, month = 1, day = 1)
+    start_date = dt.datetime(year = end_date.year - year_lookback, month = 1, day = 1)
+    utc_ns = CalendarEngine.utc_grid(start_date, end_date, bar_minutes = 60)
+
+    return pd.concat([
+        CalendarEngine.weekday_table(zone, CalendarEngine.zone_times(utc_ns, zone, start_date.year, end_date.year)[1])
+        for zone in CalendarEngine.ZONE_TZ.keys()])
+
+def time_it(func, *args) -> float:
+
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type = int, nargs = "+", default = [10, 30, 50])
+    args = parser.parse_args()
+
+    np.random.seed(1234)
+    for year_lookback in args.years:
+
+        df_weekdays = weekday_tables(year_lookback)
+        vectorized_time = time_it(CalendarEngine.assign_holidays, df_weekdays, 1234)
+        legacy_time = time_it(legacy_holidays, df_weekdays)
+
+        print("{}y ({} zone-years) vectorized: {:.4f}s legacy: {:.2f}s speedup: {:.0f}x".format(
+            year_lookback,
+            len(df_weekdays[["zone", "year"]].drop_duplicates()),
+            vectorized_time,
+            legacy_time,
+            legacy_time / vectorized_time))
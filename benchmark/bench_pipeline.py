@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Dec  3 10:48:26 2023
+
+@author: Diego
+"""
+
+# times every stage of the pipeline (DateGenerator, PriceGenerator, make_sample and each
+# MarketStats method) for a grid of year_lookback and contracts per zone, along with the
+# RSS each stage adds and its own peak RSS, and writes the results to JSON so runs of
+# different versions can be compared. The calendar, holiday, roll, cumprod and OHLC steps
+# inside the generators are timed as nested stages. Each configuration runs in its own
+# process inside a temporary directory so nothing is downloaded and nothing in ../data is
+# touched
+#
+# $ python ./benchmark/bench_pipeline.py
+# $ python ./benchmark/bench_pipeline.py --years 2 5 --contracts 1 2 --out bench_pipeline.json
+# $ python ./benchmark/bench_pipeline.py --large
+# $ python ./benchmark/bench_pipeline.py --backend process --n-jobs 4
+
+import os
+import sys
+import json
+import time
+import platform
+import functools
+import argparse
+import resource
+import tempfile
+import subprocess
+import datetime as dt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.append(SRC_PATH)
+
+# fixed so results don't move with the calendar year
+END_DATE = dt.datetime(year = 2023, month = 1, day = 1)
+ZONES = ["NYC", "Chicago", "London", "Tokyo", "Frankfurt"]
+
+SMALL_CONFIG = {"years": [2], "contracts": [1]}
+LARGE_CONFIG = {"years": [2, 5, 10], "contracts": [1, 2]}
+
+# MarketStats methods in an order where each one's inputs already exist
+MARKET_STATS_METHODS = [
+    "get_roll_adjusted_close",
+    "get_volume_stats",
+    "get_avg_intraday_nyc_rtn",
+    "get_intraday_window_rtn",
+    "get_roll_adjusted_prices",
+    "get_intraday_price_range",
+    "build_rollups",
+    "resample_bars",
+    "resample_bars_daily",
+    "get_daily_true_range",
+    "get_intraday_total_nyc_return",
+    "sweep_intraday_total_nyc_return"]
+
+# functions inside the generators timed as nested stages of the stage that calls them, the
+# calendar ones only run in this process with the default n_jobs = 1
+NESTED_STAGES = {
+    "CalendarEngine": ["zone_times", "weekday_table", "assign_holidays", "zone_market"],
+    "RollSchedule": ["quarterly_roll_dates"],
+    "PriceGenerator.PriceGenerator": ["_first_bar_positions", "_roll_labels", "_segment_cumprod"],
+    "OhlcKernel": ["ohlc", "volumes"]}
+
+# high water mark of this process in MB, VmHWM since the last reset_peak_rss on linux and
+# ru_maxrss (in KB on linux, bytes on mac) otherwise
+def peak_rss_mb() -> float:
+
+    try:
+        with open("/proc/self/status", "r") as file:
+            return [int(line.split()[1]) for line in file if line.startswith("VmHWM")][0] / 1024
+
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 ** 2)
+
+# resident memory of this process right now in MB
+def current_rss_mb() -> float:
+
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+
+    except OSError:
+        return peak_rss_mb()
+
+# resets the high water mark to the current RSS, linux only, returns whether it could
+def reset_peak_rss() -> bool:
+
+    try:
+        with open("/proc/self/clear_refs", "w") as file: file.write("5")
+        return True
+
+    except OSError:
+        return False
+
+# times stages and records the RSS each one adds and the peak RSS while it ran. The process
+# peak only goes up so it is reset at the start of every stage, a nested stage folds the peak
+# of its parent so far in before resetting and hands its own peak back when it is done. Without
+# resets (not linux) stage peaks are None. Nested stages called more than once are summed
+class StageTimer:
+
+    def __init__(self):
+
+        self.stages = []
+        self.running = []
+        self.can_reset = reset_peak_rss()
+
+    def __call__(self, stage: str, func, *args, **kwargs):
+
+        if len(self.running) > 0:
+
+            parent = self.running[-1]
+            parent["peak"] = max(parent["peak"], peak_rss_mb())
+            name = "{} / {}".format(parent["record"]["stage"], stage)
+            record = next((record for record in self.stages if record["stage"] == name), None)
+
+        else: name, record = stage, None
+
+        if record == None:
+
+            record = {"stage": name, "calls": 0, "seconds": 0.0, "rss_delta_mb": 0.0, "stage_peak_mb": None}
+            self.stages.append(record)
+
+        self.can_reset = reset_peak_rss()
+        start_rss = current_rss_mb()
+        self.running.append({"record": record, "peak": start_rss})
+
+        start = time.perf_counter()
+        out = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        peak = max(self.running.pop()["peak"], peak_rss_mb())
+        if len(self.running) > 0: self.running[-1]["peak"] = max(self.running[-1]["peak"], peak)
+
+        record["calls"] += 1
+        record["seconds"] = round(record["seconds"] + seconds, 4)
+        record["rss_delta_mb"] = round(record["rss_delta_mb"] + current_rss_mb() - start_rss, 1)
+        if self.can_reset == True: record["stage_peak_mb"] = round(max(record["stage_peak_mb"] or 0, peak), 1)
+
+        if len(self.running) == 0: self.report(record)
+        return out
+
+    # prints a top level stage and the stages nested in it
+    def report(self, record: dict):
+
+        for stage in self.stages[self.stages.index(record):]:
+
+            print("    {:<60} {:>9.2f}s {:>+9.0f} MB {:>9} MB".format(
+                stage["stage"], stage["seconds"], stage["rss_delta_mb"],
+                "-" if stage["stage_peak_mb"] == None else "{:.0f}".format(stage["stage_peak_mb"])))
+
+    # replaces the NESTED_STAGES functions with ones timed by this timer
+    def instrument(self):
+
+        import importlib
+
+        for path, names in NESTED_STAGES.items():
+
+            module = importlib.import_module(path.split(".")[0])
+            owner = getattr(module, path.split(".")[1]) if "." in path else module
+
+            for name in names: setattr(owner, name, self._timed("{}.{}".format(path.split(".")[-1], name), getattr(owner, name)))
+
+    # a plain function rather than a partial so methods still bind to their instance
+    def _timed(self, stage: str, func):
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs): return self(stage, func, *args, **kwargs)
+
+        return timed
+
+# runs one configuration start to finish, called in a fresh process
+def run_config(year_lookback: int, contracts_per_zone: int, backend: str = "serial", n_jobs: int = 1) -> dict:
+
+    from DateGenerator import DateGenerator
+    from PriceGenerator import PriceGenerator
+    from MarketStats import MarketStats
+    import makeData
+
+    timer = StageTimer()
+    timer.instrument()
+    country_contract = {zone: contracts_per_zone for zone in ZONES}
+
+    # the generators read and write ../data relative to the working directory
+    with tempfile.TemporaryDirectory() as tmp_path:
+
+        run_path = os.path.join(tmp_path, "run")
+        os.makedirs(run_path)
+        os.chdir(run_path)
+
+        date_generator = timer(
+            "DateGenerator.__init__", DateGenerator,
+            country_contract = country_contract, end_date = END_DATE, year_lookback = year_lookback, verbose = False)
+        timer("DateGenerator.save_data", date_generator.save_data)
+        del date_generator
+
+        price_generator = timer("PriceGenerator.__init__", PriceGenerator, verbose = False)
+        row_count = len(price_generator.df_vol)
+        timer("PriceGenerator.save_data", price_generator.save_data)
+        del price_generator
+
+        timer("makeData.make_sample", makeData.make_sample)
+
+        market_stats = timer(
+            "MarketStats.__init__", MarketStats,
+            file_path = os.path.join(tmp_path, "data", "prices.parquet"), backend = backend, n_jobs = n_jobs)
+
+        for method in MARKET_STATS_METHODS:
+            timer("MarketStats.{}".format(method), getattr(market_stats, method))
+
+    return {
+        "year_lookback": year_lookback,
+        "contracts_per_zone": contracts_per_zone,
+        "contract_count": contracts_per_zone * len(ZONES),
+        "backend": backend,
+        "n_jobs": n_jobs,
+        "price_rows": row_count,
+        "total_seconds": round(sum(stage["seconds"] for stage in timer.stages if " / " not in stage["stage"]), 4),
+        "peak_rss_mb": round(max(stage["stage_peak_mb"] for stage in timer.stages) if timer.can_reset == True else peak_rss_mb(), 1),
+        "stages": timer.stages}
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd = SRC_PATH, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment() -> dict:
+
+    return {
+        "created": dt.datetime.now().isoformat(timespec = "seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pyarrow": pa.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type = int, nargs = "+", help = "year_lookback values (at least 2)")
+    parser.add_argument("--contracts", type = int, nargs = "+", help = "contracts per zone")
+    parser.add_argument("--large", action = "store_true", help = "use the larger grid (slow and memory hungry)")
+    parser.add_argument("--backend", default = "serial", choices = ["serial", "thread", "process"], help = "MarketStats executor backend")
+    parser.add_argument("--n-jobs", type = int, default = 1, help = "MarketStats executor jobs, -1 for every core")
+    parser.add_argument("--out", default = "bench_pipeline.json", help = "JSON file to write results to")
+    args = parser.parse_args()
+
+    config = LARGE_CONFIG if args.large == True else SMALL_CONFIG
+    years = args.years if args.years != None else config["years"]
+    contracts = args.contracts if args.contracts != None else config["contracts"]
+
+    results = []
+    for year_lookback in years:
+        for contracts_per_zone in contracts:
+
+            print("{}y lookback, {} contracts per zone".format(year_lookback, contracts_per_zone))
+            print("    {:<60} {:>10} {:>12} {:>12}".format("stage", "time", "rss added", "stage peak"))
+
+            # spawn so every configuration starts from a clean process and its own peak RSS
+            with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_config, year_lookback, contracts_per_zone, args.backend, args.n_jobs).result())
+
+            print("    {:<60} {:>9.2f}s {:>22.0f} MB".format("total", results[-1]["total_seconds"], results[-1]["peak_rss_mb"]))
+
+    with open(args.out, "w") as file:
+        json.dump({"environment": environment(), "results": results}, file, indent = 2)
+
+    print("Results written to", args.out)
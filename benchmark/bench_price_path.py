@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Nov 30 10:21:48 2023
+
+@author: Diego
+"""
+
+# throughput (rows per second) of the return to price path in PriceGenerator, the
+# original groupby / apply of _fill and _cum_rtn against a single sort with a
+# segment wise cumprod over each contract's contiguous block
+#
+# $ python ./benchmark/bench_price_path.py --contracts 5 25 --years 1 5
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+from PriceGenerator import PriceGenerator
+
+BARS_PER_YEAR = 365 * 24 * 12
+
+# frame shaped like df_combined before the price path with a roll every quarter
+def make_input(contract_count: int, year_count: int) -> pd.DataFrame:
+
+    rng = np.random.RandomState(123)
+    bar_count = BARS_PER_YEAR * year_count
+    times = pd.date_range("2020-01-01", periods = bar_count, freq = "5min")
+    names = ["Zone{}".format(i + 1) for i in range(contract_count)]
+
+    df = pd.DataFrame({
+        "contract_name": np.repeat(names, bar_count),
+        "nyc_time": np.tile(times, contract_count),
+        "local_time": np.tile(times, contract_count),
+        "rtn": rng.normal(loc = 0.000003, scale = 0.0002, size = bar_count * contract_count),
+        "start_price": 1_000.0,
+        "roll_count": 0})
+
+    roll_rows = np.flatnonzero((df.nyc_time.dt.is_quarter_start & (df.nyc_time.dt.hour == 0) & (df.nyc_time.dt.minute == 0)).values)
+    df["roll"] = np.nan
+    df["contract"] = None
+    df.loc[roll_rows, "roll"] = 0.02
+    df.loc[roll_rows, "contract"] = (
+        df.contract_name.iloc[roll_rows] + "_" + 
+        (df.iloc[roll_rows].groupby("contract_name").cumcount() + 2).astype(str))
+
+    # shuffle so both paths have to sort
+    return df.sample(frac = 1, random_state = 123).reset_index(drop = True)
+
+# original PriceGenerator._fill and _cum_rtn
+def _fill(df: pd.DataFrame) -> pd.DataFrame:
+    return(df.sort_values(
+        "local_time").
+        fillna(method = "ffill").
+        assign(contract = lambda x: x.contract.fillna(x.contract_name + "_" + (x.roll_count + 1).astype(str))))
+
+def _cum_rtn(df: pd.DataFrame) -> pd.DataFrame:
+    return(df.sort_values(
+        "nyc_time").
+        assign(open_rtn = lambda x: np.cumprod(1 + x.rtn)))
+
+def legacy_path(df: pd.DataFrame) -> pd.DataFrame:
+
+    return (df.assign(
+        roll = lambda x: x.roll.fillna(0)).
+        groupby("contract_name").
+        apply(_fill).
+        reset_index(drop = True).
+        assign(rtn = lambda x: x.rtn + x.roll).
+        drop(columns = ["roll"]).
+        groupby("contract_name").
+        apply(_cum_rtn).
+        reset_index(drop = True).
+        assign(open_price = lambda x: x.start_price * x.open_rtn))
+
+def vectorized_path(generator: PriceGenerator, df: pd.DataFrame) -> pd.DataFrame:
+
+    df_combined = (df.sort_values(
+        ["contract_name", "nyc_time"]).
+        reset_index(drop = True))
+
+    starts = generator._group_starts(df_combined.contract_name.values)
+    df_first = df_combined.iloc[starts]
+    roll_bars = np.flatnonzero(df_combined.roll.notna().values)
+
+    df_combined = (df_combined.assign(
+        contract = generator._roll_labels(
+            names = df_first.contract_name.values,
+            roll_counts = df_first.roll_count.values,
+            starts = starts,
+            roll_bars = roll_bars,
+            row_count = len(df_combined)),
+        rtn = lambda x: x.rtn + x.roll.fillna(0)).
+        drop(columns = ["roll"]))
+
+    open_rtn = generator._segment_cumprod(1 + df_combined.rtn.values, starts)
+    return df_combined.assign(open_price = df_combined.start_price.values * open_rtn)
+
+def time_it(func, *args) -> tuple:
+
+    start = time.perf_counter()
+    out = func(*args)
+    return time.perf_counter() - start, out
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contracts", type = int, nargs = "+", default = [5, 25])
+    parser.add_argument("--years", type = int, nargs = "+", default = [1, 5])
+    args = parser.parse_args()
+
+    # chunk mode skips reading data/date so the helper methods can be used on their own
+    generator = PriceGenerator(chunk = "year", verbose = False)
+
+    for contract_count in args.contracts:
+        for year_count in args.years:
+
+            df = make_input(contract_count, year_count)
+            legacy_time, df_legacy = time_it(legacy_path, df)
+            vectorized_time, df_vectorized = time_it(vectorized_path, generator, df)
+
+            same = (
+                np.array_equal(df_legacy.open_price.values, df_vectorized.open_price.values) and
+                np.array_equal(df_legacy.contract.values, df_vectorized.contract.values))
+            print("{} contracts {}y ({:,} rows) legacy: {:,.0f} rows/s vectorized: {:,.0f} rows/s same output: {}".format(
+                contract_count,
+                year_count,
+                len(df),
+                len(df) / legacy_time,
+                len(df) / vectorized_time,
+                same))
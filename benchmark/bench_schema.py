@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 28 18:05:33 2023
+
+@author: Diego
+"""
+
+# memory / disk report of the compact schema against the old object string schema
+# for a prices.parquet (or date.parquet) file written by the generators
+#
+# $ python ./benchmark/bench_schema.py ../data/prices.parquet
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import DataSchema
+
+# the schema written before names and market state were compacted
+def legacy_schema(df: pd.DataFrame) -> pd.DataFrame:
+
+    dtypes = {col: object for col in DataSchema.NAME_COLS + ["market_day", "market_hour"] if col in df.columns}
+    dtypes.update({col: "int32" for col in ["weekday", "hour"] if col in df.columns})
+    dtypes.update({col: "float64" for col in ["buy_vol", "sell_vol"] + DataSchema.PRICE_COLS if col in df.columns})
+    return df.astype(dtypes)
+
+def time_it(func, *args) -> float:
+
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_path")
+    parser.add_argument("--price-dtype", default = "float64", choices = ["float64", "float32"])
+    args = parser.parse_args()
+
+    df_legacy = legacy_schema(pd.read_parquet(path = args.file_path, engine = "pyarrow"))
+    df_compact = DataSchema.compact(df_legacy, args.price_dtype)
+
+    print("In memory (MB)")
+    df_report = DataSchema.memory_report(df_legacy, df_compact)
+    print(df_report.round(2))
+    print("total before: {:.1f}MB after: {:.1f}MB".format(df_report.before_mb.sum(), df_report.after_mb.sum()))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        for name, df in [("legacy", df_legacy), ("compact", df_compact)]:
+
+            path = os.path.join(tmp_dir, "{}.parquet".format(name))
+            df.to_parquet(path = path, engine = "pyarrow")
+            read_time = time_it(pd.read_parquet, path)
+            print("{} on disk: {:.1f}MB read: {:.2f}s".format(name, os.path.getsize(path) / 1e6, read_time))
+
+    string_time = time_it(lambda: df_legacy.query("market_hour == 'open'"))
+    mask_time = time_it(lambda: df_compact[DataSchema.is_open(df_compact.market_hour)])
+    print("open bar filter string query: {:.3f}s boolean mask: {:.3f}s".format(string_time, mask_time))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Nov 25 10:12:44 2023
+
+@author: Diego
+"""
+
+# calendar engine that works directly on int64 epoch arrays (nanoseconds), all of
+# the timezone work is done with per-zone UTC offset tables pulled from the tz
+# database once and after that local times, weekdays, dates and hours are plain
+# integer arithmetic with no string conversion and no merging
+
+import numpy as np
+import pandas as pd
+import datetime as dt
+
+import DataSchema
+
+NS_PER_MINUTE = 60 * 1_000_000_000
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# tz database names of each zone a contract can be in
+ZONE_TZ = {
+    "NYC": "America/New_York",
+    "Chicago": "America/Chicago",
+    "London": "Europe/London",
+    "Tokyo": "Asia/Tokyo",
+    "Frankfurt": "Europe/Berlin"}
+
+# local hours where the market is shut even on an open day
+CLOSED_HOURS = [17, 18, 19, 20]
+
+# trading days per year, the remaining weekdays are holidays
+OPEN_DAYS = 250
+
+def to_epoch(date: dt.datetime) -> int:
+    return int(pd.Timestamp(date).value)
+
+# every bar_minutes timestamp between start and end (inclusive) as UTC nanoseconds
+def utc_grid(start_date: dt.datetime, end_date: dt.datetime, bar_minutes: int = 5) -> np.ndarray:
+
+    # np.arange sizes itself with floats which drops the end point at nanosecond epochs
+    start_ns, step = to_epoch(start_date), bar_minutes * NS_PER_MINUTE
+    bar_count = (to_epoch(end_date) - start_ns) // step + 1
+    return start_ns + np.arange(bar_count, dtype = np.int64) * step
+
+def _utc_offsets(utc_ns: np.ndarray, tz: str) -> np.ndarray:
+
+    utc_index = pd.DatetimeIndex(utc_ns).tz_localize("UTC")
+    return utc_index.tz_convert(tz).tz_localize(None).asi8 - utc_ns
+
+# builds the table of UTC instants where the zone's offset changes and the offset
+# in effect from that instant onwards. The offsets are sampled hourly and every
+# change is then refined to the exact minute so it doesn't matter when the zone
+# switches over
+def tz_offset_table(tz: str, start_ns: int, end_ns: int) -> tuple:
+
+    first_hour = start_ns - start_ns % NS_PER_HOUR - NS_PER_HOUR
+    hour_count = (end_ns - first_hour) // NS_PER_HOUR + 2
+    hourly = first_hour + np.arange(hour_count, dtype = np.int64) * NS_PER_HOUR
+
+    hourly_offsets = _utc_offsets(hourly, tz)
+    changes = np.flatnonzero(np.diff(hourly_offsets)) + 1
+
+    transitions, offsets = [hourly[0]], [hourly_offsets[0]]
+    for change in changes:
+
+        minutes = hourly[change - 1] + np.arange(1, 61, dtype = np.int64) * NS_PER_MINUTE
+        minute_offsets = _utc_offsets(minutes, tz)
+        first_new = np.argmax(minute_offsets == hourly_offsets[change])
+
+        transitions.append(minutes[first_new])
+        offsets.append(hourly_offsets[change])
+
+    return np.array(transitions, dtype = np.int64), np.array(offsets, dtype = np.int64)
+
+# converts utc nanoseconds to local wall clock nanoseconds for a tz database zone
+def to_local(utc_ns: np.ndarray, tz: str) -> np.ndarray:
+
+    if len(utc_ns) == 0: return utc_ns.copy()
+
+    transitions, offsets = tz_offset_table(tz, int(utc_ns.min()), int(utc_ns.max()))
+    idx = np.searchsorted(transitions, utc_ns, side = "right") - 1
+    return utc_ns + offsets[idx]
+
+# when clocks go back the same wall clock time shows up twice, keep the first one
+def first_occurrence_mask(local_ns: np.ndarray) -> np.ndarray:
+
+    if len(local_ns) == 0: return np.ones(0, dtype = bool)
+
+    previous_max = np.maximum.accumulate(local_ns)
+    mask = np.ones(len(local_ns), dtype = bool)
+    mask[1:] = local_ns[1:] > previous_max[:-1]
+    return mask
+
+# day number since epoch, weekday (monday = 0) and hour of local wall clock nanoseconds
+def calendar_fields(local_ns: np.ndarray) -> tuple:
+
+    days = np.floor_divide(local_ns, NS_PER_DAY)
+    weekday = ((days + 3) % 7).astype(np.int32)  # 1970-01-01 was a thursday
+    hour = (np.mod(local_ns, NS_PER_DAY) // NS_PER_HOUR).astype(np.int32)
+    return days, weekday, hour
+
+def day_number(dates: pd.Series) -> np.ndarray:
+    return dates.values.astype("datetime64[D]").astype(np.int64)
+
+def day_year(days: np.ndarray) -> np.ndarray:
+    return days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+# NYC standardized and local times for a zone, restricted to local years in [min_year, max_year)
+# NYC repeated wall clock times are dropped across every zone to match how nyc_time is keyed
+def zone_times(utc_ns: np.ndarray, zone: str, min_year: int, max_year: int) -> tuple:
+
+    nyc_ns = to_local(utc_ns, ZONE_TZ["NYC"])
+    keep = first_occurrence_mask(nyc_ns)
+    utc_ns, nyc_ns = utc_ns[keep], nyc_ns[keep]
+
+    local_ns = to_local(utc_ns, ZONE_TZ[zone])
+    years = day_year(np.floor_divide(local_ns, NS_PER_DAY))
+    in_range = (years >= min_year) & (years < max_year)
+
+    return nyc_ns[in_range], local_ns[in_range]
+
+# unique weekdays per zone which are the candidates for trading days
+def weekday_table(zone: str, local_ns: np.ndarray) -> pd.DataFrame:
+
+    days = np.unique(np.floor_divide(local_ns, NS_PER_DAY))
+    weekday = ((days + 3) % 7).astype(np.int32)
+    days, weekday = days[weekday < 5], weekday[weekday < 5]
+
+    return pd.DataFrame({
+        "zone": zone,
+        "date": days.astype("datetime64[D]").astype("datetime64[ns]"),
+        "year": day_year(days),
+        "weekday": weekday})
+
+# splitmix64 finalizer, turns any uint64 counter into a well mixed pseudo random uint64
+def _mix64(x: np.ndarray) -> np.ndarray:
+
+    with np.errstate(over = "ignore"):
+
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+# random sort key for each (seed, zone, day), since it only depends on those three the
+# holidays come out the same no matter how the calendar is chunked or which order zones run in
+def day_keys(seed: int, zone: str, days: np.ndarray) -> np.ndarray:
+
+    zone_key = _mix64(np.array([seed], dtype = np.uint64))[0] ^ np.uint64(list(ZONE_TZ.keys()).index(zone))
+    return _mix64(_mix64(np.full(len(days), zone_key, dtype = np.uint64)) ^ days.astype(np.uint64))
+
+# ranks every weekday within its zone and year by a random key and marks the first 250 
+# open and the rest holidays, same idea as shuffling each year and taking the head
+def assign_holidays(df_weekdays: pd.DataFrame, seed: int) -> pd.DataFrame:
+
+    days = day_number(df_weekdays.date)
+    zone_codes, zone_names = pd.factorize(df_weekdays.zone)
+
+    keys = np.zeros(len(days), dtype = np.uint64)
+    for code, zone in enumerate(zone_names):
+        keys[zone_codes == code] = day_keys(seed, zone, days[zone_codes == code])
+
+    years = df_weekdays.year.values
+    order = np.lexsort((keys, years, zone_codes))
+
+    # position of each row within its (zone, year) group once sorted
+    group_start = np.ones(len(order), dtype = bool)
+    group_start[1:] = (np.diff(zone_codes[order]) != 0) | (np.diff(years[order]) != 0)
+    group_first = np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))
+
+    rank = np.empty(len(order), dtype = np.int64)
+    rank[order] = np.arange(len(order)) - group_first
+
+    return df_weekdays.assign(market_day = np.where(rank < OPEN_DAYS, "open", "holiday").astype(object))
+
+# builds the df_market frame for one zone, open_days and holiday_days are local day
+# numbers (days since epoch) and every other day is a closed weekend day
+def zone_market(
+        zone: str,
+        contract_names: list,
+        nyc_ns: np.ndarray,
+        local_ns: np.ndarray,
+        open_days: np.ndarray,
+        holiday_days: np.ndarray) -> pd.DataFrame:
+
+    days, weekday, hour = calendar_fields(local_ns)
+
+    # market state is built straight into the compact categorical codes
+    market_day = np.zeros(len(days), dtype = np.int8)
+    market_day[np.isin(days, holiday_days)] = DataSchema.MARKET_DAY.categories.get_loc("holiday")
+    is_open_day = np.isin(days, open_days)
+    market_day[is_open_day] = DataSchema.MARKET_DAY.categories.get_loc("open")
+
+    market_hour = (is_open_day & ~np.isin(hour, CLOSED_HOURS)).astype(np.int8)
+
+    df_zone = pd.DataFrame({
+        "zone": zone,
+        "nyc_time": nyc_ns.astype("datetime64[ns]"),
+        "local_time": local_ns.astype("datetime64[ns]"),
+        "weekday": weekday.astype(np.int8),
+        "date": days.astype("datetime64[D]").astype("datetime64[ns]"),
+        "market_day": pd.Categorical.from_codes(market_day, dtype = DataSchema.MARKET_DAY),
+        "hour": hour.astype(np.int8),
+        "market_hour": pd.Categorical.from_codes(market_hour, dtype = DataSchema.MARKET_HOUR)})
+
+    df_out = pd.concat([
+        df_zone.assign(contract_name = contract_name) for contract_name in contract_names])
+
+    return df_out[[
+        "contract_name", "zone", "nyc_time", "local_time", "weekday",
+        "date", "market_day", "hour", "market_hour"]]
+
+# local times and holiday table of one zone over local years [min_year, max_year), the bulk of the
+# work for a zone and the same for every quarter of those years, so quarters can share it
+def zone_years(
+        zone: str,
+        start_date: dt.datetime,
+        end_date: dt.datetime,
+        min_year: int,
+        max_year: int,
+        seed: int) -> tuple:
+
+    # pad a day either side of the years so every local day is complete
+    utc_ns = utc_grid(
+        max(start_date, dt.datetime(year = min_year, month = 1, day = 1) - dt.timedelta(days = 1)),
+        min(end_date, dt.datetime(year = max_year, month = 1, day = 1) + dt.timedelta(days = 1)))
+
+    nyc_ns, local_ns = zone_times(utc_ns, zone, min_year, max_year)
+
+    # holidays need the whole year even when only a quarter is built
+    df_holiday = assign_holidays(weekday_table(zone, local_ns), seed).drop(columns = ["year"])
+
+    return nyc_ns, local_ns, df_holiday
+
+# df_market and the holiday table of one zone from its zone_years, optionally only one local quarter
+def zone_frames(zone: str, contract_names: list, years: tuple, quarter: int = None) -> tuple:
+
+    nyc_ns, local_ns, df_holiday = years
+
+    if quarter != None:
+
+        months = local_ns.astype("datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+        in_quarter = months % 12 // 3 + 1 == quarter
+        nyc_ns, local_ns = nyc_ns[in_quarter], local_ns[in_quarter]
+
+    df_market = zone_market(
+        zone = zone,
+        contract_names = contract_names,
+        nyc_ns = nyc_ns,
+        local_ns = local_ns,
+        open_days = day_number(df_holiday.query("market_day == 'open'").date),
+        holiday_days = day_number(df_holiday.query("market_day == 'holiday'").date))
+
+    return df_market, df_holiday
+
+# whole calendar for one zone over local years [min_year, max_year), optionally only one local quarter
+# zones don't depend on each other so this is the unit of work handed to each worker process
+def build_zone(
+        zone: str,
+        contract_names: list,
+        start_date: dt.datetime,
+        end_date: dt.datetime,
+        min_year: int,
+        max_year: int,
+        seed: int,
+        quarter: int = None) -> tuple:
+
+    years = zone_years(zone, start_date, end_date, min_year, max_year, seed)
+    return zone_frames(zone, contract_names, years, quarter)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 28 16:48:21 2023
+
+@author: Diego
+"""
+
+# compact column types for date.parquet and prices.parquet. Names and market state are
+# stored dictionary encoded (pandas categoricals) so every 5 minute row holds a small int
+# code rather than a python string, market state codes fit in int8 and can be compared
+# as boolean masks without any string comparisons
+
+import numpy as np
+import pandas as pd
+
+MARKET_DAY = pd.CategoricalDtype(categories = ["closed", "holiday", "open"])
+MARKET_HOUR = pd.CategoricalDtype(categories = ["closed", "open"])
+
+COMPACT_DTYPES = {
+    "contract_name": "category",
+    "zone": "category",
+    "contract": "category",
+    "weekday": "int8",
+    "hour": "int8",
+    "market_day": MARKET_DAY,
+    "market_hour": MARKET_HOUR,
+    "buy_vol": "int32",
+    "sell_vol": "int32"}
+
+PRICE_COLS = ["open_price", "high_price", "low_price", "close_price"]
+NAME_COLS = ["contract_name", "zone", "contract"]
+
+# casts whichever of the known columns are present, prices can be stored as float32
+def compact(df: pd.DataFrame, price_dtype: str = "float64") -> pd.DataFrame:
+
+    if price_dtype not in ["float64", "float32"]: raise ValueError("price_dtype must be float64 or float32")
+
+    dtypes = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns}
+    dtypes.update({col: price_dtype for col in PRICE_COLS if col in df.columns})
+    return df.astype(dtypes)
+
+# name columns back to plain strings for code that builds new names out of them
+def expand_names(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype({col: object for col in NAME_COLS if col in df.columns})
+
+# boolean mask of where a market_day or market_hour column is open, works on the compact
+# categorical columns and on older files that stored them as strings
+def is_open(col: pd.Series) -> np.ndarray:
+
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return col.cat.codes.values == col.cat.categories.get_loc("open")
+
+    return col.values == "open"
+
+# in memory size of each column before and after compacting in MB
+def memory_report(df_before: pd.DataFrame, df_after: pd.DataFrame) -> pd.DataFrame:
+
+    return (pd.DataFrame({
+        "before_mb": df_before.memory_usage(index = False, deep = True) / 1e6,
+        "after_mb": df_after.memory_usage(index = False, deep = True) / 1e6}).
+        assign(reduction = lambda x: 1 - x.after_mb / x.before_mb))
@@ -6,34 +6,25 @@ Created on Wed Nov 15 13:24:31 2023
 """
 
 import os
-import string
-import numpy as np
 import pandas as pd
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import DataSchema
+import CalendarEngine
+import ParquetDataset
 
 class DateGenerator:
     
-    def _gen_rand_holidays(self, df: pd.DataFrame) -> pd.DataFrame:
-        
-        df_shuffled = df.sample(frac = 1)
-        df_market_open = df_shuffled.head(250).assign(market_day = "open")
-        good_dates = df_market_open.date.drop_duplicates().to_list()
-        df_market_holiday = df_shuffled.query("date != @good_dates").assign(market_day = "holiday")
-        
-        df_out = pd.concat([df_market_open, df_market_holiday])
-        return df_out
-    
     # function to check that we have 250 trading days
     def _check_days_count(self):
         
+        # date is already the local date so there is no need to format local_time
         bad_data = (self.df_market.query(
             "market_day == 'open'")
-            [["contract_name", "local_time"]].
-            assign(
-                date = lambda x: x.local_time.dt.strftime("%Y-%m-%d"), 
-                year = lambda x: x.local_time.dt.year).
-            drop(columns = ["local_time"]).
+            [["contract_name", "date"]].
             drop_duplicates().
+            assign(year = lambda x: x.date.dt.year).
             groupby(["contract_name", "year"]).
             agg("count")
             ["date"].
@@ -49,21 +40,17 @@ class DateGenerator:
     
         # due to using year end and international times there are some days 
         # with less than a full trading day which needs to be accounted for
-        first_date = self.df_market.local_time.min().date().strftime("%Y-%m-%d")
+        first_date = self.df_market.date.min()
     
         bad_data = (self.df_market.query(
             "market_hour == 'open'")
-            [["contract_name", "local_time"]].
-            assign(
-                date_hour = lambda x: x.local_time.dt.strftime("%Y-%m-%d %H"), 
-                date = lambda x: x.local_time.dt.strftime("%Y-%m-%d")).
-            drop(columns = ["local_time"]).
+            [["contract_name", "date", "hour"]].
             drop_duplicates().
             groupby(["contract_name", "date"]).
             agg("count")
-            ["date_hour"].
+            ["hour"].
             reset_index().
-            query("date_hour != 20 & date > @first_date"))
+            query("hour != 20 & date > @first_date"))
         
         if len(bad_data) == 0: 
             if self.verbose == True: print("Data has correct hours per day")
@@ -78,10 +65,18 @@ class DateGenerator:
             end_date: dt.datetime = dt.datetime(year = dt.date.today().year, month = 1, day = 1), 
             # default first of current year
             year_lookback: int = 10,
+            chunk: str = None,
+            n_jobs: int = 1,
+            hive_copy: bool = False,
+            row_group_size: int = ParquetDataset.ROW_GROUP_SIZE,
+            compression: str = "snappy",
+            seed: int = 1234,
+            data_path: str = None,
             verbose: bool = True):
         
-        self.seed = 1234
-        np.random.seed(self.seed)
+        # holidays are drawn from the seed
+        if type(seed) != int: raise TypeError("seed must be type int")
+        self.seed = seed
         
         self.verbose = verbose
         
@@ -111,6 +106,25 @@ class DateGenerator:
         if type(year_lookback) != int: raise TypeError("year_lookback must be type int")
         if year_lookback < 2: raise ValueError("year_lookback must be greater than a year")
         
+        if chunk not in [None, "year", "quarter"]: raise ValueError("chunk must be None, 'year' or 'quarter'")
+        self.chunk = chunk
+        
+        # number of worker processes to build zones in, -1 uses every core
+        if type(n_jobs) != int: raise TypeError("n_jobs must be type int")
+        if n_jobs == 0 or n_jobs < -1: raise ValueError("n_jobs must be positive or -1")
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        
+        # also write data/date_hive partitioned by zone, contract_name and local year
+        self.hive_copy = hive_copy
+        
+        # row group size and codec of every parquet file written
+        ParquetDataset.check_write_options(row_group_size, compression)
+        self.row_group_size, self.compression = row_group_size, compression
+        
+        # data is written to data_path, by default ../data from the working directory
+        self.parent_path = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
+        self.data_path = os.path.join(self.parent_path, "data") if data_path == None else os.path.abspath(data_path)
+        
         self.end_date = end_date
         self.start_date = dt.datetime(
             year = self.end_date.year - year_lookback, 
@@ -124,10 +138,6 @@ class DateGenerator:
                 self.start_date,
                 self.end_date))
         
-        self.dates = [
-            self.start_date + dt.timedelta(minutes=x) for x in range(
-                0, int((self.end_date - self.start_date).total_seconds() / 60) + 1, 5)]
-        
         # define contract names
         self.contract_names = []
         for country in self.country_contract.keys():
@@ -137,115 +147,127 @@ class DateGenerator:
                 contract_name = "{}{}".format(country, i+1)
                 self.contract_names.append(contract_name)
                 
-        translation_table = str.maketrans('', '', string.digits)
-                
-        if self.verbose == True: print("Standardizing Time to NYC")
-        
-        # initilizing longer data with datetimes
-        self.df_time = (pd.DataFrame(
-            columns = self.contract_names,
-            index = self.dates).
-            reset_index().
-            melt(id_vars = "index", var_name = "contract_name").
-            drop(columns = ["value"]).
-            rename(columns = {"index": "utc_time"}).
-            assign(
-                zone = lambda x: x.contract_name.str.translate(translation_table),
-                utc_time = lambda x: x.utc_time.dt.tz_localize("UTC"),
-                nyc_time = lambda x: x.utc_time.dt.tz_convert("America/New_York").dt.strftime("%Y-%m-%d %H:%M")).
-            groupby(["contract_name", "nyc_time"]).
-            head(1))
-        
-        if self.verbose == True: print("Adding Time Zone changes")
-        
-        # making dataframe of timezones with daylight savings to merge
-        # unfortunately when using tz_convert it makes a type specific to zone so the melt changes it to class object
-        # instead coerce datetimes to string and then coerce back to datetimes when joined
-        self.df_timezones_add = (pd.DataFrame({
-            "utc_time": self.df_time.utc_time.drop_duplicates().sort_values().to_list()}).
-            assign(
-                NYC = lambda x: x.utc_time.dt.tz_convert("America/New_York").dt.strftime("%Y-%m-%d %H:%M"),
-                Chicago = lambda x: x.utc_time.dt.tz_convert("America/Chicago").dt.strftime("%Y-%m-%d %H:%M"),
-                London = lambda x: x.utc_time.dt.tz_convert("Europe/London").dt.strftime("%Y-%m-%d %H:%M"),
-                Tokyo = lambda x: x.utc_time.dt.tz_convert("Asia/Tokyo").dt.strftime("%Y-%m-%d %H:%M"),
-                Frankfurt = lambda x: x.utc_time.dt.tz_convert("Europe/Berlin").dt.strftime("%Y-%m-%d %H:%M")).
-            melt(id_vars = "utc_time", var_name = "zone", value_name = "local_time"))
-        
         # tz_convert will occassionaly bring in some date times from previous years when switching UTC to a
         # specific datetime
-        min_year = self.start_date.year
-        max_year = self.end_date.year
-        
-        # merge time zones to get local times check for weekends and add in holidays
-        self.df_date_combined = (self.df_time.merge(
-            right = self.df_timezones_add, how = "inner", on = ["utc_time", "zone"]).
-            drop(columns = ["utc_time"]).
-            assign(
-                nyc_time = lambda x: pd.to_datetime(x.nyc_time),
-                local_time = lambda x: pd.to_datetime(x.local_time),
-                weekday = lambda x: x.local_time.dt.weekday,
-                date = lambda x: pd.to_datetime(x.local_time.dt.strftime("%Y-%m-%d")),
-                year = lambda x: x.date.dt.year).
-            query("year >= @min_year & year < @max_year").
-            drop(columns = ["year"])) 
-        
-        if self.verbose == True: print("Adding Holidays")
-        
-        # create mask-like dataframe to join back with holiday and open market days
-        self.df_holiday = (self.df_date_combined[
-            ["zone", "date"]].
-            drop_duplicates().
-            assign(
-                year = lambda x: x.date.dt.year,
-                weekday = lambda x: x.date.dt.weekday).
-            query("weekday != [5,6]").
-            groupby(["zone", "year"]).
-            apply(self._gen_rand_holidays).
-            reset_index(drop = True).
-            sort_values("date").
-            drop(columns = ["year"]))
-        
-        # join back holidays on date and fillna with closed since its a weekend
-        self.df_open = (self.df_date_combined.merge(
-            right = self.df_holiday,
-            how = "outer", 
-            on = ["date", "weekday", "zone"]).
-            assign(
-                market_day = lambda x: x.market_day.fillna("closed"),
-                hour = lambda x: x.local_time.dt.hour))
-        
-        if self.verbose == True: print("Adding Market Hours")
-        
-        # put market hours in 
-        # preferably use assign but since _ror is not accepted with np.where
-        # slice dataframe by hour and concat
-        closed_hours = [17, 18, 19, 20]
-        
-        # we can get our specific market hours
-        self.df_hour_open = (self.df_open.query(
-            "market_day == 'open' & hour != @closed_hours").
-            assign(market_hour = "open"))
-        
-        # then join then back to the original data and fillna as closed
-        self.df_market = (self.df_open.merge(
-            right = self.df_hour_open,
-            how = "outer",
-            on = self.df_open.columns.to_list()).
-            assign(market_hour = lambda x: x.market_hour.fillna("closed")))
+        self.min_year = self.start_date.year
+        self.max_year = self.end_date.year
+        
+        # when chunking nothing is generated until save_data which then generates and writes
+        # one chunk at a time so only a single chunk is held in memory
+        if self.chunk != None: return
+        
+        self.df_market, self.df_holiday = self._get_market(self.min_year, self.max_year)
         
         self._check_days_count()
         self._check_hours_count()
         
-    def save_data(self):
+    # local times and holidays of each zone for local years [min_year, max_year), which every quarter 
+    # of those years is cut from, each zone in its own process when n_jobs > 1
+    def _get_zone_years(self, min_year: int, max_year: int) -> dict:
         
-        self.parent_path = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-        self.data_path = os.path.join(self.parent_path, "data")
+        jobs = [
+            (zone, self.start_date, self.end_date, min_year, max_year, self.seed) 
+            for zone in self.country_contract.keys()]
+        
+        if self.n_jobs == 1: 
+            zone_results = [CalendarEngine.zone_years(*job) for job in jobs]
+            
+        else:
+            
+            with ProcessPoolExecutor(max_workers = min(self.n_jobs, len(jobs))) as pool:
+                zone_results = list(pool.map(CalendarEngine.zone_years, *zip(*jobs)))
+                
+        return dict(zip(self.country_contract.keys(), zone_results))
+    
+    # builds df_market and the holiday table for local years [min_year, max_year), optionally only 
+    # one local quarter, each zone is built separately and in its own process when n_jobs > 1.
+    # zone_years from _get_zone_years skips rebuilding the years and only cuts out the quarter
+    def _get_market(self, min_year: int, max_year: int, quarter: int = None, zone_years: dict = None) -> tuple:
+        
+        if self.verbose == True: print("Building calendar for {} zones".format(len(self.country_contract)))
+        
+        jobs = [
+            (zone, ["{}{}".format(zone, i+1) for i in range(count)], self.start_date, self.end_date, 
+             min_year, max_year, self.seed, quarter)
+            for zone, count in self.country_contract.items()]
+        
+        if zone_years != None:
+            zone_results = [CalendarEngine.zone_frames(job[0], job[1], zone_years[job[0]], quarter) for job in jobs]
+        
+        elif self.n_jobs == 1: 
+            zone_results = [CalendarEngine.build_zone(*job) for job in jobs]
+            
+        else:
+            
+            with ProcessPoolExecutor(max_workers = min(self.n_jobs, len(jobs))) as pool:
+                zone_results = list(pool.map(CalendarEngine.build_zone, *zip(*jobs)))
+        
+        # results come back in zone order regardless of which worker finished first
+        df_market = pd.concat([df_zone for df_zone, df_zone_holiday in zone_results]).reset_index(drop = True)
+        df_holiday = pd.concat([df_zone_holiday for df_zone, df_zone_holiday in zone_results]).reset_index(drop = True)
+        
+        return df_market, df_holiday
+    
+    # generates and writes the calendar one year or quarter at a time to data/date
+    def _save_chunks(self):
+        
+        ParquetDataset.clear(self.dataset_out)
+        ParquetDataset.clear(self.hive_out)
+        quarters = [None] if self.chunk == "year" else [1, 2, 3, 4]
+        
+        for year in range(self.min_year, self.max_year):
+            
+            # the year's local times and holidays are built once and each quarter is cut from them
+            zone_years = self._get_zone_years(year, year + 1) if self.chunk == "quarter" else None
+            
+            for quarter in quarters:
+                
+                if self.verbose == True: print("Writing", year if quarter == None else "{} Q{}".format(year, quarter))
+                
+                self.df_market, df_holiday = self._get_market(year, year + 1, quarter, zone_years)
+                if len(self.df_market) == 0: continue
+                
+                if quarter == None: self._check_days_count()
+                self._check_hours_count()
+                df_out = DataSchema.compact(self.df_market)
+                ParquetDataset.write_chunk(df_out, self.dataset_out, row_group_size = self.row_group_size, compression = self.compression)
+                
+                if self.hive_copy == True: 
+                    
+                    ParquetDataset.write_hive(
+                        df_out, self.hive_out, ParquetDataset.hive_part((year, 1 if quarter == None else quarter)), 
+                        row_group_size = self.row_group_size, compression = self.compression)
+        
+    def save_data(self):
         
         if os.path.exists(self.data_path) == False: os.makedirs(self.data_path)
+        self.hive_out = os.path.join(self.data_path, "date_hive")
+        
+        if self.chunk != None:
+            
+            self.dataset_out = os.path.join(self.data_path, "date")
+            self._save_chunks()
+            if self.verbose == True: print("Dataset Written to", self.dataset_out)
+            if self.hive_copy == True and self.verbose == True: print("Hive copy Written to", self.hive_out)
+            return
+        
         self.file_out = os.path.join(self.data_path, "date.parquet")
-        self.df_market.to_parquet(path = self.file_out, engine = "pyarrow")
+        df_out = DataSchema.compact(self.df_market)
+        df_out.to_parquet(
+            path = self.file_out, 
+            engine = "pyarrow", 
+            compression = self.compression, 
+            row_group_size = self.row_group_size)
         
         if self.verbose == True: print("File Written to", self.file_out)
+        
+        # a stale copy of an older run is wiped either way
+        ParquetDataset.clear(self.hive_out)
+        
+        if self.hive_copy == True:
+            
+            ParquetDataset.write_hive(df_out, self.hive_out, row_group_size = self.row_group_size, compression = self.compression)
+            if self.verbose == True: print("Hive copy Written to", self.hive_out)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Dec  7 10:14:02 2023
+
+@author: Diego
+"""
+
+# executor MarketStats fans independent work out through. Contracts (or hour windows) are split
+# into n_jobs contiguous chunks which are mapped serially, on a thread pool or on a process pool,
+# and results come back in chunk order so concatenating them is deterministic. Threads suit the
+# numpy kernels since they release the GIL, processes pickle each chunk over to the workers
+#
+#   MarketStats(file_path, backend = "process", n_jobs = 4)
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+BACKENDS = ["serial", "thread", "process"]
+
+class Executor:
+
+    # n_jobs = -1 uses every core, the serial backend always runs one job
+    def __init__(self, backend: str = "serial", n_jobs: int = 1):
+
+        if backend not in BACKENDS: raise ValueError("backend must be 'serial', 'thread' or 'process'")
+        if n_jobs == -1: n_jobs = os.cpu_count()
+        if n_jobs < 1: raise ValueError("n_jobs must be at least 1 or -1 for every core")
+
+        self.backend = backend
+        self.n_jobs = 1 if backend == "serial" else n_jobs
+
+    # items split into at most n_jobs contiguous chunks, none of them empty
+    def chunks(self, items: list) -> list:
+
+        splits = np.array_split(np.arange(len(items)), min(self.n_jobs, max(len(items), 1)))
+        return [[items[i] for i in split] for split in splits if len(split) > 0]
+
+    # func over the iterables like map, results are in the same order as the arguments
+    def map(self, func, *iterables) -> list:
+
+        if self.n_jobs == 1: return list(map(func, *iterables))
+
+        pool = ThreadPoolExecutor if self.backend == "thread" else ProcessPoolExecutor
+        with pool(max_workers = self.n_jobs) as executor:
+            return list(executor.map(func, *iterables))
@@ -1,98 +1,755 @@
+import inspect
+import hashlib
+import datetime as dt
+import functools
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import matplotlib.pyplot as plt
 
-class MarketStats:
+import DataSchema
+import Executor
+import PriceStore
+import StatsCache
+import WindowReturns
+
+# lists of windows and the like are keyed as tuples so they can be looked up
+def _freeze(value):
+    return tuple(_freeze(item) for item in value) if isinstance(value, (list, tuple)) else value
+
+# runs a MarketStats kernel (a method that only uses its arguments) on one chunk of frames, it is 
+# module level and runs on a bare object so a process pool doesn't pickle the caller and its df_price
+def _run_kernel(kernel: str, frames: list, args: tuple = ()):
+    return getattr(MarketStats.__new__(MarketStats), kernel)(*frames, *args)
+
+# caches what a get_* method saves by the arguments it was called with, calling it again with the
+# same arguments puts the cached attributes back rather than recomputing them. With a disk cache
+# the results are also looked up in and written to it
+def cached_result(method):
+
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        key = (method.__name__, tuple((name, _freeze(value)) for name, value in list(arguments.arguments.items())[1:]))
+
+        if key not in self._results:
+
+            results = None if self.cache == None else self.cache.load(self._source, *key)
+            if results == None:
+
+                self._require(self.COLUMNS[method.__name__])
+                method(self, *args, **kwargs)
+                results = {attr: self.__dict__[attr] for attr in self.OUTPUTS[method.__name__]}
+                if self.cache != None: self.cache.save(self._source, *key, results)
+
+            self._results[key] = results
 
-    def __init__(self, file_path: str, verbose: str = False): 
+        self.__dict__.update(self._results[key])
 
-        self.df_price = pd.read_parquet(path = file_path, engine = "pyarrow")
+    return wrapper
+
+class MarketStats:
+
+    # attributes each get_* method saves and the derived tables it reads, used to build a table on
+    # first access and to find what goes stale when a table is invalidated
+    OUTPUTS = {
+        "get_roll_adjusted_close": ["df_roll_adj", "df_roll_state"],
+        "get_volume_stats": ["daily_vol", "daily_vol_totals", "daily_avg_vol"],
+        "get_avg_intraday_nyc_rtn": ["nyc_intraday_hour1", "nyc_intraday_hour2", "intraday_rtn", "intraday_rtn_totals", "avg_intraday_rtn"],
+        "get_intraday_window_rtn": ["intraday_window_rtn", "intraday_window_rtn_totals", "avg_intraday_window_rtn"],
+        "get_roll_adjusted_prices": ["df_prices_adj"],
+        "get_intraday_price_range": ["df_intraday_range", "df_intraday_range_totals", "df_intraday_range_avg"],
+        "build_rollups": ["df_rollup_15min", "df_rollup_1h", "df_rollup_session", "df_rollup_1d", "df_rollup_1w"],
+        "resample_bars": ["df_bars"],
+        "resample_bars_daily": ["daily_price"],
+        "get_daily_true_range": ["df_daily_true_range", "df_daily_true_range_totals", "df_daily_true_range_avg"],
+        "get_intraday_total_nyc_return": [
+            "nyc_intraday_total_hour1", "nyc_intraday_total_hour2", "intraday_total_return", "intraday_total_return_totals", 
+            "intraday_avg_total_return"],
+        "sweep_intraday_total_nyc_return": ["intraday_total_return_sweep", "intraday_total_return_sweep_totals", "intraday_avg_total_return_sweep"]}
+
+    INPUTS = {
+        "get_roll_adjusted_close": [],
+        "get_volume_stats": [],
+        "get_avg_intraday_nyc_rtn": ["df_roll_adj"],
+        "get_intraday_window_rtn": ["df_roll_adj"],
+        "get_roll_adjusted_prices": ["df_roll_adj"],
+        "get_intraday_price_range": ["df_prices_adj"],
+        "build_rollups": ["df_roll_adj"],
+        "resample_bars": ["df_roll_adj", "df_rollup_15min", "df_rollup_1h", "df_rollup_session", "df_rollup_1d", "df_rollup_1w"],
+        "resample_bars_daily": ["df_rollup_1d"],
+        "get_daily_true_range": ["daily_price"],
+        "get_intraday_total_nyc_return": ["df_roll_adj"],
+        "sweep_intraday_total_nyc_return": ["df_roll_adj"]}
+
+    # df_price columns each get_* method reads on top of contract_name and local_time which are 
+    # always loaded, when the constructor is given columns anything else is read on first use
+    BASE_COLUMNS = ["contract_name", "local_time"]
+    COLUMNS = {
+        "get_roll_adjusted_close": ["close_price", "contract", "market_hour"],
+        "get_volume_stats": ["buy_vol", "sell_vol", "market_hour"],
+        "get_avg_intraday_nyc_rtn": [],
+        "get_intraday_window_rtn": [],
+        "get_roll_adjusted_prices": ["open_price", "high_price", "low_price", "close_price"],
+        "get_intraday_price_range": ["market_hour"],
+        "build_rollups": ["open_price", "high_price", "low_price", "close_price", "buy_vol", "sell_vol", "market_hour"],
+        "resample_bars": [],
+        "resample_bars_daily": [],
+        "get_daily_true_range": [],
+        "get_intraday_total_nyc_return": [],
+        "sweep_intraday_total_nyc_return": []}
+
+    # method bringing each get_* method's tables up to date with appended bars, see update
+    UPDATES = {
+        "get_roll_adjusted_close": "_update_roll_adjusted_close",
+        "get_volume_stats": "_update_volume_stats",
+        "get_avg_intraday_nyc_rtn": "_update_avg_intraday_nyc_rtn",
+        "get_intraday_window_rtn": "_update_intraday_window_rtn",
+        "get_roll_adjusted_prices": "_update_roll_adjusted_prices",
+        "get_intraday_price_range": "_update_intraday_price_range",
+        "build_rollups": "_update_rollups",
+        "resample_bars": "_update_bars",
+        "resample_bars_daily": "_update_bars_daily",
+        "get_daily_true_range": "_update_daily_true_range",
+        "get_intraday_total_nyc_return": "_update_intraday_total_nyc_return",
+        "sweep_intraday_total_nyc_return": "_update_sweep_intraday_total_nyc_return"}
+
+    # groups the averages are taken over, the *_totals attributes hold their sums and counts
+    WINDOW_KEYS = ["nyc_hour1", "nyc_hour2", "contract_name"]
+    ROLL_KEYS = ["contract_name", "roll"]
+
+    NYC_COLUMNS = ["nyc_time", "market_hour", "local_time"]
+    ROLL_COLUMNS = ["contract_name", "local_time", "close_price", "contract", "market_hour"]
+    VOLUME_COLUMNS = ["contract_name", "local_time", "buy_vol", "sell_vol", "market_hour"]
+    DAY_NS = pd.Timedelta(days = 1).value
+
+    # clocks bars can be resampled on and the df_price column holding each one's time
+    BAR_CLOCKS = {"local": "local_time", "nyc": "nyc_time"}
+    BAR_FIELDS = ["open_price", "high_price", "low_price", "close_price"]
+    VOLUME_FIELDS = ["buy_vol", "sell_vol"]
+    BAR_REDUCTIONS = {
+        "open_price": "first",
+        "high_price": "max",
+        "low_price": "min",
+        "close_price": "last",
+        "buy_vol": "sum",
+        "sell_vol": "sum"}
+
+    # rollups build_rollups keeps from finest to coarsest and the attribute each is saved as, bars 
+    # of other sizes are built from the coarsest one that fits inside them. Weeks start on Monday 
+    # (1970-01-05 is the first Monday after the epoch)
+    ROLLUPS = {
+        "15min": "df_rollup_15min",
+        "1h": "df_rollup_1h",
+        "session": "df_rollup_session",
+        "1d": "df_rollup_1d",
+        "1w": "df_rollup_1w"}
+
+    WEEK_ORIGIN = pd.Timedelta(days = 4)
+
+    # every df_price column the methods need including the methods building the tables they read,
+    # e.g. MarketStats(file_path, columns = MarketStats.columns_for("get_volume_stats"))
+    @classmethod
+    def columns_for(cls, *methods: str) -> list:
+
+        columns, pending = [], list(methods)
+        while len(pending) != 0:
+
+            method = pending.pop()
+            if method not in cls.COLUMNS: raise ValueError("{} is not a get_* method".format(method))
+
+            columns += cls.COLUMNS[method]
+            pending += [
+                upstream for table in cls.INPUTS[method]
+                for upstream, outputs in cls.OUTPUTS.items() if table in outputs]
+
+        return list(dict.fromkeys(cls.BASE_COLUMNS + columns))
+
+    # columns, contracts, start / end (local time, end exclusive) and market_hour_only are pushed 
+    # down into the parquet reader so skipped row groups and columns are never read. columns = None 
+    # reads every column, otherwise only those and the columns each method needs as it is called
+    def __init__(
+            self, 
+            file_path: str, 
+            verbose: str = False, 
+            cache_dir: str = None, 
+            cache_size_mb: float = 1_024,
+            columns: list = None,
+            contracts: list = None,
+            start = None,
+            end = None,
+            market_hour_only: bool = False,
+            backend: str = "serial",
+            n_jobs: int = 1): 
+
+        # results of get_* calls keyed by (method, arguments)
+        self._results = {}
+
+        # bars added with update, every column of the source and only the constructor's row filters
+        self._appended = None
+
+        # per contract work is split into n_jobs chunks of contracts run serially or on a thread or process pool
+        self.executor = Executor.Executor(backend, n_jobs)
+
+        self.file_path = file_path
+        self.filters = {
+            "contracts": None if contracts == None else list(contracts),
+            "start": None if start == None else pd.Timestamp(start),
+            "end": None if end == None else pd.Timestamp(end),
+            "market_hour_only": market_hour_only}
+
+        # derived tables are also kept on disk when cache_dir is set, entries are keyed by the 
+        # source file's fingerprint and the filters so they go stale as soon as the file is rewritten
+        self.cache = None if cache_dir == None else StatsCache.StatsCache(cache_dir, cache_size_mb)
+        self._source = None if cache_dir == None else {
+            "fingerprint": StatsCache.fingerprint(file_path),
+            "filters": {key: None if value is None else str(value) for key, value in self.filters.items()}}
+
+        # an Arrow copy (prices.arrow) is memory mapped and read as zero copy per contract slices
+        self.store = PriceStore.PriceStore(file_path) if PriceStore.is_arrow_path(file_path) == True else None
+
+        self.df_price = self._read(
+            None if columns == None else list(dict.fromkeys(self.BASE_COLUMNS + list(columns))),
+            self.filters["contracts"])
+        
         self.contracts = self.df_price.contract_name.drop_duplicates().to_list()
         self.min_date = self.df_price.local_time.min().date()
         self.max_date = self.df_price.local_time.max().date()
         self.verbose = verbose
 
-    def _zero_out_roll(self, df: pd.DataFrame) -> pd.DataFrame:
-        
-        df_first = (df.query(
-            "local_time == local_time.min()").
-            assign(roll_adj = 0))
-        
-        df_other = (df.query(
-            "local_time != local_time.min()").
-            assign(roll_adj = lambda x: x.roll_unadj))
-        
-        df_combined = pd.concat([df_first, df_other])
-        return df_combined
-    
-    def _get_first(self, df: pd.DataFrame) -> pd.DataFrame: 
-        return(df.query("local_time == local_time.min()"))
+    # filter expression for the constructor's row filters, optionally for one zone rather than the contracts
+    def _row_filter(self, contracts: list = None, zone: str = None):
 
-    def _get_roll_adjusted_close(self, df: pd.DataFrame) -> pd.DataFrame:
+        conditions = []
+        if contracts != None: conditions.append(ds.field("contract_name").isin(contracts))
+        if zone != None: conditions.append(ds.field("zone") == zone)
 
-        df_rtn_hour = (df[
-            ["contract_name", "local_time", "close_price"]].
-            pivot(index = "local_time", columns = "contract_name", values = "close_price").
-            pct_change().
-            reset_index().
-            melt(id_vars = "local_time", value_name = "roll_unadj").
-            fillna(0).
-            merge(
-                right = df[["contract_name", "local_time", "contract", "market_hour"]],
-                how = "inner",
-                on = ["contract_name", "local_time"]))
-
-        df_rtn_open = df_rtn_hour.query("market_hour == 'open'")
-        df_rtn_close = df_rtn_hour.query("market_hour == 'close'")
-
-        df_open_roll_adj = (df_rtn_open.groupby(
-            "contract").
-            apply(self._zero_out_roll).
-            reset_index(drop = True))
+        if self.filters["start"] != None:
+            conditions.append(ds.field("local_time") >= pa.scalar(self.filters["start"], type = pa.timestamp("ns")))
 
-        df_out = pd.concat([df_rtn_close, df_open_roll_adj])
+        if self.filters["end"] != None:
+            conditions.append(ds.field("local_time") < pa.scalar(self.filters["end"], type = pa.timestamp("ns")))
 
-        df_wider = (df_open_roll_adj[
-            ["local_time", "contract_name", "roll_unadj", "roll_adj"]].
-            melt(id_vars = ["local_time", "contract_name"]).
-            assign(contract = lambda x: x.contract_name + "_" + x.variable).
-            drop(columns = ["contract_name", "variable"]).
-            pivot(index = "local_time", columns = "contract", values = "value"))
+        if self.filters["market_hour_only"] == True: conditions.append(ds.field("market_hour") == "open")
 
-        df_cum_longer = (np.cumprod(
-            1 + df_wider).
-            reset_index().
-            melt(id_vars = "local_time").
-            assign(
-                contract_name = lambda x: x.contract.str.split("_").str[0],
-                roll = lambda x: x.contract.str.split("_").str[-1]).
-            drop(columns = ["contract"]))
-
-        df_start_prices = (self.df_price[
-            ["contract_name", "local_time", "close_price"]].
-            groupby("contract_name").
-            apply(self._get_first).
-            reset_index(drop = True).
-            drop(columns = ["local_time"]))
-
-        df_roll_adj = (df_cum_longer.merge(
-            right = df_start_prices, how = "inner", on = ["contract_name"]).
-            assign(price = lambda x: x.close_price * x.value).
-            drop(columns = ["value", "close_price"]).
-            pivot(index = ["local_time", "contract_name"], columns = "roll", values = "price").
-            reset_index())
+        if len(conditions) == 0: return None
+        return functools.reduce(lambda left, right: left & right, conditions)
+
+    # the memory mapped store selects contracts and zones as slices and only filters the rest
+    # bars added with update come after the file's
+    def _read(self, columns: list, contracts: list = None, zone: str = None) -> pd.DataFrame:
+
+        if self.store != None: df = self.store.read(columns, contracts, zone, self._row_filter())
+        else: df = pd.read_parquet(path = self.file_path, engine = "pyarrow", columns = columns, filters = self._row_filter(contracts, zone))
+
+        if self._appended is None: return df
+
+        df_new = self._appended[self._row_mask(self._appended, contracts, zone)]
+        return self._concat_rows(df, df_new if columns == None else df_new[columns])
+
+    # columns of the source file, not counting a stored pandas index
+    def _source_columns(self) -> list:
+
+        schema = self.store.table.schema if self.store != None else ds.dataset(self.file_path, format = "parquet", partitioning = "hive").schema
+        index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+        return [name for name in schema.names if name not in index_columns]
+
+    # the constructor's row filters as a mask over a frame, for rows that don't come from the file
+    def _row_mask(self, df: pd.DataFrame, contracts: list = None, zone: str = None) -> np.ndarray:
+
+        mask = np.ones(len(df), dtype = bool)
+        if contracts != None: mask &= df.contract_name.isin(contracts).values
+        if zone != None: mask &= (df.zone == zone).values
+        if self.filters["start"] != None: mask &= (df.local_time >= self.filters["start"]).values
+        if self.filters["end"] != None: mask &= (df.local_time < self.filters["end"]).values
+        if self.filters["market_hour_only"] == True: mask &= DataSchema.is_open(df.market_hour)
+
+        return mask
+
+    # rows of df followed by those of df_new in df's columns, categoricals take on any new categories
+    def _concat_rows(self, df: pd.DataFrame, df_new: pd.DataFrame) -> pd.DataFrame:
+
+        df_new = df_new[df.columns]
+        df_out = pd.concat([df, df_new], ignore_index = True)
+
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and isinstance(df_out[col].dtype, pd.CategoricalDtype) == False:
+                df_out[col] = pd.api.types.union_categoricals([df[col], df_new[col].astype("category")])
+
+        return df_out
+
+    # reads whichever of the columns df_price doesn't have yet, the same filters give the same rows
+    # in the same order so they line up with what is already loaded
+    def _require(self, columns: list):
+
+        missing = [col for col in dict.fromkeys(columns) if col not in self.df_price.columns]
+        if len(missing) == 0: return
+
+        if self.verbose == True: print("Reading columns", missing)
+        df_missing = self._read(missing, self.filters["contracts"])
+        self.df_price = pd.concat([self.df_price, df_missing], axis = 1)
+
+    # NYC rows map local time to NYC time for the intraday NYC return methods, when contracts are 
+    # filtered the NYC rows are read on their own so they don't depend on which contracts are loaded.
+    # since keeps the rows from then on
+    def _nyc_rows(self, since: pd.Timestamp = None) -> pd.DataFrame:
+
+        if self.filters["contracts"] != None: df = self._read(self.NYC_COLUMNS + ["zone"], zone = "NYC")
+        else:
+
+            self._require(["zone"] + self.NYC_COLUMNS)
+            df = self.df_price
+
+        if since is not None: df = df[(df.local_time >= since).values]
+        return df.query("zone == 'NYC'")[self.NYC_COLUMNS]
+
+    # get_* method that saves an attribute, None if no method does
+    def _producer(self, attr: str) -> str:
+
+        for method, outputs in self.OUTPUTS.items():
+            if attr in outputs: return method
+
+        return None
+
+    # a derived table that hasn't been built yet is built on first access with the method's default
+    # arguments, along with any tables it needs in turn
+    def __getattr__(self, name: str):
+
+        method = None if name.startswith("_") else self._producer(name)
+        if method == None: raise AttributeError("'MarketStats' object has no attribute '{}'".format(name))
+
+        if self.verbose == True: print("Building {} with {}()".format(name, method))
+        getattr(self, method)()
+        return self.__dict__[name]
+
+    # drops the cached results of the given tables or get_* methods and of everything built from
+    # them so they are rebuilt on next access, with no arguments every derived table is dropped
+    def invalidate(self, *names: str):
+
+        stale = set()
+        for name in names:
+
+            method = name if name in self.OUTPUTS else self._producer(name)
+            if method == None: raise ValueError("{} is not a derived table or get_* method".format(name))
+            stale.add(method)
+
+        if len(names) == 0: stale = set(self.OUTPUTS)
+
+        # anything reading a stale table is stale as well
+        downstream = stale
+        while len(downstream) != 0:
+
+            downstream = set(
+                method for method, inputs in self.INPUTS.items()
+                if method not in stale and any(self._producer(table) in stale for table in inputs))
+
+            stale = stale | downstream
+
+        self._results = {key: value for key, value in self._results.items() if key[0] not in stale}
+        for method in stale:
+            for attr in self.OUTPUTS[method]: self.__dict__.pop(attr, None)
+
+        if self.verbose == True: print("Invalidated", sorted(stale))
+
+    # a cutoff as a value of a time column, columns of dates are compared by day
+    def _cutoff_value(self, times: np.ndarray, cutoff: pd.Timestamp):
+        return pd.Timestamp(cutoff).date() if times.dtype == object else pd.Timestamp(cutoff).to_datetime64()
+
+    # rows of a frame at or after their contract's cutoff (or one cutoff for every contract), 
+    # contracts without one have none. Only rows from the earliest cutoff on can be since theirs 
+    # so contracts are only matched for those
+    def _since(self, df: pd.DataFrame, cutoffs, time_col: str = "local_time") -> np.ndarray:
+
+        times = df[time_col].values
+        if isinstance(cutoffs, pd.Series) == False: return times >= self._cutoff_value(times, cutoffs)
+
+        mask = np.zeros(len(times), dtype = bool)
+        if len(cutoffs) == 0: return mask
+
+        rows = np.flatnonzero(times >= self._cutoff_value(times, cutoffs.min()))
+        codes = pd.Categorical(df.contract_name.values[rows], categories = cutoffs.index).codes
+
+        if times.dtype == object: values = np.append(cutoffs.dt.date.values, dt.date.max)
+        else: values = np.append(cutoffs.values.astype("datetime64[ns]"), np.datetime64("NaT"))
+
+        mask[rows] = times[rows] >= values[codes]
+        return mask
+
+    # cutoffs floored to the start of the bar of size they fall in, e.g. their day or week
+    def _floor_cutoffs(self, cutoffs: pd.Series, size: int) -> pd.Series:
+
+        times = cutoffs.values.astype("datetime64[ns]").view(np.int64)
+        return pd.Series(self._floor(times, size).view("datetime64[ns]"), index = cutoffs.index)
+
+    # categories of a categorical column of a table and of its tail with any new in the tail after 
+    # the table's as a concat puts them, and the codes of both in them
+    def _union_codes(self, values: pd.Series, tail_values: pd.Series) -> tuple:
+
+        tail_values = pd.Categorical(tail_values)
+        categories = values.cat.categories
+        categories = categories.append(tail_values.categories[tail_values.categories.isin(categories) == False])
+
+        return categories, values.cat.codes.values, categories.get_indexer(tail_values.categories)[tail_values.codes]
+
+    # arrays a table and its recomputed rows are sorted by, the window rank first when there are 
+    # windows. Categoricals are compared by code, labels has the categories to turn codes back into values
+    def _sort_keys(self, df: pd.DataFrame, df_tail: pd.DataFrame, keys: list, windows: list = None) -> tuple:
+
+        arrays, tail_arrays, labels = [], [], []
+        if windows != None:
+
+            arrays.append(self._window_rank(df, windows))
+            tail_arrays.append(self._window_rank(df_tail, windows))
+            labels.append(None)
+
+        for key in keys:
+
+            if isinstance(df[key].dtype, pd.CategoricalDtype):
+
+                categories, codes, tail_codes = self._union_codes(df[key], df_tail[key])
+                arrays.append(codes)
+                tail_arrays.append(tail_codes)
+                labels.append(categories)
+
+            else:
+
+                arrays.append(df[key].values)
+                tail_arrays.append(np.asarray(df_tail[key].values, dtype = df[key].dtype))
+                labels.append(None)
+
+        return arrays, tail_arrays, labels
+
+    # key, start and end of every block of rows sorted by the arrays (every row of a block has the 
+    # same value in each), found by jumping from one value to the next with searchsorted so it 
+    # costs a search per block rather than a pass over the rows
+    def _blocks(self, arrays: list, row_count: int) -> list:
+
+        blocks = [((), 0, row_count)]
+        for values in arrays:
+
+            nested = []
+            for key, start, end in blocks:
+                while start < end:
+
+                    stop = start + np.searchsorted(values[start:end], values[start], side = "right")
+                    nested.append((key + (values[start],), start, stop))
+                    start = stop
+
+            blocks = nested
+
+        return blocks
+
+    # a derived table with each contract's rows from its cutoff on (or every row from one cutoff on) 
+    # replaced by the recomputed ones, along with the rows replaced. Tables are in order of the 
+    # groups in keys (e.g. contract_name), of windows first when there are windows, and by time 
+    # within a group, as the recomputed rows are. Each group of the table is a block that is cut at 
+    # its cutoff with searchsorted and the recomputed rows of the group go after what is kept, so 
+    # nothing is sorted or grouped again and blocks without new rows are taken as they are
+    def _splice(self, df: pd.DataFrame, df_tail: pd.DataFrame, cutoffs, time_col: str, keys: list, windows: list = None) -> tuple:
+
+        arrays, tail_arrays, labels = self._sort_keys(df, df_tail, keys, windows)
+        blocks = {key: (start, end) for key, start, end in self._blocks(arrays, len(df))}
+        tail_blocks = {key: (start, end) for key, start, end in self._blocks(tail_arrays, len(df_tail))}
+
+        times = df[time_col].values
+        # the level of the block keys holding the contract a cutoff is looked up by
+        level = (0 if windows == None else 1) + keys.index("contract_name") if isinstance(cutoffs, pd.Series) else None
+
+        # slices of the table (0) and the tail (1) in output order
+        segments, replaced = [], [np.arange(0)]
+        for key in sorted(set(blocks) | set(tail_blocks)):
+
+            if key in blocks:
+
+                start, end = blocks[key]
+                cutoff = cutoffs if level == None else cutoffs.get(key[level] if labels[level] is None else labels[level][key[level]])
+
+                cut = end if cutoff is None else start + np.searchsorted(times[start:end], self._cutoff_value(times, cutoff), side = "left")
+                segments.append((0, start, cut))
+                replaced.append(np.arange(cut, end))
+
+            if key in tail_blocks: segments.append((1, *tail_blocks[key]))
+
+        replaced = np.concatenate(replaced)
+        if len(df_tail) == 0 and len(replaced) == 0: return df, df.iloc[:0]
+
+        return self._join_segments(df, df_tail, segments), df.take(replaced)
+
+    # rows of a table and its tail put together from slices of each, every column is copied once
+    # from the slices of its values rather than concatenating the frames and taking from that
+    def _join_segments(self, df: pd.DataFrame, df_tail: pd.DataFrame, segments: list) -> pd.DataFrame:
+
+        columns = {}
+        for col in df.columns:
+
+            dtype = df[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+
+                categories, codes, tail_codes = self._union_codes(df[col], df_tail[col])
+                sources = [codes, tail_codes]
+
+            else: sources = [df[col].values, np.asarray(df_tail[col].values, dtype = dtype)]
+
+            values = np.concatenate([sources[source][start:end] for source, start, end in segments])
+            columns[col] = pd.Categorical.from_codes(values, dtype = pd.CategoricalDtype(categories, dtype.ordered)) if isinstance(dtype, pd.CategoricalDtype) else values
+
+        if isinstance(df.index, pd.RangeIndex) and isinstance(df_tail.index, pd.RangeIndex): index = None
+        else:
+
+            offsets = [0, len(df)]
+            positions = np.concatenate([np.arange(start, end) + offsets[source] for source, start, end in segments])
+            index = df.index.append(df_tail.index).take(positions)
+
+        return pd.DataFrame(columns, index = index, copy = False)
+
+    # sums, non null counts and row counts of the values columns by keys. Averages are kept as these 
+    # so an update only adds in the recomputed rows and takes out the replaced ones rather than 
+    # grouping the whole table again
+    def _totals(self, df: pd.DataFrame, keys: list, values: list) -> pd.DataFrame:
+
+        grouped = df.groupby(keys, observed = True)
+        return pd.concat([
+            grouped[values].sum().add_suffix("_sum"), 
+            grouped[values].count().add_suffix("_count"), 
+            grouped.size().rename("rows")], axis = 1)
+
+    # totals with the replaced rows taken out and the recomputed ones added, groups left without 
+    # rows are dropped
+    def _update_totals(self, df_totals: pd.DataFrame, df_replaced: pd.DataFrame, df_tail: pd.DataFrame, keys: list, values: list) -> pd.DataFrame:
+
+        df_out = (df_totals.sub(
+            self._totals(df_replaced, keys, values), fill_value = 0).
+            add(self._totals(df_tail, keys, values), fill_value = 0).
+            sort_index())
+
+        return df_out[df_out.rows > 0].astype(df_totals.dtypes.to_dict())
+
+    # averages of the values columns from their totals
+    def _means(self, df_totals: pd.DataFrame, values: list) -> pd.DataFrame:
+        return pd.DataFrame({value: df_totals[value + "_sum"] / df_totals[value + "_count"] for value in values})
+
+    # appends bars that came in after the loaded ones and brings every table built so far up to date
+    # without rebuilding it. new_bars has the source file's columns and each contract's bars have to
+    # start after its last loaded bar. Roll adjusted closes carry on from each contract's last close,
+    # open contract and cumulative returns in df_roll_state, and every other table only recomputes 
+    # each contract's rows from its first new bar on (from the start of that day, week or bar when 
+    # the table is by day, week or bar, NYC days for the NYC return methods) and splices them into
+    # each table's contract (and window) blocks in place. The averages come from the *_totals sums 
+    # and counts, which only take out the replaced rows and add the new ones
+    #
+    #   stats.update(df_new_bars)
+    def update(self, new_bars: pd.DataFrame):
+
+        columns = self._source_columns()
+        missing = [col for col in columns if col not in new_bars.columns]
+        if len(missing) != 0: raise ValueError("new_bars is missing columns {}".format(missing))
+
+        df_new = new_bars.reset_index(drop = True)[columns]
+        df_new = df_new[self._row_mask(df_new)].reset_index(drop = True)
+        if len(df_new) == 0: return
+
+        df_rows = df_new[self._row_mask(df_new, self.filters["contracts"])]
+
+        cutoffs = df_rows.groupby(df_rows.contract_name.astype(str)).local_time.min()
+        last_time = self.df_price.groupby("contract_name", observed = True).local_time.max()
+        last_time.index = last_time.index.astype(str)
+
+        stale = cutoffs[cutoffs <= last_time.reindex(cutoffs.index)]
+        if len(stale) != 0: 
+            raise ValueError("new bars have to come after the loaded ones, {} goes back to {}".format(stale.index[0], stale.iloc[0]))
+
+        self._appended = df_new if self._appended is None else self._concat_rows(self._appended, df_new)
+        row_count = len(self.df_price)
+        self.df_price = self._concat_rows(self.df_price, df_rows)
+
+        self.contracts = self.df_price.contract_name.drop_duplicates().to_list()
+        self.min_date = self.df_price.local_time.min().date()
+        self.max_date = self.df_price.local_time.max().date()
+
+        # the disk cache has to tell the updated tables from the file's
+        if self._source != None:
+
+            digest = hashlib.sha256(self._source.get("appended", "").encode())
+            digest.update(pd.util.hash_pandas_object(df_new, index = False).values.tobytes())
+            self._source = dict(self._source, appended = digest.hexdigest())
+
+        # NYC rows are matched to every contract on local time so new NYC bars reach back into every 
+        # contract's days, the NYC return tables are taken again for every contract from the first 
+        # new bar of any contract
+        nyc_cutoff = df_new.local_time.min()
+
+        # each entry is put back in place, updated and collected again in the order the tables are 
+        # built in so every update reads the updated tables it depends on
+        order = list(self.OUTPUTS)
+        current = {
+            key: all(self.__dict__.get(attr) is value for attr, value in results.items()) 
+            for key, results in self._results.items()}
+
+        for key in sorted(self._results, key = lambda key: order.index(key[0])):
+
+            method = key[0]
+            if self.verbose == True: print("Updating", method)
+
+            self._require(self.COLUMNS[method])
+            self.__dict__.update(self._results[key])
+            getattr(self, self.UPDATES[method])(self.df_price.iloc[row_count:], cutoffs, nyc_cutoff, **dict(key[1]))
+            self._results[key] = {attr: self.__dict__[attr] for attr in self.OUTPUTS[method]}
+
+        for key, results in self._results.items():
+            if current.get(key, True) == True: self.__dict__.update(results)
+
+    # runs a kernel over chunks of whole contract_names through the executor, each frame is split by 
+    # contract_name and the results are concatenated in contract_name order (per key for kernels 
+    # returning a dict of frames). One chunk runs the kernel directly on the frames
+    def _map_contracts(self, kernel: str, frames: list, *args):
+
+        chunks = self.executor.chunks(list(np.sort(frames[0].contract_name.astype(str).unique())))
+        if len(chunks) <= 1: return getattr(self, kernel)(*frames, *args)
+
+        parts = [[df[df.contract_name.isin(chunk)] for df in frames] for chunk in chunks]
+        results = self.executor.map(functools.partial(_run_kernel, kernel, args = args), parts)
+
+        if isinstance(results[0], dict): 
+            return {key: pd.concat([result[key] for result in results], ignore_index = True) for key in results[0]}
+
+        return pd.concat(results, ignore_index = True)
+
+    # WindowReturns.window_returns with the windows split into chunks through the executor
+    def _window_returns(self, rows: dict, windows: list, window_type: str) -> pd.DataFrame:
+
+        chunks = self.executor.chunks(list(windows))
+        if len(chunks) <= 1: return WindowReturns.window_returns(rows, windows, window_type)
+
+        return pd.concat(
+            self.executor.map(WindowReturns.window_returns, [rows] * len(chunks), chunks, [window_type] * len(chunks)), 
+            ignore_index = True)
+
+    # cumulative product restarting at every start, each segment is a contiguous slice
+    def _segment_cumprod(self, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        
+        out = np.empty_like(values)
+        bounds = np.append(starts, len(values))
+        
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            np.multiply.accumulate(values[start:end], out = out[start:end])
+            
+        return out
+
+    # unadjusted close compounds every bar's close to close return over the open bars, adjusted 
+    # does the same but zeroes the return at each contract's first open bar (the roll) and both 
+    # start from the contract_name's first close. Done once over every contract on arrays sorted 
+    # by contract_name then local_time. df_state carries on each contract_name from the bars 
+    # before these (its first and last close, last open contract and cumulative returns), the 
+    # state after these bars comes back as df_roll_state
+    def _get_roll_adjusted_close(self, df: pd.DataFrame, df_state: pd.DataFrame = None) -> dict:
+        
+        name_codes, names = pd.factorize(df.contract_name, sort = True)
+        names = np.asarray(names, dtype = object)
+        local_time = df.local_time.values
+        order = np.lexsort((local_time, name_codes))
+        
+        name_codes, local_time = name_codes[order], local_time[order]
+        close = df.close_price.values[order]
+        contracts = df.contract.values
+        contract_codes = pd.factorize(df.contract)[0][order]
+        is_open = DataSchema.is_open(df.market_hour)[order]
+        
+        carried = (pd.DataFrame(
+            np.nan, index = names, columns = ["first_close", "last_close", "contract", "factor_adj", "factor_unadj"])
+            if df_state is None else df_state.set_index("contract_name").reindex(names))
+        
+        # close to close return of every bar, on each contract_name's first bar 0 or the return 
+        # from its last carried close
+        name_starts = np.flatnonzero(np.diff(name_codes, prepend = -1))
+        name_ends = np.append(name_starts, len(name_codes))[1:] - 1
+        start_names = name_codes[name_starts]
+        fresh = carried.last_close.isna().values[start_names]
+        
+        rtn_unadj = np.zeros(len(close), dtype = close.dtype)
+        rtn_unadj[1:] = close[1:] / close[:-1] - 1
+        rtn_unadj[name_starts[~fresh]] = close[name_starts[~fresh]] / carried.last_close.values.astype(close.dtype)[start_names[~fresh]] - 1
+        rtn_unadj[name_starts[fresh]] = 0
         
-        return df_roll_adj
+        first_close = carried.first_close.values.astype(close.dtype)
+        first_close[start_names[fresh]] = close[name_starts[fresh]]
+        
+        # only open bars are compounded, the first open bar of each contract is its roll bar
+        open_rows = np.flatnonzero(is_open)
+        open_names, open_contracts = name_codes[open_rows], contract_codes[open_rows]
+        
+        open_name_starts = np.flatnonzero(np.diff(open_names, prepend = -1))
+        open_name_ends = np.append(open_name_starts, len(open_rows))[1:] - 1
+        is_roll = np.ones(len(open_rows), dtype = bool)
+        is_roll[1:] = (open_contracts[1:] != open_contracts[:-1]) | (open_names[1:] != open_names[:-1])
+        is_roll[open_name_starts] = (
+            np.asarray(contracts.take(order[open_rows[open_name_starts]]), dtype = object) != 
+            carried.contract.values[open_names[open_name_starts]])
+        
+        rtn_open = rtn_unadj[open_rows]
+        rtn_adj = np.where(is_roll, 0, rtn_open)
+        
+        # compounding carries on from the cumulative returns so far, multiplying in the same order 
+        # as over the whole history
+        growth_adj, growth_unadj = 1 + rtn_adj, 1 + rtn_open
+        growth_adj[open_name_starts] *= np.nan_to_num(carried.factor_adj.values[open_names[open_name_starts]], nan = 1).astype(close.dtype)
+        growth_unadj[open_name_starts] *= np.nan_to_num(carried.factor_unadj.values[open_names[open_name_starts]], nan = 1).astype(close.dtype)
+        
+        factor_adj = self._segment_cumprod(growth_adj, open_name_starts)
+        factor_unadj = self._segment_cumprod(growth_unadj, open_name_starts)
+        
+        df_roll_adj = (pd.DataFrame({
+            "local_time": local_time[open_rows],
+            "contract_name": names[open_names],
+            "adj": first_close[open_names] * factor_adj,
+            "unadj": first_close[open_names] * factor_unadj}).
+            rename_axis(columns = "roll"))
+        
+        df_roll_state = pd.DataFrame({
+            "contract_name": names,
+            "first_close": first_close,
+            "last_close": carried.last_close.values.astype(close.dtype),
+            "contract": carried.contract.values.astype(object),
+            "factor_adj": carried.factor_adj.values.astype(close.dtype),
+            "factor_unadj": carried.factor_unadj.values.astype(close.dtype)})
+        
+        end_names = open_names[open_name_ends]
+        df_roll_state.loc[start_names, "last_close"] = close[name_ends]
+        df_roll_state.loc[end_names, "contract"] = np.asarray(contracts.take(order[open_rows[open_name_ends]]), dtype = object)
+        df_roll_state.loc[end_names, "factor_adj"] = factor_adj[open_name_ends]
+        df_roll_state.loc[end_names, "factor_unadj"] = factor_unadj[open_name_ends]
+        
+        return {"df_roll_adj": df_roll_adj, "df_roll_state": df_roll_state}
+
+    # the bars' closes from df_price, with the carried state of the contracts they continue
+    def _roll_adjusted_close(self, df: pd.DataFrame, df_state: pd.DataFrame = None):
+        
+        frames = [df[self.ROLL_COLUMNS]]
+        if df_state is not None: frames.append(df_state[df_state.contract_name.isin(df.contract_name.astype(str).unique())])
+        
+        return self._map_contracts("_get_roll_adjusted_close", frames)
 
+    @cached_result
     def get_roll_adjusted_close(self):
         
-        self.df_roll_adj = (self.df_price.groupby([
-            "contract_name"]).
-            apply(self._get_roll_adjusted_close).
-            reset_index(drop = True))
+        results = self._roll_adjusted_close(self.df_price)
+        self.df_roll_adj, self.df_roll_state = results["df_roll_adj"], results["df_roll_state"]
         
         if self.verbose == True: print("Roll Adjusted closed saved as attribute df_roll_adj")
 
+    def _update_roll_adjusted_close(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+        
+        results = self._roll_adjusted_close(df_new, self.df_roll_state)
+        self.df_roll_adj = self._splice(self.df_roll_adj, results["df_roll_adj"], cutoffs, "local_time", ["contract_name"])[0]
+        self.df_roll_state = (pd.concat([
+            self.df_roll_state[self.df_roll_state.contract_name.isin(cutoffs.index) == False], 
+            results["df_roll_state"]]).
+            sort_values("contract_name", ignore_index = True))
+
     def plot_roll_adjusted_close(self, figssize: tuple = (30,6)):
 
         fig, axes = plt.subplots(ncols = len(self.contracts), figsize = figssize)
@@ -126,6 +783,7 @@ class MarketStats:
             query("year == @year").
             drop(columns = ["date", "year"]))
 
+        self._require(["contract"])
         df_roll_contract_name = df_roll_year_spef.merge(
             right = self.df_price[["local_time", "contract_name", "contract"]],
             how = "inner",
@@ -174,24 +832,40 @@ class MarketStats:
         plt.tight_layout(pad = 3.5)
         plt.show()
     
-    def get_volume_stats(self):
+    # open bar volume of every contract and local date of the rows
+    def _daily_vol(self, df: pd.DataFrame) -> pd.DataFrame:
 
-        self.daily_vol = (self.df_price[
-            ["contract_name", "local_time", "buy_vol", "sell_vol", "market_hour"]].
-            query("market_hour == 'open'").
+        return (df[
+            self.VOLUME_COLUMNS].
+            loc[lambda x: DataSchema.is_open(x.market_hour)].
             assign(date = lambda x: x.local_time.dt.date).
             drop(columns = ["local_time", "market_hour"]).
-            groupby(["contract_name", "date"]).
+            groupby(["contract_name", "date"], observed = True).
             agg("sum").
             reset_index())
-        
-        self.daily_avg_vol = (self.daily_vol.drop(
-            columns = ["date"]).
-            groupby("contract_name").
-            agg("mean"))
+
+    def _daily_avg_vol(self):
+        self.daily_avg_vol = self._means(self.daily_vol_totals, self.VOLUME_FIELDS)
+
+    @cached_result
+    def get_volume_stats(self):
+
+        self.daily_vol = self._daily_vol(self.df_price)
+        self.daily_vol_totals = self._totals(self.daily_vol, ["contract_name"], self.VOLUME_FIELDS)
+        self._daily_avg_vol()
         
         if self.verbose == True: print("Daily volume saved as attribute daily_vol\naverage daily volume saved as daily_avg_vol")
         
+    # the days with new bars are summed again from all of their bars
+    def _update_volume_stats(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        days = self._floor_cutoffs(cutoffs, self.DAY_NS)
+        df_tail = self._daily_vol(self.df_price[self._since(self.df_price, days)])
+
+        self.daily_vol, df_replaced = self._splice(self.daily_vol, df_tail, days, "date", ["contract_name"])
+        self.daily_vol_totals = self._update_totals(self.daily_vol_totals, df_replaced, df_tail, ["contract_name"], self.VOLUME_FIELDS)
+        self._daily_avg_vol()
+
     def plot_daily_volume_hist(self):
 
         fig, axes = plt.subplots(ncols = len(self.contracts), nrows = 2, figsize = (30,8))
@@ -254,22 +928,26 @@ class MarketStats:
         plt.tight_layout(pad = 3)
         plt.show()
 
-    def _get_min_max_date(self, df: pd.DataFrame) -> pd.DataFrame: 
-        return(df.query(
-            "nyc_time == nyc_time.max() | nyc_time == nyc_time.min()").drop_duplicates())
+    # df_roll_adj matched to the NYC rows on local time and kept to open NYC hours as in the intraday 
+    # NYC methods, arranged by contract-day for WindowReturns. since keeps the days from then on, the 
+    # NYC rows' local time is NYC time so matched rows' NYC day is their local day
+    def _nyc_day_rows(self, prices: list, since: pd.Timestamp = None) -> dict:
 
-    def _get_rtn(self, df: pd.DataFrame) -> pd.DataFrame:
-        
-        df_out = (df.drop(
-            columns = ["date"]).
-            pivot(index = "nyc_time", columns = "contract_name", values = "adj").
-            pct_change().
-            dropna().
-            reset_index().
-            melt(id_vars = "nyc_time"))
-    
-        return(df_out)
+        df_roll_adj, df_nyc = self.df_roll_adj, self._nyc_rows(since)
+        if since is not None: df_roll_adj = df_roll_adj[(df_roll_adj.local_time >= since).values]
+
+        df = (df_roll_adj.merge(
+            right = df_nyc,
+            how = "inner",
+            on = "local_time").
+            loc[lambda x: DataSchema.is_open(x.market_hour)])
+
+        name_codes, names = pd.factorize(df.contract_name, sort = True)
+        return WindowReturns.day_rows(
+            names, name_codes, df.nyc_time.values.view(np.int64), 
+            {price: df[price].values for price in prices})
 
+    @cached_result
     def get_avg_intraday_nyc_rtn(
         self,
         nyc_hour1: int = 9,
@@ -279,35 +957,78 @@ class MarketStats:
 
         if nyc_hour1 > nyc_hour2: raise ValueError("nyc_hour1 must be less than nyc_hour2")
 
-        df_min_max = (self.df_roll_adj.merge(
-            right = self.df_price.query("zone == 'NYC'")[["nyc_time", "market_hour", "local_time"]],
-            how = "inner",
-            on = "local_time").
-            drop(columns = ["local_time"]).
-            query("market_hour == 'open'").
-            assign(
-                date = lambda x: x.nyc_time.dt.date,
-                hour = lambda x: x.nyc_time.dt.hour).
-            query("hour >= @nyc_hour1 & hour < @nyc_hour2")
-            [["date", "contract_name", "adj", "nyc_time"]].
-            groupby(["date", "contract_name"]).
-            apply(self._get_min_max_date).
-            reset_index(drop = True))
-
-        self.intraday_rtn = (df_min_max.groupby(
-            ["date", "contract_name"]).
-            apply(self._get_rtn).
-            drop(columns = ["contract_name", "nyc_time"]).
-            reset_index().
-            drop(columns = ["level_2"]))
-        
-        self.avg_intraday_rtn = (self.intraday_rtn.drop(
-            columns = ["date"]).
-            groupby("contract_name").
-            mean() * 100)
+        self.intraday_rtn = self._intraday_rtn(self._nyc_day_rows(["adj"]), nyc_hour1, nyc_hour2)
+        self.intraday_rtn_totals = self._totals(self.intraday_rtn, ["contract_name"], ["value"])
+        self._avg_intraday_rtn()
         
         if self.verbose == True: print("Intraday returns saved as attribute intraday_rtn\naverage intraday return save as attribute avg_intraday_rtn")
 
+    def _intraday_rtn(self, rows: dict, nyc_hour1: int, nyc_hour2: int) -> pd.DataFrame:
+
+        return (self._window_returns(
+            rows, [(nyc_hour1, nyc_hour2)], "range")
+            [["date", "contract_name", "adj_rtn"]].
+            rename(columns = {"adj_rtn": "value"}))
+
+    def _avg_intraday_rtn(self):
+        self.avg_intraday_rtn = self._means(self.intraday_rtn_totals, ["value"]) * 100
+
+    # NYC window returns are by contract-day so the days from each contract's NYC cutoff are taken again
+    def _update_avg_intraday_nyc_rtn(
+            self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp, nyc_hour1: int = 9, nyc_hour2: int = 12):
+
+        day = nyc_cutoff.floor("D")
+        df_tail = self._intraday_rtn(self._nyc_day_rows(["adj"], day), nyc_hour1, nyc_hour2)
+
+        self.intraday_rtn, df_replaced = self._splice(self.intraday_rtn, df_tail, day, "date", [])
+        self.intraday_rtn_totals = self._update_totals(self.intraday_rtn_totals, df_replaced, df_tail, ["contract_name"], ["value"])
+        self._avg_intraday_rtn()
+
+    # position of each row's window in windows, window tables are in the order their windows are given.
+    # The hours are columns or index levels
+    def _window_rank(self, df: pd.DataFrame, windows: list) -> np.ndarray:
+
+        rank = np.full(25 * 25, -1)
+        rank[[nyc_hour1 * 25 + nyc_hour2 for nyc_hour1, nyc_hour2 in windows]] = np.arange(len(windows))
+
+        hours = [df[col].values if col in df.columns else df.index.get_level_values(col).values for col in ["nyc_hour1", "nyc_hour2"]]
+        return rank[hours[0] * 25 + hours[1]]
+
+    # adjusted return from the first to the last open bar between nyc_hour1 and nyc_hour2 of every 
+    # contract-day for each (nyc_hour1, nyc_hour2) window, all windows in one pass. windows = None 
+    # sweeps all 300 windows of whole NYC hours
+    @cached_result
+    def get_intraday_window_rtn(self, windows: list = None):
+
+        if windows == None: windows = WindowReturns.all_windows("range")
+
+        self.intraday_window_rtn = self._window_returns(self._nyc_day_rows(["adj"]), windows, "range")
+        self.intraday_window_rtn_totals = self._totals(self.intraday_window_rtn, self.WINDOW_KEYS, ["adj_rtn"])
+        self._avg_intraday_window_rtn()
+
+        if self.verbose == True: print("Intraday window returns saved as attribute intraday_window_rtn\naverage window returns saved as attribute avg_intraday_window_rtn")
+
+    def _avg_intraday_window_rtn(self):
+
+        self.avg_intraday_window_rtn = (self._means(
+            self.intraday_window_rtn_totals, ["adj_rtn"]).
+            adj_rtn.
+            mul(100).
+            unstack("contract_name"))
+
+    def _update_intraday_window_rtn(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp, windows: list = None):
+
+        if windows == None: windows = WindowReturns.all_windows("range")
+
+        day = nyc_cutoff.floor("D")
+        df_tail = self._window_returns(self._nyc_day_rows(["adj"], day), windows, "range")
+
+        self.intraday_window_rtn, df_replaced = self._splice(self.intraday_window_rtn, df_tail, day, "date", [], windows)
+        self.intraday_window_rtn_totals = self._update_totals(
+            self.intraday_window_rtn_totals, df_replaced, df_tail, self.WINDOW_KEYS, ["adj_rtn"])
+
+        self._avg_intraday_window_rtn()
+
     def plot_avg_intraday_nyc_rtn(self):
 
         (self.avg_intraday_rtn.sort_values(
@@ -361,49 +1082,81 @@ class MarketStats:
         plt.tight_layout(pad = 3)
         plt.show()
 
-    def get_roll_adjusted_prices(self):
+    # OHLC of the df_price rows with the roll spread of the matching df_roll_adj rows added on, one 
+    # row per field of each bar in df_roll_adj's order (by contract_name then local_time) whatever 
+    # order df_price is in, so the rows of new bars go at the end of their contract's
+    def _prices_adj(self, df: pd.DataFrame, df_roll_adj: pd.DataFrame) -> pd.DataFrame:
 
-        df_spread = (self.df_roll_adj.assign(
+        df_bars = (df_roll_adj.assign(
             spread = lambda x: x.adj- x.unadj).
-            drop(columns = ["adj", "unadj"]))
+            drop(columns = ["adj", "unadj"]).
+            merge(right = df[["contract_name", "local_time"] + self.BAR_FIELDS], how = "inner", on = ["local_time", "contract_name"]))
+
+        prices = df_bars[self.BAR_FIELDS].values
+        return pd.DataFrame({
+            "contract_name": np.repeat(df_bars.contract_name.values, len(self.BAR_FIELDS)),
+            "local_time": np.repeat(df_bars.local_time.values, len(self.BAR_FIELDS)),
+            "field": np.tile(np.array(self.BAR_FIELDS, dtype = object), len(df_bars)),
+            "unadj": prices.ravel(),
+            "adj": (df_bars.spread.values[:, None] + prices).ravel()})
+
+    @cached_result
+    def get_roll_adjusted_prices(self):
 
-        self.df_prices_adj = (self.df_price[
-            ["contract_name", "local_time", "open_price", "high_price", "low_price", "close_price"]].
-            melt(id_vars = ["contract_name", "local_time"], var_name = "field").
-            merge(right = df_spread, how = "inner", on = ["local_time", "contract_name"]).
-            assign(adj = lambda x: x.spread + x.value).
-            drop(columns = ["spread"]).
-            rename(columns = {"value": "unadj"}))
-        
+        self.df_prices_adj = self._prices_adj(self.df_price, self.df_roll_adj)
         if self.verbose == True: print("roll adjusted prices saved as attribute df_prices_adj")
+
+    def _update_roll_adjusted_prices(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        df_tail = self._prices_adj(df_new, self.df_roll_adj[self._since(self.df_roll_adj, cutoffs)])
+        self.df_prices_adj = self._splice(self.df_prices_adj, df_tail, cutoffs, "local_time", ["contract_name"])[0]
     
-    def get_intraday_price_range(self):
-        
-        self.df_intraday_range = (self.df_prices_adj.query(
+    # bar range (high - low) / close of the open bars for get_intraday_price_range
+    def _intraday_range(self, df_prices_adj: pd.DataFrame, df_hours: pd.DataFrame) -> pd.DataFrame:
+
+        return (df_prices_adj.query(
             "field != 'open_price'").
             melt(id_vars = ["contract_name", "local_time", "field"], var_name = "roll").
             pivot(index = ["contract_name", "local_time", "roll"], columns = ["field"], values = "value").
             reset_index().
             assign(price_range = lambda x: (x.high_price - x.low_price) / x.close_price).
             drop(columns = ["close_price", "high_price", "low_price"]).
-            merge(
-                right = self.df_price[["contract_name", "local_time", "market_hour"]], 
-                how = "inner", on = ["contract_name", "local_time"]).
-            query("market_hour == 'open'").
-            drop(columns = ["market_hour"]))
-        
-        self.df_intraday_range_avg = (self.df_intraday_range.drop(
-            columns = ["local_time"]).
-            groupby(["contract_name", "roll"]).
-            agg("mean").
+            merge(right = df_hours, how = "inner", on = ["contract_name", "local_time"]).
+            loc[lambda x: DataSchema.is_open(x.market_hour)].
+            drop(columns = ["market_hour"]).
+            reset_index(drop = True))
+
+    @cached_result
+    def get_intraday_price_range(self):
+        
+        self.df_intraday_range = self._map_contracts(
+            "_intraday_range", 
+            [self.df_prices_adj, self.df_price[["contract_name", "local_time", "market_hour"]]])
+        
+        self.df_intraday_range_totals = self._totals(self.df_intraday_range, self.ROLL_KEYS, ["price_range"])
+        self._intraday_range_avg()
+        if self.verbose == True: print("Intraday range saved as attribute df.intraday_rate\nintraday average range saved as attribute df_intraday_range_avg")
+
+    def _update_intraday_price_range(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        df_tail = self._map_contracts(
+            "_intraday_range", 
+            [self.df_prices_adj[self._since(self.df_prices_adj, cutoffs)], df_new[["contract_name", "local_time", "market_hour"]]])
+
+        self.df_intraday_range, df_replaced = self._splice(self.df_intraday_range, df_tail, cutoffs, "local_time", ["contract_name"])
+        self.df_intraday_range_totals = self._update_totals(self.df_intraday_range_totals, df_replaced, df_tail, self.ROLL_KEYS, ["price_range"])
+        self._intraday_range_avg()
+
+    def _intraday_range_avg(self):
+
+        self.df_intraday_range_avg = (self._means(
+            self.df_intraday_range_totals, ["price_range"]).
             reset_index().
             pivot(index = ["contract_name"], columns = "roll", values = "price_range").
             rename(columns = {
                 "adj": "Adjusted", 
                 "unadj": "Unadjutsted"}))
         
-        if self.verbose == True: print("Intraday range saved as attribute df.intraday_rate\nintraday average range saved as attribute df_intraday_range_avg")
-        
     def plot_intraday_price_range_avg(self):
 
         (self.df_intraday_range_avg.plot(
@@ -470,82 +1223,271 @@ class MarketStats:
         plt.tight_layout(pad = 3)
         plt.show()
 
-    def _get_first_date(self, df: pd.DataFrame) -> pd.DataFrame: 
-        return(df.query("local_time == local_time.min()"))
-    
-    def _get_last_date(self, df: pd.DataFrame) -> pd.DataFrame: 
-        return(df.query("local_time == local_time.max()"))
+    # bar size in ns, None for session bars. Sizes have to divide a day or be whole days so bars 
+    # line up with the local dates
+    def _bar_size(self, bar_size: str) -> int:
 
-    def resample_bars_daily(self):
+        if bar_size == "session": return None
 
-        df_price_adj_longer = (self.df_prices_adj.melt(
-            id_vars = ["contract_name", "local_time", "field"], var_name = "roll").
-            assign(date = lambda x: x.local_time.dt.date))
-
-        if self.verbose == True: print("Working on Open")
-        df_open = (df_price_adj_longer.query(
-            "field == 'open_price'").
-            drop(columns = ["field"]).
-            groupby(["contract_name", "roll", "date"]).
-            apply(self._get_first_date).
-            reset_index(drop = True).
-            rename(columns = {"value": "open_price"}).
-            drop(columns = ["local_time"]))
-
-        if self.verbose == True: print("Working on Close")
-        df_close = (df_price_adj_longer.query(
-            "field == 'close_price'").
-            drop(columns = ["field"]).
-            groupby(["contract_name", "roll", "date"]).
-            apply(self._get_last_date).
-            reset_index(drop = True).
-            rename(columns = {"value": "close_price"}).
-            drop(columns = ["local_time"]))
-
-        if self.verbose == True: print("Working on High")
-        df_high = (df_price_adj_longer.query(
-            "field == 'high_price'").
-            drop(columns = ["field", "local_time"]).
-            groupby(["contract_name", "roll", "date"]).
-            agg("max")
-            ["value"].
-            reset_index().
-            rename(columns = {"value": "high_price"}))
-
-        if self.verbose == True: print("Working on Low")
-        df_low = (df_price_adj_longer.query(
-            "field == 'low_price'").
-            drop(columns = ["field", "local_time"]).
-            groupby(["contract_name", "roll", "date"]).
-            agg("min")
-            ["value"].
-            reset_index().
-            rename(columns = {"value": "low_price"}))
+        size, day = pd.Timedelta(bar_size), pd.Timedelta(days = 1)
+        if size <= pd.Timedelta(0) or (day % size != pd.Timedelta(0) and size % day != pd.Timedelta(0)):
+            raise ValueError("bar_size must be 'session', divide a day or be a whole number of days")
+
+        return size.value
+
+    # start of the bar each time falls in, whole weeks start on Monday and everything else is 
+    # counted from the epoch
+    def _floor(self, times: np.ndarray, size: int) -> np.ndarray:
+
+        origin = self.WEEK_ORIGIN.value if size % pd.Timedelta(weeks = 1).value == 0 else 0
+        return (times - origin) // size * size + origin
+
+    # one value per bar from values sorted by bar, bars start at starts
+    def _reduce(self, values: np.ndarray, starts: np.ndarray, how: str) -> np.ndarray:
+
+        if how == "sum": values = values.astype(np.int64)
+        if len(starts) == 0: return values[:0]
+
+        if how == "first": return values[starts]
+        if how == "last": return values[np.append(starts[1:], len(values)) - 1]
+        if how == "max": return np.maximum.reduceat(values, starts)
+        if how == "min": return np.minimum.reduceat(values, starts)
+        return np.add.reduceat(values, starts)
+
+    # bars of rows sorted by contract_name then time, every bar is a contiguous run of rows so each
+    # column is one reduceat over the bar starts. columns maps each bar column to its row values
+    def _aggregate(self, names: np.ndarray, name_codes: np.ndarray, bar_time: np.ndarray, columns: dict) -> pd.DataFrame:
+
+        starts = np.flatnonzero(np.diff(name_codes, prepend = -1) | np.diff(bar_time, prepend = -1))
+        bars = {
+            "contract_name": names[name_codes[starts]],
+            "bar_time": bar_time[starts].view("datetime64[ns]")}
+
+        for column, values in columns.items():
+
+            field = column if column in self.BAR_REDUCTIONS else column.rsplit("_", 1)[0]
+            bars[column] = self._reduce(values, starts, self.BAR_REDUCTIONS[field])
+
+        return pd.DataFrame(bars)
+
+    # df_price rows that have a roll spread with the prices and volumes bars are reduced from, 
+    # adjusted prices are the unadjusted ones plus the roll spread as in get_roll_adjusted_prices.
+    # since keeps each contract's rows from its cutoff on the clock's time, local and NYC time are 
+    # less than a day apart
+    def _bar_source(self, clock: str, with_open: bool = False, since: pd.Series = None) -> pd.DataFrame:
+
+        time_col = self.BAR_CLOCKS[clock]
+        fields = self.BAR_FIELDS + self.VOLUME_FIELDS + (["market_hour"] if with_open == True else [])
+        self._require([time_col] + fields)
+
+        df_price, df_roll_adj = self.df_price, self.df_roll_adj
+        if since is not None:
+
+            df_price = df_price[self._since(df_price, since, time_col)]
+            df_roll_adj = df_roll_adj[self._since(df_roll_adj, since - pd.Timedelta(days = 1))]
+
+        df_price = df_price[list(dict.fromkeys(["contract_name", "local_time", time_col] + fields))]
+
+        df_spread = (df_roll_adj.assign(
+            spread = lambda x: x.adj - x.unadj).
+            drop(columns = ["adj", "unadj"]))
+
+        return df_price.merge(right = df_spread, how = "inner", on = ["local_time", "contract_name"])
+
+    # _bar_source rows sorted by contract_name then time_col as arrays, is_open is None without market_hour
+    def _bar_rows(self, df: pd.DataFrame, time_col: str) -> tuple:
 
-        self.daily_price = (df_open.merge(
-            right = df_close, how = "inner", on = ["contract_name", "roll", "date"]).
-            merge(right = df_high, how = "inner", on = ["contract_name", "roll", "date"]).
-            merge(right = df_low, how = "inner", on = ["contract_name", "roll", "date"]).
-            rename(columns = {"date": "local_date"}))
+        name_codes, names = pd.factorize(df.contract_name, sort = True)
+        times = df[time_col].values.view(np.int64)
+        order = np.lexsort((times, name_codes))
+
+        spread = df.spread.values[order]
+        columns = {}
+        for roll in ["adj", "unadj"]:
+            for field in self.BAR_FIELDS:
+
+                values = df[field].values[order]
+                columns["{}_{}".format(field, roll)] = spread + values if roll == "adj" else values
+
+        for field in self.VOLUME_FIELDS: columns[field] = df[field].values[order]
+
+        is_open = DataSchema.is_open(df.market_hour)[order] if "market_hour" in df.columns else None
+        return np.asarray(names, dtype = object), name_codes[order], times[order], columns, is_open
+
+    # bars of one size from _bar_source rows, session bars are the open bars of each local date
+    def _resample_rows(self, df: pd.DataFrame, bar_size: str, time_col: str) -> pd.DataFrame:
+
+        size = self._bar_size(bar_size)
+        names, name_codes, times, columns, is_open = self._bar_rows(df, time_col)
+
+        if size == None:
+
+            name_codes, times = name_codes[is_open], times[is_open]
+            columns = {column: values[is_open] for column, values in columns.items()}
+            size = pd.Timedelta(days = 1).value
+
+        return self._aggregate(names, name_codes, self._floor(times, size), columns)
+
+    # every rollup from _bar_source rows keyed by attribute, the rows are reduced to 15min bars once 
+    # and each coarser rollup is built from the one before it
+    def _rollup_rows(self, df: pd.DataFrame) -> dict:
+
+        names, name_codes, times, columns, is_open = self._bar_rows(df, "local_time")
+
+        rollups, df_bars = {}, None
+        for rollup in ["15min", "1h", "1d", "1w"]:
+
+            size = self._bar_size(rollup)
+            if df_bars is None: df_bars = self._aggregate(names, name_codes, self._floor(times, size), columns)
+            else: df_bars = self._from_rollup(df_bars, size)
+
+            rollups[self.ROLLUPS[rollup]] = df_bars
+
+        rollups[self.ROLLUPS["session"]] = self._aggregate(
+            names, name_codes[is_open], 
+            self._floor(times[is_open], pd.Timedelta(days = 1).value), 
+            {column: values[is_open] for column, values in columns.items()})
+
+        return rollups
+
+    # bars straight from df_price
+    def _resample(self, bar_size: str, clock: str) -> pd.DataFrame:
+
+        df = self._bar_source(clock, with_open = self._bar_size(bar_size) == None)
+        return self._map_contracts("_resample_rows", [df], bar_size, self.BAR_CLOCKS[clock])
+
+    # coarser bars from a rollup whose bars each sit inside one of them, the rollup is already sorted
+    def _from_rollup(self, df_rollup: pd.DataFrame, size: int) -> pd.DataFrame:
+
+        name_codes, names = pd.factorize(df_rollup.contract_name, sort = True)
+        columns = {column: df_rollup[column].values for column in df_rollup.columns[2:]}
+
+        return self._aggregate(
+            np.asarray(names, dtype = object), name_codes, 
+            self._floor(df_rollup.bar_time.values.view(np.int64), size), columns)
+
+    # the coarsest rollup whose bars fit inside bars of size, None when none do (e.g. 5min)
+    def _rollup_for(self, size: int) -> str:
+
+        for rollup in reversed(list(self.ROLLUPS)):
+            if rollup != "session" and size % self._bar_size(rollup) == 0: return rollup
+
+        return None
+
+    # local bars come from the coarsest rollup that fits, NYC bars and local bars no rollup fits 
+    # are built from df_price. Session bars are always on local dates
+    def _bars(self, bar_size: str, clock: str) -> pd.DataFrame:
+
+        if clock not in self.BAR_CLOCKS: raise ValueError("clock must be 'local' or 'nyc'")
+
+        size = self._bar_size(bar_size)
+        rollup = "session" if size == None else self._rollup_for(size) if clock == "local" else None
+        if rollup == None: return self._resample(bar_size, clock)
+
+        if self.verbose == True: print("Using {} rollup".format(rollup))
+        df_rollup = getattr(self, self.ROLLUPS[rollup])
+        if size == None or size == self._bar_size(rollup): return df_rollup.copy()
+
+        return self._from_rollup(df_rollup, size)
+
+    # 15min, 1h, session, 1d and 1w (Monday) local bars of every contract in one pass
+    @cached_result
+    def build_rollups(self):
+
+        rollups = self._map_contracts("_rollup_rows", [self._bar_source("local", with_open = True)])
+        for attr, df_rollup in rollups.items(): setattr(self, attr, df_rollup)
         
+        if self.verbose == True: print("Rollups saved as attributes {}".format(", ".join(self.ROLLUPS.values())))
+
+    # every rollup fits inside a week so the weeks with new bars are rolled up again
+    def _update_rollups(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        weeks = self._floor_cutoffs(cutoffs, self._bar_size("1w"))
+        rollups = self._map_contracts("_rollup_rows", [self._bar_source("local", with_open = True, since = weeks)])
+
+        for attr, df_tail in rollups.items(): 
+            setattr(self, attr, self._splice(getattr(self, attr), df_tail, weeks, "bar_time", ["contract_name"])[0])
+
+    # OHLC and volume bars of any size that divides a day or is whole days (15min, 1h, 4h, 1d, 1w ...) 
+    # or "session" on the local or NYC clock, bar_time is the start of each bar
+    @cached_result
+    def resample_bars(self, bar_size: str = "1h", clock: str = "local"):
+
+        self.df_bars = self._bars(bar_size, clock)
+        if self.verbose == True: print("{} bars ({} time) saved as attribute df_bars".format(bar_size, clock))
+
+    # the bars with new bars in them are resampled again from df_price, whichever rollup the bars 
+    # came from gives the same values
+    def _update_bars(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp, bar_size: str = "1h", clock: str = "local"):
+
+        time_col, size = self.BAR_CLOCKS[clock], self._bar_size(bar_size)
+        starts = cutoffs if clock == "local" else df_new.groupby(df_new.contract_name.astype(str)).nyc_time.min()
+        starts = self._floor_cutoffs(starts, self.DAY_NS if size == None else size)
+
+        df_tail = self._map_contracts(
+            "_resample_rows", [self._bar_source(clock, with_open = size == None, since = starts)], bar_size, time_col)
+
+        self.df_bars = self._splice(self.df_bars, df_tail, starts, "bar_time", ["contract_name"])[0]
+
+    # daily_price rows of 1d bars
+    def _daily_price(self, df_bars: pd.DataFrame) -> pd.DataFrame:
+
+        df_daily = df_bars.drop(columns = ["bar_time"])
+        df_daily.insert(1, "local_date", df_bars.bar_time.dt.date)
+        return df_daily
+
+    @cached_result
+    def resample_bars_daily(self):
+
+        self.daily_price = self._daily_price(self._bars("1d", "local"))
         if self.verbose == True: print("daily bars saved as attribute daily_price")
-        
+
+    def _update_bars_daily(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        days = self._floor_cutoffs(cutoffs, self.DAY_NS)
+        df_tail = self._daily_price(self.df_rollup_1d[self._since(self.df_rollup_1d, days, "bar_time")].reset_index(drop = True))
+        self.daily_price = self._splice(self.daily_price, df_tail, days, "local_date", ["contract_name"])[0]
+
+    # true range of daily_price rows by contract_name then roll then date
+    def _daily_true_range(self, daily_price: pd.DataFrame) -> pd.DataFrame:
+
+        df_range = daily_price[["contract_name", "local_date"]].assign(**{
+            roll: (daily_price["high_price_" + roll] - daily_price["low_price_" + roll]) / daily_price["close_price_" + roll]
+            for roll in ["adj", "unadj"]})
+
+        return (df_range.melt(
+            id_vars = ["contract_name", "local_date"], var_name = "roll", value_name = "price_range").
+            sort_values(["contract_name", "roll"], kind = "stable").
+            reset_index(drop = True)
+            [["contract_name", "roll", "local_date", "price_range"]])
+
+    @cached_result
     def get_daily_true_range(self):
         
-        self.df_daily_true_range = (self.daily_price.assign(
-            price_range = lambda x: (x.high_price - x.low_price) / x.close_price).
-            drop(columns = ["close_price", "high_price", "low_price", "open_price"]))
+        self.df_daily_true_range = self._daily_true_range(self.daily_price)
+        self.df_daily_true_range_totals = self._totals(self.df_daily_true_range, self.ROLL_KEYS, ["price_range"])
+        self._daily_true_range_avg()
         
-        self.df_daily_true_range_avg = (self.df_daily_true_range.drop(
-            columns = ["local_date"]).
-            groupby(["contract_name", "roll"]).
-            agg("mean")
-            ["price_range"].
+        if self.verbose == True: print("Daily true range saved as attribute df_daily_true_range\nDaily true average range saved as attribute df_daily_true_range_avg")
+
+    def _update_daily_true_range(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp):
+
+        days = self._floor_cutoffs(cutoffs, self.DAY_NS)
+        df_tail = self._daily_true_range(self.daily_price[self._since(self.daily_price, days, "local_date")])
+
+        self.df_daily_true_range, df_replaced = self._splice(self.df_daily_true_range, df_tail, days, "local_date", self.ROLL_KEYS)
+        self.df_daily_true_range_totals = self._update_totals(
+            self.df_daily_true_range_totals, df_replaced, df_tail, self.ROLL_KEYS, ["price_range"])
+
+        self._daily_true_range_avg()
+
+    def _daily_true_range_avg(self):
+        
+        self.df_daily_true_range_avg = (self._means(
+            self.df_daily_true_range_totals, ["price_range"]).
             reset_index().
             pivot(index = "contract_name", columns = "roll", values = "price_range"))
         
-        if self.verbose == True: print("Daily true range saved as attribute df_daily_true_range\nDaily true average range saved as attribute df_daily_true_range_avg")
-        
     def plot_daily_avg_true_range(self):
 
         (self.df_daily_true_range_avg.rename(
@@ -610,14 +1552,16 @@ class MarketStats:
         plt.tight_layout(pad = 3)
         plt.show()
 
-    def _calc_rtn(self, df: pd.DataFrame) -> pd.DataFrame:
-        return(df.query(
-            "nyc_time == nyc_time.min() | nyc_time == nyc_time.max()").
-            sort_values("nyc_time").
-            assign(rtn = lambda x: x.price.pct_change() * 100).
-            dropna().
-            drop(columns = ["nyc_time"]))
+    # WindowReturns rows as intraday_total_return rows, one per roll with the return in percent
+    def _roll_returns(self, df_rtn: pd.DataFrame, index: list = []) -> pd.DataFrame:
+
+        df_out = df_rtn.loc[np.repeat(df_rtn.index.values, 2), index + ["contract_name", "date"]].reset_index(drop = True)
+        df_out["roll"] = np.tile(["adj", "unadj"], len(df_rtn))
+        df_out["rtn"] = np.column_stack([df_rtn.adj_rtn.values, df_rtn.unadj_rtn.values]).ravel() * 100
+
+        return df_out
 
+    @cached_result
     def get_intraday_total_nyc_return(
         self,
         nyc_hour1: int = 9,
@@ -625,33 +1569,71 @@ class MarketStats:
 
         self.nyc_intraday_total_hour1, self.nyc_intraday_total_hour2 = nyc_hour1, nyc_hour2
 
-        df_min_max = (self.df_roll_adj.merge(
-            right = self.df_price.query("zone == 'NYC'")[["nyc_time", "market_hour", "local_time"]],
-            how = "inner",
-            on = "local_time").
-            drop(columns = ["local_time"]).
-            query("market_hour == 'open'").
-            assign(
-                date = lambda x: x.nyc_time.dt.date,
-                hour = lambda x: x.nyc_time.dt.hour))
-
-        self.intraday_total_return = (df_min_max.query(
-            "hour == @nyc_hour1 | hour == @nyc_hour2").
-            drop(columns = ["market_hour", "hour"]).
-            melt(id_vars = ["nyc_time", "contract_name", "date"], var_name = "roll", value_name = "price").
-            groupby(["date", "contract_name", "roll"]).
-            apply(self._calc_rtn).
-            reset_index(drop = True).
-            drop(columns = ["price"]))
-        
-        self.intraday_avg_total_return = (self.intraday_total_return.drop(
-            columns = ["date"]).
-            groupby(["contract_name", "roll"]).
-            agg("mean").
-            reset_index())
+        self.intraday_total_return = self._roll_returns(self._window_returns(
+            self._nyc_day_rows(["adj", "unadj"]), [(nyc_hour1, nyc_hour2)], "ends"))
         
+        self.intraday_total_return_totals = self._totals(self.intraday_total_return, self.ROLL_KEYS, ["rtn"])
+        self._intraday_avg_total_return()
         if self.verbose == True: print("Intraday total return as attribute intraday_total_return\nIntraday average total return saved as attribute intraday_avg_total_return")
+
+    def _intraday_avg_total_return(self):
+        self.intraday_avg_total_return = self._means(self.intraday_total_return_totals, ["rtn"]).reset_index()
+
+    def _update_intraday_total_nyc_return(
+            self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp, nyc_hour1: int = 9, nyc_hour2: int = 12):
+
+        day = nyc_cutoff.floor("D")
+        df_tail = self._roll_returns(self._window_returns(
+            self._nyc_day_rows(["adj", "unadj"], day), [(nyc_hour1, nyc_hour2)], "ends"))
+
+        self.intraday_total_return, df_replaced = self._splice(self.intraday_total_return, df_tail, day, "date", [])
+        self.intraday_total_return_totals = self._update_totals(
+            self.intraday_total_return_totals, df_replaced, df_tail, self.ROLL_KEYS, ["rtn"])
+
+        self._intraday_avg_total_return()
         
+    # get_intraday_total_nyc_return for many (nyc_hour1, nyc_hour2) windows, a list or a 
+    # WindowReturns.grid, all 576 hour pairs when windows = None. The NYC rows are matched once 
+    # and every window is taken from them in one pass (split across the executor's jobs). Results 
+    # are indexed by window
+    @cached_result
+    def sweep_intraday_total_nyc_return(self, windows: list = None):
+
+        if windows == None: windows = WindowReturns.all_windows("ends")
+
+        self.intraday_total_return_sweep = (self._roll_returns(
+            self._window_returns(self._nyc_day_rows(["adj", "unadj"]), windows, "ends"), 
+            ["nyc_hour1", "nyc_hour2"]).
+            set_index(["nyc_hour1", "nyc_hour2"]))
+
+        self.intraday_total_return_sweep_totals = self._totals(
+            self.intraday_total_return_sweep, self.WINDOW_KEYS + ["roll"], ["rtn"])
+
+        self._intraday_avg_total_return_sweep()
+        if self.verbose == True: print("Intraday total return sweep saved as attribute intraday_total_return_sweep\nIntraday average total return sweep saved as attribute intraday_avg_total_return_sweep")
+
+    def _update_sweep_intraday_total_nyc_return(self, df_new: pd.DataFrame, cutoffs: pd.Series, nyc_cutoff: pd.Timestamp, windows: list = None):
+
+        if windows == None: windows = WindowReturns.all_windows("ends")
+
+        day = nyc_cutoff.floor("D")
+        df_tail = (self._roll_returns(
+            self._window_returns(self._nyc_day_rows(["adj", "unadj"], day), windows, "ends"), 
+            ["nyc_hour1", "nyc_hour2"]).
+            set_index(["nyc_hour1", "nyc_hour2"]))
+
+        self.intraday_total_return_sweep, df_replaced = self._splice(self.intraday_total_return_sweep, df_tail, day, "date", [], windows)
+        self.intraday_total_return_sweep_totals = self._update_totals(
+            self.intraday_total_return_sweep_totals, df_replaced, df_tail, self.WINDOW_KEYS + ["roll"], ["rtn"])
+
+        self._intraday_avg_total_return_sweep()
+
+    def _intraday_avg_total_return_sweep(self):
+
+        self.intraday_avg_total_return_sweep = (self._means(
+            self.intraday_total_return_sweep_totals, ["rtn"]).
+            reset_index(["contract_name", "roll"]))
+
     def plot_avg_total_intraday_nyc_rtn(self):
         
         (self.intraday_avg_total_return.pivot(
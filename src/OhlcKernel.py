@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Dec  2 14:05:37 2023
+
+@author: Diego
+"""
+
+# OHLC kernel for PriceGenerator, turns open prices and the raw high / low / close adds
+# into OHLC prices in one pass per contract. Closed bars carry the adds of the last open
+# bar forward and only the add arrays are filled rather than every column of the frame.
+# Bars repeating a local time within a contract label (clocks going back) are flagged so
+# they can be dropped. numba is optional, when it is installed the row loop is compiled
+# and otherwise each contract is done with numpy on its slice
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ENGINES = ["numba", "numpy"]
+
+# row loop used by the numba engine, it is plain python until compiled so it is slow without numba
+def _ohlc_loop(
+        open_price: np.ndarray,
+        raw_adds: np.ndarray,
+        is_open: np.ndarray,
+        starts: np.ndarray,
+        new_label: np.ndarray,
+        local_ns: np.ndarray,
+        carried: np.ndarray) -> tuple:
+
+    row_count, group_count = len(open_price), len(starts)
+    prices = np.empty((row_count, 3))
+    keep = np.ones(row_count, dtype = np.bool_)
+    last_adds = np.empty((group_count, 3))
+
+    for group in range(group_count):
+
+        start = starts[group]
+        end = starts[group + 1] if group + 1 < group_count else row_count
+
+        first_open = -1
+        for i in range(start, end):
+            if is_open[i]:
+                first_open = i
+                break
+
+        # bars before the first open bar take the carried adds or the first open bar's adds
+        adds = carried[group].copy()
+        for col in range(3):
+            if np.isnan(adds[col]) and first_open >= 0: adds[col] = raw_adds[first_open, col]
+
+        running_max = local_ns[start]
+        for i in range(start, end):
+
+            if is_open[i]:
+                for col in range(3): adds[col] = raw_adds[i, col]
+
+            for col in range(3): prices[i, col] = open_price[i] + adds[col]
+
+            if new_label[i] or local_ns[i] > running_max:
+                running_max = local_ns[i]
+            else:
+                keep[i] = False
+
+        last_adds[group] = adds
+
+    return prices, keep, last_adds
+
+_ohlc_loop_jit = numba.njit(cache = True)(_ohlc_loop) if numba is not None else None
+
+def _ohlc_numpy(
+        open_price: np.ndarray,
+        raw_adds: np.ndarray,
+        is_open: np.ndarray,
+        starts: np.ndarray,
+        new_label: np.ndarray,
+        local_ns: np.ndarray,
+        carried: np.ndarray) -> tuple:
+
+    row_count = len(open_price)
+    prices = np.empty((row_count, 3))
+    keep = np.ones(row_count, dtype = bool)
+    last_adds = np.empty((len(starts), 3))
+    bounds = np.append(starts, row_count)
+
+    for group, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+
+        open_slice = is_open[start:end]
+        open_rows = np.flatnonzero(open_slice)
+
+        leading = carried[group].copy()
+        if len(open_rows) > 0: leading = np.where(np.isnan(leading), raw_adds[start + open_rows[0]], leading)
+
+        # index of the last open bar at or before each bar, -1 before the first one
+        last_open = np.maximum.accumulate(np.where(open_slice, np.arange(end - start), -1))
+        adds = np.where(
+            (last_open >= 0)[:, None],
+            raw_adds[start + np.maximum(last_open, 0)],
+            leading[None, :])
+
+        prices[start:end] = open_price[start:end, None] + adds
+        last_adds[group] = adds[-1] if end > start else leading
+
+        # running max of local time restarting at every new label
+        label_starts = np.append(np.flatnonzero(new_label[start:end]), end - start)
+        for label_start, label_end in zip(label_starts[:-1], label_starts[1:]):
+
+            local_slice = local_ns[start + label_start:start + label_end]
+            previous_max = np.maximum.accumulate(local_slice)
+            keep[start + label_start + 1:start + label_end] = local_slice[1:] > previous_max[:-1]
+
+    return prices, keep, last_adds
+
+# engine used when none is asked for
+def default_engine() -> str:
+    return "numba" if numba is not None else "numpy"
+
+# open_price, is_open and local_ns are per bar sorted by contract then time, raw_adds is (bars, 3)
+# of high, low and close adds drawn for every bar, starts are the first bar of each contract and
+# new_label flags the first bar of each contract label, carried is (contracts, 3) of the adds
+# carried in from the previous chunk (nan when there are none). Returns (bars, 3) of high, low
+# and close prices, the mask of bars to keep and each contract's last adds
+def ohlc(
+        open_price: np.ndarray,
+        raw_adds: np.ndarray,
+        is_open: np.ndarray,
+        starts: np.ndarray,
+        new_label: np.ndarray,
+        local_ns: np.ndarray,
+        carried: np.ndarray,
+        engine: str = None) -> tuple:
+
+    if engine == None: engine = default_engine()
+    if engine not in ENGINES: raise ValueError("engine must be 'numba' or 'numpy'")
+    if engine == "numba" and numba is None: raise ImportError("numba is not installed")
+
+    args = (
+        np.ascontiguousarray(open_price, dtype = np.float64),
+        np.ascontiguousarray(raw_adds, dtype = np.float64),
+        np.ascontiguousarray(is_open, dtype = bool),
+        np.ascontiguousarray(starts, dtype = np.int64),
+        np.ascontiguousarray(new_label, dtype = bool),
+        np.ascontiguousarray(local_ns, dtype = np.int64),
+        np.ascontiguousarray(carried, dtype = np.float64))
+
+    if engine == "numba": return _ohlc_loop_jit(*args)
+    return _ohlc_numpy(*args)
+
+# buy and sell volume for the kept bars, drawn from rng in the same order as before and 0 when closed
+def volumes(rng: np.random.RandomState, is_open: np.ndarray) -> tuple:
+
+    buy_vol = np.round(rng.normal(loc = 4_000, scale = 30, size = len(is_open)))
+    sell_vol = np.round(rng.normal(loc = 4_000, scale = 30, size = len(is_open)))
+    return np.where(is_open, buy_vol, 0), np.where(is_open, sell_vol, 0)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Nov 26 11:40:05 2023
+
+@author: Diego
+"""
+
+# helpers for the partitioned parquet datasets written when generating in chunks
+# layout is hive style by local year and quarter:
+#
+#   data/date/year=2021/quarter=1/part-0.parquet
+#   data/prices/year=2021/quarter=1/part-0.parquet
+#
+# the generators can also write a hive copy by zone, contract_name and local year which readers
+# prune by any of the three from the directory names alone. Each chunk writes its own part files
+# so a resumed run can remove just the chunks it rewrites
+#
+#   data/prices_hive/zone=NYC/contract_name=NYC1/year=2021/part-2021q1-0.parquet
+
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION_FILE = "part-0.parquet"
+PARTITION_KEYS = ["year", "quarter"]
+HIVE_PARTITIONS = ["zone", "contract_name", "year"]
+COMPRESSIONS = ["snappy", "gzip", "brotli", "zstd", "lz4", "none"]
+
+# default rows per row group, a bit over a quarter of one contract's 5 minute bars so a time filter
+# skips most of a contract sorted file rather than every contract sharing one row group
+ROW_GROUP_SIZE = 32 * 1024
+
+# row group size and codec every parquet file is written with, None keeps pyarrow's row group size
+def check_write_options(row_group_size: int, compression: str):
+    
+    if row_group_size != None and (type(row_group_size) != int or row_group_size < 1): 
+        raise ValueError("row_group_size must be None or a positive int")
+        
+    if compression not in COMPRESSIONS: 
+        raise ValueError("compression must be one of {}".format(", ".join(COMPRESSIONS)))
+
+def partition_path(root: str, year: int, quarter: int) -> str:
+    return os.path.join(root, "year={}".format(year), "quarter={}".format(quarter))
+
+# local year and quarter of a datetime column
+def year_quarter(local_time: pd.Series) -> tuple:
+
+    months = local_time.values.astype("datetime64[M]").astype(np.int64)
+    return months // 12 + 1970, months % 12 // 3 + 1
+
+# sorted (year, quarter) pairs in a dataset
+def list_partitions(root: str) -> list:
+
+    partitions = []
+    if os.path.exists(root) == False: return partitions
+
+    for year_dir in os.listdir(root):
+
+        year_match = re.fullmatch(r"year=(\d+)", year_dir)
+        if year_match == None: continue
+
+        for quarter_dir in os.listdir(os.path.join(root, year_dir)):
+
+            quarter_match = re.fullmatch(r"quarter=(\d)", quarter_dir)
+            if quarter_match == None: continue
+            partitions.append((int(year_match.group(1)), int(quarter_match.group(1))))
+
+    return sorted(partitions)
+
+# wipe the dataset so a new run doesn't mix with partitions of an old one
+def clear(root: str):
+    if os.path.exists(root) == True: shutil.rmtree(root)
+
+# splits a chunk by local quarter and writes each piece to its partition. Readers add the year and
+# quarter keys back as columns, so a column of the same name (the prices' Period quarter) would
+# clash with them and is left to the partition key
+def write_chunk(
+        df: pd.DataFrame, 
+        root: str, 
+        time_col: str = "local_time", 
+        row_group_size: int = None, 
+        compression: str = "snappy"):
+
+    years, quarters = year_quarter(df[time_col])
+    for year, quarter in sorted(set(zip(years.tolist(), quarters.tolist()))):
+
+        path = partition_path(root, year, quarter)
+        if os.path.exists(path) == False: os.makedirs(path)
+
+        (df[(years == year) & (quarters == quarter)].
+            drop(columns = [key for key in PARTITION_KEYS if key in df.columns]).
+            reset_index(drop = True).
+            to_parquet(
+                path = os.path.join(path, PARTITION_FILE), 
+                engine = "pyarrow", 
+                compression = compression, 
+                row_group_size = row_group_size))
+
+# row count of each partition from its parquet footer, nothing else is read
+def partition_rows(root: str, partitions: list) -> list:
+    return [pq.ParquetFile(os.path.join(partition_path(root, year, quarter), PARTITION_FILE)).metadata.num_rows for year, quarter in partitions]
+
+# removes partitions, e.g. the ones a resumed run is about to rewrite
+def remove_partitions(root: str, partitions: list):
+
+    for year, quarter in partitions:
+        shutil.rmtree(partition_path(root, year, quarter), ignore_errors = True)
+
+def read_partitions(root: str, partitions: list, columns: list = None) -> pd.DataFrame:
+
+    return (pd.concat([
+        pd.read_parquet(
+            path = os.path.join(partition_path(root, year, quarter), PARTITION_FILE),
+            engine = "pyarrow",
+            columns = columns)
+        for year, quarter in partitions]).
+        reset_index(drop = True))
+
+# groups the dataset's partitions into the chunks they are processed in
+def chunk_partitions(root: str, chunk: str) -> list:
+
+    partitions = list_partitions(root)
+    if chunk == "quarter": return [[partition] for partition in partitions]
+
+    years = sorted(set(year for year, quarter in partitions))
+    return [[partition for partition in partitions if partition[0] == year] for year in years]
+
+# name of the part files a chunk writes to the hive copy, by the chunk's first (year, quarter)
+# or "all" for an unchunked run
+def hive_part(partition: tuple = None) -> str:
+    return "all" if partition == None else "{}q{}".format(*partition)
+
+# writes a frame to the hive copy, rows are sorted by local_time within each partition so the
+# local_time min / max of every row group covers a narrow range and time filters skip the rest
+def write_hive(
+        df: pd.DataFrame, 
+        root: str, 
+        part: str = "all", 
+        time_col: str = "local_time", 
+        row_group_size: int = None, 
+        compression: str = "snappy"):
+    
+    years, quarters = year_quarter(df[time_col])
+    df_hive = (df.assign(
+        year = years.astype(np.int32)).
+        sort_values(["zone", "contract_name", time_col], kind = "stable"))
+    
+    # serial so each file keeps the sorted row order
+    ds.write_dataset(
+        data = pa.Table.from_pandas(df_hive, preserve_index = False), 
+        base_dir = root, 
+        format = "parquet", 
+        partitioning = HIVE_PARTITIONS, 
+        partitioning_flavor = "hive", 
+        basename_template = "part-{}-{{i}}.parquet".format(part), 
+        file_options = ds.ParquetFileFormat().make_write_options(compression = compression), 
+        min_rows_per_group = 0 if row_group_size == None else row_group_size, 
+        max_rows_per_group = 1024 * 1024 if row_group_size == None else row_group_size, 
+        use_threads = False, 
+        existing_data_behavior = "overwrite_or_ignore")
+
+# sorted (zone, contract_name, year) partitions of a hive copy that hold at least one part file
+def list_hive(root: str) -> list:
+    
+    partitions = []
+    if os.path.exists(root) == False: return partitions
+    
+    for dir_path, dir_names, file_names in os.walk(root):
+        
+        keys = os.path.relpath(dir_path, root).split(os.sep)
+        if len(keys) != len(HIVE_PARTITIONS) or len(file_names) == 0: continue
+        
+        matches = [re.fullmatch(r"{}=(.+)".format(name), key) for name, key in zip(HIVE_PARTITIONS, keys)]
+        if None in matches: continue
+        
+        zone, contract_name, year = [match.group(1) for match in matches]
+        partitions.append((zone, contract_name, int(year)))
+        
+    return sorted(partitions)
+
+# removes the part files of some chunks from the hive copy and the partitions left empty
+def remove_hive_parts(root: str, parts: list):
+    
+    prefixes = tuple("part-{}-".format(part) for part in parts)
+    
+    for dir_path, dir_names, file_names in os.walk(root, topdown = False):
+        
+        for file_name in file_names: 
+            if file_name.startswith(prefixes) == True: os.remove(os.path.join(dir_path, file_name))
+            
+        if dir_path != root and len(os.listdir(dir_path)) == 0: os.rmdir(dir_path)
+
+# reads a hive copy, a row_filter on the partition columns only opens the matching partitions and 
+# one on local_time skips row groups by their statistics. zone and contract_name come back as 
+# categoricals like the other datasets and the columns keep their written order
+def read_hive(root: str, row_filter = None, columns: list = None) -> pd.DataFrame:
+    
+    dataset = ds.dataset(
+        root, 
+        format = "parquet", 
+        partitioning = ds.HivePartitioning.discover(infer_dictionary = True))
+    
+    table = dataset.to_table(columns = columns, filter = row_filter)
+    
+    # the partition columns are appended last, the pandas metadata has the order they were written in
+    written = [column["name"] for column in (dataset.schema.pandas_metadata or {"columns": []})["columns"]]
+    names = [name for name in written if name in table.column_names]
+    
+    return table.select(names + [name for name in table.column_names if name not in names]).to_pandas()
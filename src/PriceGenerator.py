@@ -5,35 +5,82 @@ Created on Thu Nov 16 01:10:19 2023
 @author: Diego
 """
 import os
+import json
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+import DataSchema
+import OhlcKernel
+import ParquetDataset
+import PriceStore
+import RollSchedule
 
 class PriceGenerator:
     
-    # fills in names for specifically rolled contracts
-    def _fill(self, df: pd.DataFrame) -> pd.DataFrame:
-        return(df.sort_values(
-            "local_time").
-            fillna(method = "ffill").
-            assign(contract = lambda x: x.contract.fillna(x.contract_name + "_1")))
+    # index of the first row of each run of equal keys, keys must already be sorted
+    def _group_starts(self, keys: np.ndarray) -> np.ndarray:
+        
+        if len(keys) == 0: return np.zeros(0, dtype = np.int64)
+        return np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+    
+    # position of the first bar of each (group, day) pair, rows are sorted by group then time
+    # so the (group, day) keys are sorted and each first bar is one searchsorted away, -1 where
+    # the day isn't in the data
+    def _first_bar_positions(
+            self, 
+            group_id: np.ndarray, 
+            days: np.ndarray, 
+            pair_groups: np.ndarray, 
+            pair_days: np.ndarray) -> np.ndarray:
+        
+        bar_keys = group_id * RollSchedule.KEY_STRIDE + days
+        pair_keys = pair_groups * RollSchedule.KEY_STRIDE + pair_days
+        if len(bar_keys) == 0: return np.full(len(pair_keys), -1)
+        
+        positions = np.searchsorted(bar_keys, pair_keys, side = "left")
+        found = (positions < len(bar_keys)) & (bar_keys[np.minimum(positions, len(bar_keys) - 1)] == pair_keys)
+        return np.where(found, positions, -1)
+    
+    # contract label of every bar, contract_name_N where N carries on from roll_count and goes 
+    # up by one at each roll bar of that contract. The rolls before each bar come from 
+    # searchsorted over the sorted roll bar positions rather than filling labels forward
+    def _roll_labels(
+            self, 
+            names: np.ndarray, 
+            roll_counts: np.ndarray, 
+            starts: np.ndarray, 
+            roll_bars: np.ndarray, 
+            row_count: int) -> np.ndarray:
+        
+        roll_bars = np.sort(roll_bars)
+        group_id = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, row_count)))
+        
+        rolls_before = (
+            np.searchsorted(roll_bars, np.arange(row_count), side = "right") - 
+            np.searchsorted(roll_bars, starts, side = "left")[group_id])
+        
+        # every label a contract can take in this block, offset by contract
+        new_rolls = np.diff(np.searchsorted(roll_bars, np.append(starts, row_count), side = "left"))
+        offsets = np.concatenate([[0], np.cumsum(new_rolls + 1)[:-1]])
+        labels = np.array([
+            "{}_{}".format(name, roll_count + 1 + i)
+            for name, roll_count, count in zip(names, roll_counts, new_rolls)
+            for i in range(count + 1)], dtype = object)
+        
+        return labels[offsets[group_id] + rolls_before]
     
-    # function to find quarterly role
-    def _find_quarterly_roll(self, df: pd.DataFrame) -> pd.DataFrame:
+    # cumulative product restarting at every group start, each group is a contiguous slice 
+    # so this is one np.multiply.accumulate per contract rather than a dataframe per contract
+    def _segment_cumprod(self, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
         
-        df_tmp = df.query("month == month.min() & day == 15")
-        df_tmp_open = df_tmp.query("market_day == 'open'")
-        df_tmp_closed = df_tmp.query("market_day == ['closed', 'holiday']")
-
-        if len(df_tmp_open) != 0:
-            return(df_tmp_open)
-            
-        else:
+        out = np.empty_like(values)
+        bounds = np.append(starts, len(values))
+        
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            np.multiply.accumulate(values[start:end], out = out[start:end])
             
-            closed_date = df_tmp_closed.head(1).date.iloc[0]
-            return(df.sort_values(
-                "date").
-                query("date > @closed_date & market_day == 'open'").
-                head(1))
+        return out
     
     # function to add in roll price (via rtn) of first minute of the day
     def _find_first_trade_bar(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -64,57 +111,97 @@ class PriceGenerator:
             
             print("OHLC data is checked")
         
-    # add contracts names for they are rolled
-    # start on second contract then ffill forward then the remaining contracts are 
-    # contract1 respecitively which will be defined after the merge and ffill
-    def _add_contract_name(self, df: pd.DataFrame) -> pd.DataFrame:
-      
-        return(df.assign(
-            tmp = [i + 2 for i in range(len(df))],
-            contract = lambda x: x.contract_name + "_" + x.tmp.astype(str)).
-            drop(columns = ["tmp"]))
-    
-    # calculate cumulative return
-    def _cum_rtn(self, df: pd.DataFrame) -> pd.DataFrame:
-        
-        return(df.sort_values(
-            "nyc_time").
-            assign(
-                open_rtn = lambda x: np.cumprod(1 + x.rtn)))
-    
-    def _get_first_min(self, df: pd.DataFrame) -> pd.DataFrame:
-        return(df.query("local_time == local_time.min()"))
-        
     def __init__(
             self,
             scale: float = 0.0002,
             loc: float = 0.000003,
+            chunk: str = None,
+            price_dtype: str = "float64",
+            roll_day: int = 15,
+            ohlc_engine: str = None,
+            arrow_copy: bool = False,
+            hive_copy: bool = False,
+            row_group_size: int = ParquetDataset.ROW_GROUP_SIZE,
+            compression: str = "snappy",
+            seed: int = 123,
+            data_path: str = None,
             verbose = True):
         
-        np.random.seed(123)
+        # RandomState gives the same draws as seeding np.random but can be carried across chunks
+        if type(seed) != int: raise TypeError("seed must be type int")
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.scale, self.loc = scale, loc
         self.verbose = verbose
         
-        # path management
+        if chunk not in [None, "year", "quarter"]: raise ValueError("chunk must be None, 'year' or 'quarter'")
+        self.chunk = chunk
+        
+        # prices are float64 in memory and written out as price_dtype
+        if price_dtype not in ["float64", "float32"]: raise ValueError("price_dtype must be float64 or float32")
+        self.price_dtype = price_dtype
+        
+        # contracts roll on this day of the first month of each quarter, later days would run 
+        # into the next month in some quarters
+        if roll_day < 1 or roll_day > 28: raise ValueError("roll_day must be between 1 and 28")
+        self.roll_day = roll_day
+        
+        # OHLC kernel engine, None uses numba when it is installed and numpy otherwise
+        if ohlc_engine not in [None] + OhlcKernel.ENGINES: raise ValueError("ohlc_engine must be None, 'numba' or 'numpy'")
+        self.ohlc_engine = ohlc_engine
+        
+        # also write data/prices.arrow, an uncompressed copy MarketStats can memory map
+        self.arrow_copy = arrow_copy
+        
+        # also write data/prices_hive partitioned by zone, contract_name and local year
+        self.hive_copy = hive_copy
+        
+        # row group size and codec of every parquet file written
+        ParquetDataset.check_write_options(row_group_size, compression)
+        self.row_group_size, self.compression = row_group_size, compression
+        
+        # path management, data is read from and written to data_path, by default ../data from 
+        # the working directory
         self.parent_path = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-        self.data_path = os.path.join(self.parent_path, "data")
+        self.data_path = os.path.join(self.parent_path, "data") if data_path == None else os.path.abspath(data_path)
         self.file_path = os.path.join(self.data_path, "date.parquet")
+        self.dataset_path = os.path.join(self.data_path, "date")
+        
+        # per contract values carried from one chunk to the next
+        self.df_state = None
+        
+        # when chunking nothing is generated until save_data which then reads, generates and 
+        # writes one chunk of data/date at a time
+        if self.chunk != None: return
+        
+        self.df_date = self._read_dates(pd.read_parquet(path = self.file_path, engine = "pyarrow"))
+        self.df_vol, self.df_state = self._generate(self.df_date, self.df_state)
+                
+        if self.verbose == True: print("Checking OHLC relationship is preserved")
+        self._check_ohlc()
+        
+    # names get built on top of contract_name so they are read back as strings while 
+    # market_day and market_hour stay compact
+    def _read_dates(self, df: pd.DataFrame) -> pd.DataFrame:
         
-        self.df_date = (pd.read_parquet(
-            path = self.file_path, engine = "pyarrow").
-            groupby([
-                "contract_name", "zone", "local_time", "weekday", "date", 
-                "market_day", "hour", "market_hour"]).
+        return(DataSchema.expand_names(df).groupby([
+            "contract_name", "zone", "local_time", "weekday", "date", 
+            "market_day", "hour", "market_hour"], observed = True).
             head(1))
         
+    # generates prices for a block of dates, df_state holds each contract's last price, roll count
+    # and last OHLC adds from the previous block (None when starting fresh)
+    def _generate(self, df_date: pd.DataFrame, df_state: pd.DataFrame) -> tuple:
+        
         # generate random data will append it and then when market is close set it to 0
-        self.rand_rtns = np.random.normal(loc = loc, scale = scale, size = len(self.df_date))
+        rand_rtns = self.rng.normal(loc = self.loc, scale = self.scale, size = len(df_date))
         
         if self.verbose == True: print("Adding in Random Returns")
         
         # add returns and 0 out when market is closed ideally would merge but very expensive
-        self.df_rtn = (self.df_date.assign(
-            rtn = self.rand_rtns,
-            rtn_mod = lambda x: np.where(x.market_hour == "closed", 0, x.rtn)).
+        df_rtn = (df_date.assign(
+            rtn = rand_rtns,
+            rtn_mod = lambda x: np.where(DataSchema.is_open(x.market_hour), x.rtn, 0)).
         drop(columns = ["rtn"]).
         rename(columns = {"rtn_mod": "rtn"}).
         groupby(["contract_name", "nyc_time"]).
@@ -122,135 +209,387 @@ class PriceGenerator:
         
         if self.verbose == True: print("Initializing Price Data")
         
-        # get contract data and generate random start prices
-        self.contract_names = self.df_rtn["contract_name"].drop_duplicates().to_list()
-        self.contract_count = len(self.contract_names)
-        self.rand_start_prices = np.random.normal(loc = 1_000, scale = 30, size = self.contract_count)
-        self.start_price = pd.DataFrame({
-            "contract_name": self.contract_names,
-            "start_price": self.rand_start_prices})
+        # get contract data and generate random start prices, later chunks start from the last price
+        if df_state is None:
+            
+            contract_names = df_rtn["contract_name"].drop_duplicates().to_list()
+            df_state = pd.DataFrame({
+                "contract_name": contract_names,
+                "start_price": self.rng.normal(loc = 1_000, scale = 30, size = len(contract_names)),
+                "roll_count": 0,
+                "high_add": np.nan,
+                "low_add": np.nan,
+                "close_add": np.nan})
 
-        self.df_start = (self.df_rtn.merge(
-            right = self.start_price, how = "inner", on = ["contract_name"]).
+        df_start = (df_rtn.merge(
+            right = df_state[["contract_name", "start_price", "roll_count"]], how = "inner", on = ["contract_name"]).
             assign(quarter = lambda x: pd.PeriodIndex(x.local_time, freq = "Q")))
         
         if self.verbose == True: print("Finding roll dates")
         
         # Finds the specific roll dates per time zone
-        self.df_roll_dates = (self.df_start[
-            ["zone", "date", "quarter", "weekday", "market_day"]].
-            assign(
-                month = lambda x: x.date.dt.month,
-                day = lambda x: x.date.dt.day).
-            drop_duplicates().
-            groupby(["zone", "quarter"]).
-            apply(self._find_quarterly_roll).
-            reset_index(drop = True).
-            drop(columns = ["quarter", "weekday", "market_day", "month", "day"]))
-        
-        # gets the specific contracts per each time zone
-        self.df_zone_contract = (self.df_start[
-            ["contract_name", "zone"]].
-            groupby("contract_name").
-            head(1))
+        df_roll_dates = RollSchedule.quarterly_roll_dates(df_start, roll_day = self.roll_day)
+        
+        # sort once so each contract is one contiguous block in time order
+        df_combined = (df_start.sort_values(
+            ["contract_name", "nyc_time"]).
+            reset_index(drop = True))
+        
+        contract_starts = self._group_starts(df_combined.contract_name.values)
+        df_first = df_combined.iloc[contract_starts]
         
-        # gets the specific roll dates per each contract and specific names
-        self.df_roll_contract = (self.df_zone_contract.merge(
-            right = self.df_roll_dates, how = "outer", on = ["zone"]).
-            groupby(["contract_name"]).
-            apply(self._add_contract_name).
+        # gets the specific roll dates per each contract via its time zone, ordered by date then 
+        # contract which is the order the roll returns are drawn in
+        df_roll_contract = (pd.DataFrame({
+            "contract_id": np.arange(len(contract_starts)),
+            "zone": df_first.zone.values}).
+            merge(right = df_roll_dates, how = "inner", on = ["zone"]).
+            sort_values(["date", "contract_id"]).
             reset_index(drop = True))
         
         # to simulate roll changes add an additional 2% change to rtn 
         # assuming that the curve trades in contango and backwardation in even proportions
         # initialize a np array of 0s and 1s via binomial replace 0s with -1s multiply by 2
-        self.curve_roll = np.random.binomial(n = 1, p = 0.5, size = len(self.df_roll_contract))
-        self.curve_roll[self.curve_roll == 0] = -1
-        self.curve_roll = self.curve_roll * 2 / 100
+        curve_roll = self.rng.binomial(n = 1, p = 0.5, size = len(df_roll_contract))
+        curve_roll[curve_roll == 0] = -1
+        curve_roll = curve_roll * 2 / 100
         
         if self.verbose == True: print("Rolling Contracts")
         
-        # get specific minute bars to apply roll to 
-        self.df_roll_min = (self.df_roll_contract.merge(
-            right = self.df_start, how = "inner", on = ["contract_name", "zone", "date"]).
-            groupby("date").
-            apply(self._get_first_min).
-            reset_index(drop = True).
-            assign(roll = self.curve_roll))
-            
-        # combine together ffill to get contract names then remaining contracts 
-        # are 1st then add roll in to rtn
-        self.df_combined = (self.df_roll_min.merge(
-            right = self.df_start,
-            how = "outer", 
-            on = self.df_start.columns.to_list()).
-            assign(roll = lambda x: x.roll.fillna(0)).
-            groupby("contract_name").
-            apply(self._fill).
-            reset_index(drop = True).
-            assign(rtn = lambda x: x.rtn + x.roll).
-            drop(columns = ["roll"]))
+        # roll is applied to the first bar of each roll date per contract by position
+        group_id = np.repeat(np.arange(len(contract_starts)), np.diff(np.append(contract_starts, len(df_combined))))
+        roll_bars = self._first_bar_positions(
+            group_id = group_id,
+            days = df_combined.date.values.astype("datetime64[D]").astype(np.int64),
+            pair_groups = df_roll_contract.contract_id.values,
+            pair_days = df_roll_contract.date.values.astype("datetime64[D]").astype(np.int64))
+        
+        curve_roll, roll_bars = curve_roll[roll_bars >= 0], roll_bars[roll_bars >= 0]
+        rtn = df_combined.rtn.values.copy()
+        rtn[roll_bars] += curve_roll
+        
+        # contract names before the first roll are the current contract then one up per roll
+        contract = self._roll_labels(
+            names = df_first.contract_name.values,
+            roll_counts = df_first.roll_count.values,
+            starts = contract_starts,
+            roll_bars = roll_bars,
+            row_count = len(df_combined))
+        
+        df_combined = (df_combined.assign(
+            contract = contract,
+            rtn = rtn)
+            [["contract_name", "zone", "contract"] + 
+             [col for col in df_start.columns if col not in ["contract_name", "zone"]]])
         
         if self.verbose == True: print("Calculating Cumulative Return to back out time series")
         
         # now calculate the cumulative returns as a multiplier for price per each contract
-        self.df_cumprod = (self.df_combined.groupby([
-            "contract_name"]).
-            apply(self._cum_rtn).
-            assign(
-                open_price = lambda x: x.start_price * x.open_rtn).
-            drop(columns = ["rtn", "start_price", "open_rtn"]))
+        open_rtn = self._segment_cumprod(1 + df_combined.rtn.values, contract_starts)
         
-        self.high_add = abs(np.random.normal(loc = 0.0, scale = 1, size = len(self.df_cumprod)))
-        self.low_add = -1 * abs(np.random.normal(loc = 0.0, scale = 1, size = len(self.df_cumprod)))
+        df_cumprod = (df_combined.assign(
+            open_price = df_combined.start_price.values * open_rtn).
+            drop(columns = ["rtn", "start_price", "roll_count"]))
         
-        self.close_add = self.high_add + self.low_add + np.random.normal(
-            loc = 0.0, scale = 0.0000001, size = len(self.df_cumprod))
+        high_add = abs(self.rng.normal(loc = 0.0, scale = 1, size = len(df_cumprod)))
+        low_add = -1 * abs(self.rng.normal(loc = 0.0, scale = 1, size = len(df_cumprod)))
         
-        if self.verbose == True: print("Adding OHLC Data to time series")
+        close_add = high_add + low_add + self.rng.normal(
+            loc = 0.0, scale = 0.0000001, size = len(df_cumprod))
         
-        # create OHLC data, the random normal data gets put in first and then zereod out for when markets
-        # are closed
-        self.df_ohlc = (self.df_cumprod.assign(
-            high_add = self.high_add,
-            low_add = self.low_add,
-            close_add = self.close_add).assign(
-                high_add = lambda x: np.where(x.market_hour == "closed", np.nan, x.high_add),
-                low_add = lambda x: np.where(x.market_hour == "closed", np.nan, x.low_add),
-                close_add = lambda x: np.where(x.market_hour == "closed", np.nan, x.close_add)).
-            fillna(method = "ffill").
-            fillna(method = "bfill").
-            assign(
-                high_price = lambda x: x.open_price + x.high_add,
-                low_price = lambda x: x.open_price + x.low_add,
-                close_price = lambda x: x.open_price + x.close_add).
-            drop(columns = ["high_add", "low_add", "close_add"]).
-            groupby(["contract", "local_time"]).
-            head(1))
-                
-        vol_count = len(self.df_ohlc)
-        buy_vol = np.round(np.random.normal(loc = 4_000, scale = 30, size = vol_count))
-        sell_vol = np.round(np.random.normal(loc = 4_000, scale = 30, size = vol_count))
+        if self.verbose == True: print("Adding OHLC Data to time series")
         
-        self.df_vol = (self.df_ohlc.assign(
-            buy_vol = buy_vol,
-            sell_vol = sell_vol).
+        # create OHLC data, closed bars carry the adds of the last open bar of their contract, bars
+        # before the first open bar take the previous chunk's last adds or on the very first chunk
+        # the first open bar's adds. Bars repeating a local time in a contract are dropped
+        is_open = DataSchema.is_open(df_cumprod.market_hour)
+        new_label = np.zeros(len(df_cumprod), dtype = bool)
+        new_label[contract_starts], new_label[roll_bars] = True, True
+        
+        carried = (df_state.set_index(
+            "contract_name").
+            loc[df_first.contract_name.values, ["high_add", "low_add", "close_add"]].
+            values)
+        
+        prices, keep, last_adds = OhlcKernel.ohlc(
+            open_price = df_cumprod.open_price.values,
+            raw_adds = np.column_stack([high_add, low_add, close_add]),
+            is_open = is_open,
+            starts = contract_starts,
+            new_label = new_label,
+            local_ns = df_cumprod.local_time.values.astype(np.int64),
+            carried = carried,
+            engine = self.ohlc_engine)
+        
+        buy_vol, sell_vol = OhlcKernel.volumes(self.rng, is_open[keep])
+        
+        df_vol = (df_cumprod.assign(
+            high_price = prices[:, 0],
+            low_price = prices[:, 1],
+            close_price = prices[:, 2]).
+            loc[keep].
             assign(
-                buy_vol = lambda x: np.where(x.market_hour == "closed", 0, x.buy_vol),
-                sell_vol = lambda x: np.where(x.market_hour == "closed", 0, x.sell_vol)).
+                buy_vol = buy_vol,
+                sell_vol = sell_vol).
             drop(columns = ["date"]).
             reset_index(drop = True))
+        
+        # carry forward the last price, roll count and OHLC adds of each contract
+        df_rolls = pd.DataFrame({
+            "contract_name": df_first.contract_name.values,
+            "new_rolls": np.bincount(group_id[roll_bars], minlength = len(contract_starts))})
+        
+        df_state_out = (pd.DataFrame({
+            "contract_name": df_first.contract_name.values,
+            "start_price": df_cumprod.open_price.values[np.append(contract_starts[1:], len(df_cumprod)) - 1],
+            "high_add": last_adds[:, 0],
+            "low_add": last_adds[:, 1],
+            "close_add": last_adds[:, 2]}).
+            merge(right = df_state[["contract_name", "roll_count"]], how = "inner", on = ["contract_name"]).
+            merge(right = df_rolls, how = "left", on = ["contract_name"]).
+            assign(roll_count = lambda x: x.roll_count + x.new_rolls).
+            drop(columns = ["new_rolls"]))
+        
+        return df_vol, df_state_out
+    
+    # generator settings an appended run must share with the run it extends
+    def _params(self) -> dict:
+        
+        return {
+            "scale": self.scale, 
+            "loc": self.loc, 
+            "chunk": self.chunk, 
+            "price_dtype": self.price_dtype, 
+            "roll_day": self.roll_day,
+            "seed": self.seed,
+            "hive_copy": self.hive_copy}
+    
+    # per contract state and random state between two chunks, json friendly
+    def _snapshot(self) -> dict:
+        
+        name, keys, pos, has_gauss, cached = self.rng.get_state()
+        return {
+            "df_state": None if self.df_state is None else self.df_state.to_dict("list"),
+            "rng": [name, keys.tolist(), int(pos), int(has_gauss), float(cached)]}
+    
+    def _restore(self, snapshot: dict):
+        
+        name, keys, pos, has_gauss, cached = snapshot["rng"]
+        self.rng.set_state((name, np.array(keys, dtype = np.uint32), pos, has_gauss, cached))
+        self.df_state = None if snapshot["df_state"] is None else pd.DataFrame(snapshot["df_state"])
+    
+    # data/prices/_state.json holds the date partitions and row counts of every chunk generated with
+    # the state going into it and the state after the last one. The leading underscore keeps the
+    # file out of the dataset when it is read
+    def _history_path(self) -> str:
+        return os.path.join(self.dataset_out, "_state.json")
+    
+    def _read_history(self) -> dict:
+        
+        if os.path.exists(self.dataset_out) == False: return None
+        if os.path.exists(self._history_path()) == False: 
+            raise FileNotFoundError("{} has no {} to append to, rerun without append".format(self.dataset_out, self._history_path()))
+        
+        with open(self._history_path(), "r") as file: history = json.load(file)
+        
+        if history["params"] != self._params(): 
+            raise ValueError("can't append with {} to a dataset generated with {}".format(self._params(), history["params"]))
+        
+        return history
+    
+    def _write_history(self, history: dict):
+        
+        tmp_path = "{}.tmp".format(self._history_path())
+        with open(tmp_path, "w") as file: json.dump(history, file)
+        os.replace(tmp_path, self._history_path())
+    
+    # first chunk that wasn't generated or whose dates changed since, e.g. the last year when a 
+    # quarter is added to it. The state going into that chunk is restored and the price partitions 
+    # from its first quarter on are removed, along with the hive parts of the chunks after it
+    def _resume(self, history: dict, chunks: list, rows: list) -> int:
+        
+        done = [[[list(partition) for partition in partitions], partition_rows] for partitions, partition_rows in zip(chunks, rows)]
+        start = 0
+        
+        while (start < len(history["chunks"]) and 
+               start < len(done) and 
+               [history["chunks"][start]["partitions"], history["chunks"][start]["rows"]] == done[start]):
+            
+            start += 1
+        
+        self._restore(history["chunks"][start]["before"] if start < len(history["chunks"]) else history["end"])
+        
+        if start < len(chunks):
+            
+            ParquetDataset.remove_partitions(self.dataset_out, [
+                partition for partition in ParquetDataset.list_partitions(self.dataset_out) 
+                if partition >= chunks[start][0]])
+            
+        if self.hive_copy == True:
+            
+            ParquetDataset.remove_hive_parts(self.hive_out, [
+                ParquetDataset.hive_part(tuple(chunk["partitions"][0])) for chunk in history["chunks"][start:]])
+        
+        history["chunks"] = history["chunks"][:start]
+        return start
+    
+    # reads, generates and writes data/prices one chunk of data/date at a time, when appending only
+    # the chunks after the ones already written are generated, carrying on from their saved state
+    def _save_chunks(self, append: bool = False):
+        
+        chunks = ParquetDataset.chunk_partitions(self.dataset_path, self.chunk)
+        rows = [ParquetDataset.partition_rows(self.dataset_path, partitions) for partitions in chunks]
+        
+        history = self._read_history() if append == True else None
+        
+        if history is None:
+            
+            ParquetDataset.clear(self.dataset_out)
+            ParquetDataset.clear(self.hive_out)
+            os.makedirs(self.dataset_out)
+            history, start = {"params": self._params(), "chunks": []}, 0
+            
+        else: start = self._resume(history, chunks, rows)
+        
+        for partitions, partition_rows in zip(chunks[start:], rows[start:]):
+            
+            if self.verbose == True: print("Generating", partitions)
+            
+            history["chunks"].append({
+                "partitions": [list(partition) for partition in partitions],
+                "rows": partition_rows,
+                "before": self._snapshot()})
+            
+            self.df_date = self._read_dates(ParquetDataset.read_partitions(self.dataset_path, partitions))
+            self.df_vol, self.df_state = self._generate(self.df_date, self.df_state)
+            
+            if self.verbose == True: print("Checking OHLC relationship is preserved")
+            self._check_ohlc()
+            
+            df_out = DataSchema.compact(self.df_vol, self.price_dtype)
+            ParquetDataset.write_chunk(df_out, self.dataset_out, row_group_size = self.row_group_size, compression = self.compression)
+            
+            if self.hive_copy == True: 
                 
-        if self.verbose == True: print("Checking OHLC relationship is preserved")
-        self._check_ohlc()
+                ParquetDataset.write_hive(
+                    df_out, self.hive_out, ParquetDataset.hive_part(partitions[0]), 
+                    row_group_size = self.row_group_size, compression = self.compression)
+        
+        history["end"] = self._snapshot()
+        self._write_history(history)
+        
+    # appending to data/prices should give exactly what generating it from scratch does, this 
+    # generates it again from scratch in a temporary dataset and compares every partition
+    def check_append(self) -> bool:
+        
+        if self.chunk == None: raise ValueError("check_append needs a chunked generator")
+        
+        dataset_out = os.path.join(self.data_path, "prices")
+        scratch = PriceGenerator(
+            scale = self.scale, 
+            loc = self.loc, 
+            chunk = self.chunk, 
+            price_dtype = self.price_dtype, 
+            roll_day = self.roll_day, 
+            ohlc_engine = self.ohlc_engine, 
+            seed = self.seed,
+            data_path = self.data_path,
+            verbose = False)
+        
+        scratch.dataset_out = os.path.join(self.data_path, "_prices_scratch")
+        scratch.hive_out = os.path.join(self.data_path, "_prices_scratch_hive")
+        scratch._save_chunks()
+        
+        partitions = ParquetDataset.list_partitions(dataset_out)
+        matches = partitions == ParquetDataset.list_partitions(scratch.dataset_out)
+        
+        for partition in partitions:
+            
+            if matches == False: break
+            matches = ParquetDataset.read_partitions(dataset_out, [partition]).equals(
+                ParquetDataset.read_partitions(scratch.dataset_out, [partition]))
+        
+        ParquetDataset.clear(scratch.dataset_out)
+        
+        if matches == True: print("Appended prices match a run from scratch")
+        else: print("Appended prices don't match a run from scratch")
+        
+        return matches
+        
+    # data/prices should read back as one frame with pandas and MarketStats, the partition keys come 
+    # back as columns so a chunk column clashing with them would make both fail
+    def check_dataset(self) -> bool:
+        
+        if self.chunk == None: raise ValueError("check_dataset needs a chunked generator")
+        
+        # imported here so generating prices doesn't pull in the analysis module and matplotlib
+        from MarketStats import MarketStats
+        
+        dataset_out = os.path.join(self.data_path, "prices")
+        rows = sum(sum(ParquetDataset.partition_rows(dataset_out, partitions)) for partitions in ParquetDataset.chunk_partitions(dataset_out, self.chunk))
+        
+        try: 
+            
+            readable = len(pd.read_parquet(path = dataset_out, engine = "pyarrow")) == rows
+            readable = readable and len(MarketStats(dataset_out, verbose = False).df_price) == rows
+            
+        except (TypeError, ValueError, pa.ArrowException) as error:
+            
+            if self.verbose == True: print("Prices dataset can't be read:", error)
+            readable = False
+            
+        if readable == True: print("Prices dataset reads with pandas and MarketStats")
+        else: print("Prices dataset doesn't read with pandas and MarketStats")
         
-    def save_data(self):
+        return readable
+        
+    # append = True extends an existing data/prices (chunked runs only) by generating just the new
+    # date chunks, each contract carries on from its last price, OHLC adds and contract_name_N
+    def save_data(self, append: bool = False):
         
         if os.path.exists(self.data_path) == False: os.makedirs(self.data_path)
+        if append == True and self.chunk == None: raise ValueError("append needs a chunked generator")
+        
+        self.hive_out = os.path.join(self.data_path, "prices_hive")
+        
+        if self.chunk != None:
+            
+            self.dataset_out = os.path.join(self.data_path, "prices")
+            self._save_chunks(append)
+            if self.verbose == True: print("Dataset Written to", self.dataset_out)
+            if self.hive_copy == True and self.verbose == True: print("Hive copy Written to", self.hive_out)
+            
+            if self.arrow_copy == True: 
+                
+                self.arrow_out = os.path.join(self.data_path, "prices.arrow")
+                PriceStore.write_arrow(self.dataset_out, self.arrow_out)
+                if self.verbose == True: print("Arrow copy Written to", self.arrow_out)
+                
+            return
+        
         self.file_out = os.path.join(self.data_path, "prices.parquet")
-        self.df_vol.to_parquet(path = self.file_out, engine = "pyarrow")
+        df_out = DataSchema.compact(self.df_vol, self.price_dtype)
+        df_out.to_parquet(
+            path = self.file_out, 
+            engine = "pyarrow", 
+            compression = self.compression, 
+            row_group_size = self.row_group_size)
         
         if self.verbose == True: print("File Written to", self.file_out)
+        
+        # a stale copy of an older run is wiped either way
+        ParquetDataset.clear(self.hive_out)
+        
+        if self.hive_copy == True:
+            
+            ParquetDataset.write_hive(df_out, self.hive_out, row_group_size = self.row_group_size, compression = self.compression)
+            if self.verbose == True: print("Hive copy Written to", self.hive_out)
+        
+        if self.arrow_copy == True:
+            
+            self.arrow_out = os.path.join(self.data_path, "prices.arrow")
+            PriceStore.write_table(pa.Table.from_pandas(df_out, preserve_index = False), self.arrow_out)
+            if self.verbose == True: print("Arrow copy Written to", self.arrow_out)
 
         
 if __name__ == "__main__":        
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Dec  8 09:05:36 2023
+
+@author: Diego
+"""
+
+# sample extraction from prices.parquet, the data/prices dataset or the data/prices_hive copy
+# without loading them. A sample spec is turned into a pyarrow filter, the time range comes from
+# the local_time statistics in the parquet footers so finding the last year reads no rows, and
+# the filter skips every row group (and hive partition) outside the sample. The rows are streamed
+# out in batches to the sample's parquet and csv files. A spec combines any of
+#
+#   "year":        a local year or "last"
+#   "month":       a month of that year or "first"
+#   "last_days":   the last N local dates of the source
+#   "contracts":   contract_names to keep
+#   "random_days": K random (contract_name, local date) pairs of what the rest selects, "seed"
+#                  makes the draw repeatable
+#
+# $ python ./src/PriceSample.py ../data/prices.parquet ../data prices_sample --year last
+# $ python ./src/PriceSample.py ../data/prices_hive ../data nyc_sample --contracts NYC1 --last-days 30
+# $ python ./src/PriceSample.py ../data/prices.parquet ../data days_sample --random-days 20 --seed 7
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import ParquetDataset
+
+SPEC_KEYS = ["year", "month", "last_days", "contracts", "random_days", "seed"]
+TIME_COL = "local_time"
+DAY = pd.Timedelta(days = 1)
+
+# directories are read with their partition keys so a year filter prunes whole year= directories
+# of the hive copy or data/prices, whose year and quarter come back as columns like they do from
+# pd.read_parquet
+def open_dataset(source: str) -> ds.Dataset:
+
+    if os.path.isdir(source) == True:
+        return ds.dataset(source, format = "parquet", partitioning = ds.HivePartitioning.discover(infer_dictionary = True))
+
+    return ds.dataset(source, format = "parquet")
+
+# the sample's schema keeps the source's pandas metadata for the columns it has, which is what
+# restores the Period quarter, but not the source's index so it reads back with a range index
+def _sample_schema(schema: pa.Schema) -> pa.Schema:
+
+    metadata = schema.pandas_metadata
+    if metadata == None: return schema
+
+    metadata = dict(
+        metadata,
+        index_columns = [],
+        columns = [column for column in metadata["columns"] if column["name"] in schema.names])
+
+    return schema.with_metadata({b"pandas": json.dumps(metadata).encode()})
+
+# a batch as the columns DataFrame.to_csv writes, formatted by arrow since formatting the times
+# and periods in pandas is most of the cost of the csv. Dictionaries are decoded, times are to
+# the second, pandas periods are period strings, nan is empty and the index comes first
+def _csv_table(batch: pa.RecordBatch, start: int) -> pa.Table:
+
+    columns = {"": pa.array(np.arange(start, start + batch.num_rows))}
+
+    for field, column in zip(batch.schema, batch.columns):
+
+        # periods come back as pandas' extension type once pandas has registered it and as int64 
+        # ordinals tagged with the extension in the field metadata before that
+        metadata = field.metadata or {}
+        if isinstance(column.type, pa.BaseExtensionType) == True:
+            metadata = {b"ARROW:extension:name": column.type.extension_name.encode(), b"ARROW:extension:metadata": column.type.__arrow_ext_serialize__()}
+            column = column.storage
+
+        if metadata.get(b"ARROW:extension:name") == b"pandas.period":
+
+            dtype = pd.PeriodDtype(json.loads(metadata[b"ARROW:extension:metadata"])["freq"])
+            ordinals, codes = np.unique(column.to_numpy(zero_copy_only = False), return_inverse = True)
+            column = pa.array(pd.arrays.PeriodArray(ordinals, dtype = dtype).astype(str)[codes])
+
+        elif pa.types.is_dictionary(column.type): column = column.dictionary_decode()
+
+        elif pa.types.is_timestamp(column.type):
+
+            # pandas only writes fractions of a second when there are any
+            try: column = pc.strftime(column.cast(pa.timestamp("s")), format = "%Y-%m-%d %H:%M:%S")
+            except pa.ArrowInvalid: column = pc.strftime(column, format = "%Y-%m-%d %H:%M:%S")
+
+        elif pa.types.is_floating(column.type):
+            column = pc.if_else(pc.is_nan(column), pa.scalar(None, column.type), column)
+
+        columns[field.name] = column
+
+    return pa.table(columns)
+
+# min and max local_time of the dataset from the row group statistics, no rows are read
+def time_range(dataset: ds.Dataset) -> tuple:
+
+    lows, highs = [], []
+
+    for fragment in dataset.get_fragments():
+
+        metadata = fragment.metadata
+        for i in range(metadata.num_row_groups):
+
+            row_group = metadata.row_group(i)
+            if row_group.num_rows == 0: continue
+
+            column = [row_group.column(j).path_in_schema for j in range(row_group.num_columns)].index(TIME_COL)
+            statistics = row_group.column(column).statistics
+
+            if statistics is None or statistics.has_min_max == False:
+                raise ValueError("{} has a row group without {} statistics".format(fragment.path, TIME_COL))
+
+            lows.append(pd.Timestamp(statistics.min))
+            highs.append(pd.Timestamp(statistics.max))
+
+    if len(highs) == 0: raise ValueError("no rows to sample")
+    return min(lows), max(highs)
+
+def _between(start: pd.Timestamp, end: pd.Timestamp) -> ds.Expression:
+    return (ds.field(TIME_COL) >= start) & (ds.field(TIME_COL) < end)
+
+def _and(row_filter: ds.Expression, expression: ds.Expression) -> ds.Expression:
+    return expression if row_filter is None else row_filter & expression
+
+# first local_time a filter selects, only the time column of the row groups it keeps is read
+def _first_time(dataset: ds.Dataset, row_filter: ds.Expression) -> pd.Timestamp:
+
+    times = dataset.to_table(columns = [TIME_COL], filter = row_filter).column(TIME_COL)
+    if len(times) == 0: raise ValueError("the sample spec selects no rows")
+
+    return pd.Timestamp(times.to_numpy().min())
+
+# K (contract_name, local date) pairs drawn from the ones the filter selects, as one filter
+def _random_days(dataset: ds.Dataset, row_filter: ds.Expression, count: int, seed: int) -> ds.Expression:
+
+    df_days = (dataset.to_table(
+        columns = ["contract_name", TIME_COL],
+        filter = row_filter).
+        to_pandas().
+        assign(
+            contract_name = lambda x: x.contract_name.astype(str),
+            date = lambda x: x.local_time.dt.floor("D")).
+        drop_duplicates(["contract_name", "date"]).
+        sort_values(["contract_name", "date"]).
+        reset_index(drop = True))
+
+    if len(df_days) == 0: raise ValueError("the sample spec selects no rows")
+
+    picks = np.sort(np.random.RandomState(seed).choice(len(df_days), min(count, len(df_days)), replace = False))
+    day_filter = None
+
+    for contract_name, date in df_days.loc[picks, ["contract_name", "date"]].itertuples(index = False):
+
+        expression = (ds.field("contract_name") == contract_name) & _between(date, date + DAY)
+        day_filter = expression if day_filter is None else day_filter | expression
+
+    return day_filter
+
+# the pyarrow filter of a sample spec, None keeps every row
+def sample_filter(dataset: ds.Dataset, spec: dict) -> ds.Expression:
+
+    unknown = [key for key in spec.keys() if key not in SPEC_KEYS]
+    if len(unknown) > 0: raise ValueError("unknown sample spec keys {}, expected {}".format(unknown, SPEC_KEYS))
+    if spec.get("month") != None and spec.get("year") == None: raise ValueError("a month needs a year")
+
+    row_filter = None
+    if spec.get("contracts") != None: row_filter = ds.field("contract_name").isin(list(spec["contracts"]))
+
+    if spec.get("year") != None or spec.get("last_days") != None: max_time = time_range(dataset)[1]
+
+    if spec.get("year") != None:
+
+        year = max_time.year if spec["year"] == "last" else int(spec["year"])
+        if "year" in dataset.schema.names: row_filter = _and(row_filter, ds.field("year") == year)
+        row_filter = _and(row_filter, _between(pd.Timestamp(year, 1, 1), pd.Timestamp(year + 1, 1, 1)))
+
+        if spec.get("month") != None:
+
+            month = _first_time(dataset, row_filter).month if spec["month"] == "first" else int(spec["month"])
+            start = pd.Timestamp(year, month, 1)
+            row_filter = _and(row_filter, _between(start, start + pd.offsets.MonthBegin(1)))
+
+    if spec.get("last_days") != None:
+
+        if spec["last_days"] < 1: raise ValueError("last_days must be at least 1")
+        row_filter = _and(row_filter, ds.field(TIME_COL) >= max_time.floor("D") - (spec["last_days"] - 1) * DAY)
+
+    if spec.get("random_days") != None:
+
+        if spec["random_days"] < 1: raise ValueError("random_days must be at least 1")
+        row_filter = _and(row_filter, _random_days(dataset, row_filter, spec["random_days"], spec.get("seed", 1234)))
+
+    return row_filter
+
+# writes the rows a spec selects to data_path/file_name.parquet and .csv a batch at a time, in the
+# source's order with a fresh index, returns the row count
+def write_sample(source: str, data_path: str, file_name: str, spec: dict, batch_size: int = 64 * 1024) -> int:
+
+    dataset = open_dataset(source)
+
+    # written columns in their original order with the partition columns last, the hive copy's 
+    # year only partitions it since its files keep every prices column
+    metadata = dataset.schema.pandas_metadata or {"columns": [], "index_columns": []}
+    dropped = ["year"] if len(ParquetDataset.list_hive(source)) > 0 else []
+    written = [column["name"] for column in metadata["columns"] if column["name"] not in metadata["index_columns"]]
+    columns = [name for name in written if name in dataset.schema.names and name not in dropped]
+    columns += [name for name in dataset.schema.names if name not in columns and name not in written and name not in dropped]
+
+    scanner = dataset.scanner(columns = columns, filter = sample_filter(dataset, spec), batch_size = batch_size)
+
+    schema = _sample_schema(scanner.projected_schema)
+    parquet_path = os.path.join(data_path, "{}.parquet".format(file_name))
+    csv_path = os.path.join(data_path, "{}.csv".format(file_name))
+    rows = 0
+
+    print("Writing Sample", file_name)
+
+    with pq.ParquetWriter(parquet_path, schema) as parquet_writer, open(csv_path, "wb") as csv_file:
+
+        # the header is written by hand since the index column has no name
+        csv_file.write("{}\n".format(",".join([""] + schema.names)).encode())
+
+        for batch in scanner.to_batches():
+
+            if batch.num_rows == 0: continue
+            parquet_writer.write_table(pa.Table.from_batches([batch], schema = schema))
+
+            csv.write_csv(
+                _csv_table(batch, rows), csv_file,
+                csv.WriteOptions(include_header = False, quoting_style = "none"))
+
+            rows += batch.num_rows
+
+    return rows
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Write a sample of the prices to parquet and csv")
+    parser.add_argument("source", help = "prices.parquet, data/prices or data/prices_hive")
+    parser.add_argument("data_path", help = "directory the sample files are written to")
+    parser.add_argument("file_name", help = "sample file name without extension")
+    parser.add_argument("--year", help = "a local year or last")
+    parser.add_argument("--month", help = "a month of the year or first")
+    parser.add_argument("--last-days", type = int)
+    parser.add_argument("--contracts", nargs = "+")
+    parser.add_argument("--random-days", type = int)
+    parser.add_argument("--seed", type = int, default = 1234)
+    parser.add_argument("--batch-size", type = int, default = 64 * 1024)
+    args = parser.parse_args()
+
+    spec = {
+        "year": args.year,
+        "month": args.month,
+        "last_days": args.last_days,
+        "contracts": args.contracts,
+        "random_days": args.random_days,
+        "seed": args.seed}
+
+    rows = write_sample(
+        source = args.source,
+        data_path = args.data_path,
+        file_name = args.file_name,
+        spec = {key: value for key, value in spec.items() if value != None},
+        batch_size = args.batch_size)
+
+    print("{} rows written".format(rows))
+
+if __name__ == "__main__":
+    main()
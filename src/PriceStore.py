@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Dec  5 08:41:19 2023
+
+@author: Diego
+"""
+
+# memory mapped Arrow store of prices. An uncompressed Arrow IPC (feather v2) copy of the
+# prices is written as a single record batch sorted by contract_name, opening it maps the file
+# rather than reading it so every process on the host shares the same pages in the page cache.
+# Each contract is a contiguous block so a contract's columns are zero copy slices of the map
+#
+#   data/prices.arrow
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+def is_arrow_path(path: str) -> bool:
+    return path.endswith(ARROW_EXTENSIONS)
+
+# plain numpy strings of a (possibly dictionary encoded) string column
+def _decode(column: pa.ChunkedArray) -> np.ndarray:
+
+    array = column.combine_chunks()
+    if isinstance(array.type, pa.DictionaryType): array = array.dictionary_decode()
+    return array.to_numpy(zero_copy_only = False)
+
+# writes a table sorted by contract_name as one record batch with one dictionary per column
+def write_table(table: pa.Table, arrow_path: str):
+
+    table = table.unify_dictionaries().combine_chunks()
+
+    # stable so each contract keeps its time order, arrow can't sort dictionary columns itself
+    order = np.argsort(_decode(table.column("contract_name")), kind = "stable")
+    if np.array_equal(order, np.arange(len(order))) == False: table = table.take(order)
+
+    tmp_path = "{}.tmp".format(arrow_path)
+
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize = max(table.num_rows, 1))
+
+    os.replace(tmp_path, arrow_path)
+
+# arrow copy of prices.parquet or the data/prices dataset, the dataset's quarter comes from its
+# quarter= directories and the year= key is left out
+def write_arrow(source_path: str, arrow_path: str):
+
+    dataset = ds.dataset(source_path, format = "parquet", partitioning = "hive")
+    write_table(dataset.to_table(columns = [name for name in dataset.schema.names if name != "year"]), arrow_path)
+
+class PriceStore:
+
+    def __init__(self, arrow_path: str):
+
+        self.arrow_path = arrow_path
+        self.source = pa.memory_map(arrow_path, "r")
+        self.table = pa.ipc.open_file(self.source).read_all()
+
+        # (offset, length) of each contract's block
+        names = _decode(self.table.column("contract_name"))
+        starts = np.concatenate([[0], np.flatnonzero(names[1:] != names[:-1]) + 1]) if len(names) > 0 else np.zeros(0, dtype = int)
+        ends = np.append(starts[1:], len(names))
+
+        self.blocks = {names[start]: (int(start), int(end - start)) for start, end in zip(starts, ends)}
+        self.contracts = list(self.blocks.keys())
+
+        zones = _decode(self.table.column("zone")) if "zone" in self.table.column_names else None
+        self.zones = {} if zones is None else {contract: zones[start] for contract, (start, length) in self.blocks.items()}
+
+    # zero copy table of one contract
+    def slice(self, contract: str) -> pa.Table:
+
+        if contract not in self.blocks: raise KeyError("{} is not in {}".format(contract, self.arrow_path))
+        return self.table.slice(*self.blocks[contract])
+
+    # zero copy numpy view of one column of one contract (or every contract), dictionary columns
+    # give their codes
+    def column(self, name: str, contract: str = None) -> np.ndarray:
+
+        table = self.table if contract == None else self.slice(contract)
+        array = table.column(name).combine_chunks()
+        if isinstance(array.type, pa.DictionaryType): array = array.indices
+
+        return array.to_numpy(zero_copy_only = True)
+
+    # contracts selected by name or zone, consecutive contracts stay one zero copy slice
+    def _select(self, contracts: list = None, zone: str = None) -> pa.Table:
+
+        selected = self.contracts if contracts == None else [contract for contract in self.contracts if contract in contracts]
+        if zone != None: selected = [contract for contract in selected if self.zones.get(contract) == zone]
+        if len(selected) == 0: return self.table.slice(0, 0)
+
+        positions = [self.contracts.index(contract) for contract in selected]
+        if positions == list(range(positions[0], positions[-1] + 1)):
+
+            start = self.blocks[selected[0]][0]
+            end = sum(self.blocks[selected[-1]])
+            return self.table.slice(start, end - start)
+
+        return pa.concat_tables([self.slice(contract) for contract in selected])
+
+    # pandas frame of the store, column and contract selections are views of the memory map and
+    # only a row_filter expression (times or market hours) makes a copy
+    def read(self, columns: list = None, contracts: list = None, zone: str = None, row_filter = None) -> pd.DataFrame:
+
+        table = self._select(contracts, zone)
+        if columns != None: table = table.select(columns)
+        if row_filter is not None: table = ds.dataset(table).to_table(filter = row_filter)
+
+        return table.to_pandas(split_blocks = True)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Dec  1 09:37:12 2023
+
+@author: Diego
+"""
+
+# roll schedule builder, finds every roll date for every zone in one pass over the
+# open day calendar by searching sorted (zone, open day) keys rather than grouping
+# by zone and quarter
+
+import numpy as np
+import pandas as pd
+
+import DataSchema
+
+# group codes are spaced further apart than any day number so (group, day) sorts as one int
+KEY_STRIDE = 1_000_000
+
+# roll on roll_day of the first month of each quarter (first month present if the data starts
+# mid quarter) or if that day is closed on the next open day in the same quarter
+# df_calendar needs zone, date and market_day and can have one row per bar or per day
+def quarterly_roll_dates(df_calendar: pd.DataFrame, roll_day: int = 15) -> pd.DataFrame:
+
+    df_days = (df_calendar[
+        ["zone", "date", "market_day"]].
+        drop_duplicates(["zone", "date"]).
+        sort_values(["zone", "date"]))
+
+    zone_codes, zone_names = pd.factorize(df_days.zone, sort = True)
+    dates = df_days.date.values.astype("datetime64[D]")
+    days = dates.astype(np.int64)
+    months = dates.astype("datetime64[M]").astype(np.int64)
+    quarters = months // 3
+
+    # one target per (zone, quarter), the rows are sorted so the first row is the first month
+    group_key = zone_codes.astype(np.int64) * KEY_STRIDE + quarters
+    group_starts = np.concatenate([[0], np.flatnonzero(group_key[1:] != group_key[:-1]) + 1])
+
+    target_days = (
+        months[group_starts].astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + roll_day - 1)
+    target_keys = zone_codes[group_starts].astype(np.int64) * KEY_STRIDE + target_days
+
+    # first open day on or after the target
+    is_open = DataSchema.is_open(df_days.market_day)
+    open_keys = zone_codes[is_open].astype(np.int64) * KEY_STRIDE + days[is_open]
+    found = np.searchsorted(open_keys, target_keys, side = "left")
+
+    found_keys = open_keys[np.minimum(found, len(open_keys) - 1)] if len(open_keys) > 0 else target_keys
+    found_days = found_keys % KEY_STRIDE
+    found_quarters = found_days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64) // 3
+
+    # the open day has to be in the same zone and quarter otherwise that quarter doesn't roll
+    valid = (
+        (found < len(open_keys)) &
+        (found_keys // KEY_STRIDE == zone_codes[group_starts]) &
+        (found_quarters == quarters[group_starts]))
+
+    return pd.DataFrame({
+        "zone": zone_names[zone_codes[group_starts][valid]],
+        "date": found_days[valid].astype("datetime64[D]").astype("datetime64[ns]")})
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Dec  4 09:12:53 2023
+
+@author: Diego
+"""
+
+# on disk cache of the derived MarketStats tables so a new session doesn't recompute them.
+# Each get_* result is one entry directory holding a parquet file per table and a meta.json,
+# keyed by a fingerprint of the source parquet (size, mtime and a hash of its footer) along
+# with the method and its arguments. Least recently used entries are evicted once the cache
+# is over its size limit
+#
+#   cache/3f2a.../meta.json
+#   cache/3f2a.../df_roll_adj.parquet
+#
+# $ python ./src/StatsCache.py ../data/cache
+# $ python ./src/StatsCache.py ../data/cache --clear
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import pandas as pd
+
+# bump when a derived table's calculation changes so older entries are never read
+CACHE_VERSION = 3
+META_FILE = "meta.json"
+
+# the footer holds the schema, row group metadata and statistics so it changes with the contents
+# but is only a few KB to read, files that aren't parquet fall back to their last 8 bytes
+def _footer(file_path: str) -> bytes:
+
+    with open(file_path, "rb") as file:
+
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        if size < 12: return b""
+
+        file.seek(size - 8)
+        tail = file.read(8)
+        footer_size = int.from_bytes(tail[:4], "little")
+        if tail[4:] != b"PAR1" or footer_size + 8 > size: return tail
+
+        file.seek(size - 8 - footer_size)
+        return file.read(footer_size)
+
+# fingerprint of a parquet file or a directory of them (a partitioned dataset)
+def fingerprint(path: str) -> str:
+
+    if os.path.isdir(path):
+        file_paths = sorted(
+            os.path.join(root, file_name)
+            for root, dirs, file_names in os.walk(path)
+            for file_name in file_names if file_name.endswith(".parquet"))
+    else:
+        file_paths = [path]
+
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+
+        stat = os.stat(file_path)
+        digest.update("{}|{}|{}".format(os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns).encode())
+        digest.update(_footer(file_path))
+
+    return digest.hexdigest()
+
+class StatsCache:
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 1_024):
+
+        if max_size_mb <= 0: raise ValueError("max_size_mb must be positive")
+
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        if os.path.exists(self.cache_dir) == False: os.makedirs(self.cache_dir)
+
+    def _key(self, source: dict, method: str, params: tuple) -> str:
+
+        key = json.dumps({
+            "version": CACHE_VERSION,
+            "source": source,
+            "method": method,
+            "params": dict(params)}, sort_keys = True, default = repr)
+
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    # saved attributes of a get_* call or None when it isn't cached, a hit marks the entry as used
+    def load(self, source: dict, method: str, params: tuple) -> dict:
+
+        entry_path = self._entry_path(self._key(source, method, params))
+        meta_path = os.path.join(entry_path, META_FILE)
+        if os.path.exists(meta_path) == False: return None
+
+        with open(meta_path) as file: meta = json.load(file)
+
+        results = dict(meta["values"])
+        for attr in meta["tables"]:
+            results[attr] = pd.read_parquet(path = os.path.join(entry_path, "{}.parquet".format(attr)), engine = "pyarrow")
+
+        os.utime(meta_path)
+        return {attr: results[attr] for attr in meta["attrs"]}
+
+    # tables are written as parquet and anything else (the hour arguments) goes in meta.json, the
+    # entry is written to a temporary directory and moved into place so it is never half written
+    def save(self, source: dict, method: str, params: tuple, results: dict):
+
+        key = self._key(source, method, params)
+        tmp_path = self._entry_path("{}.tmp{}".format(key, os.getpid()))
+        if os.path.exists(tmp_path) == True: shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        tables, values = [], {}
+        for attr, value in results.items():
+
+            if isinstance(value, pd.DataFrame):
+                value.to_parquet(path = os.path.join(tmp_path, "{}.parquet".format(attr)), engine = "pyarrow")
+                tables.append(attr)
+            else:
+                values[attr] = value.item() if hasattr(value, "item") else value
+
+        with open(os.path.join(tmp_path, META_FILE), "w") as file:
+            json.dump({
+                "method": method,
+                "params": dict(params),
+                "attrs": list(results.keys()),
+                "tables": tables,
+                "values": values,
+                "created": time.time()}, file, default = repr)
+
+        entry_path = self._entry_path(key)
+        if os.path.exists(entry_path) == True: shutil.rmtree(entry_path)
+        os.replace(tmp_path, entry_path)
+
+        self.evict(keep = key)
+
+    # one row per entry with its method, arguments, size and when it was created and last used
+    def entries(self) -> pd.DataFrame:
+
+        rows = []
+        for key in os.listdir(self.cache_dir):
+
+            meta_path = os.path.join(self._entry_path(key), META_FILE)
+            if os.path.exists(meta_path) == False: continue
+
+            with open(meta_path) as file: meta = json.load(file)
+            rows.append({
+                "key": key,
+                "method": meta["method"],
+                "params": meta["params"],
+                "size_mb": sum(
+                    os.path.getsize(os.path.join(self._entry_path(key), file_name))
+                    for file_name in os.listdir(self._entry_path(key))) / 1e6,
+                "created": pd.Timestamp(meta["created"], unit = "s"),
+                "last_used": pd.Timestamp(os.path.getmtime(meta_path), unit = "s")})
+
+        columns = ["key", "method", "params", "size_mb", "created", "last_used"]
+        return pd.DataFrame(rows, columns = columns).sort_values("last_used", ascending = False).reset_index(drop = True)
+
+    def size_mb(self) -> float:
+        return self.entries().size_mb.sum()
+
+    # removes least recently used entries until the cache fits in max_size_mb
+    def evict(self, keep: str = None):
+
+        df_entries = self.entries()
+        total_mb = df_entries.size_mb.sum()
+
+        for key, size_mb in zip(df_entries.key[::-1], df_entries.size_mb[::-1]):
+
+            if total_mb <= self.max_size_mb: break
+            if key == keep: continue
+
+            shutil.rmtree(self._entry_path(key))
+            total_mb -= size_mb
+
+    # removes the entries and the temporary directories of interrupted saves, anything else in
+    # cache_dir is left alone in case it points at a directory that holds other data
+    def clear(self):
+
+        for key in os.listdir(self.cache_dir):
+
+            is_entry = os.path.exists(os.path.join(self._entry_path(key), META_FILE))
+            is_tmp = re.fullmatch(r"[0-9a-f]{32}\.tmp\d+", key) != None and os.path.isdir(self._entry_path(key))
+
+            if is_entry == True or is_tmp == True: shutil.rmtree(self._entry_path(key), ignore_errors = True)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cache_dir")
+    parser.add_argument("--clear", action = "store_true", help = "remove every entry")
+    args = parser.parse_args()
+
+    cache = StatsCache(args.cache_dir)
+    if args.clear == True:
+        cache.clear()
+        print("Cleared", args.cache_dir)
+
+    else:
+        df_entries = cache.entries()
+        print(df_entries.to_string(index = False))
+        print("{} entries {:,.1f} MB".format(len(df_entries), df_entries.size_mb.sum()))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec  6 09:27:44 2023
+
+@author: Diego
+"""
+
+# intraday window return engine for the MarketStats NYC return methods. Rows are sorted by
+# contract then NYC time once and keyed by (contract-day, hour), since the hour only goes up
+# within a contract-day those keys are sorted and the first and last bar of any window in
+# every contract-day is a searchsorted away. Every window is done in the same pass so a
+# sweep of hour pairs costs about the same as one window
+#
+#   "range": bars with nyc_hour1 <= hour < nyc_hour2
+#   "ends":  bars in hour nyc_hour1 or hour nyc_hour2
+
+import numpy as np
+import pandas as pd
+
+HOUR_NS = pd.Timedelta(hours = 1).value
+DAY_NS = pd.Timedelta(days = 1).value
+WINDOW_TYPES = ["range", "ends"]
+
+# arrays the windows are taken from, names and name_codes are the contract of each row, nyc_time
+# is epoch ns and prices maps each price column to its values, all in the same row order
+def day_rows(names: np.ndarray, name_codes: np.ndarray, nyc_time: np.ndarray, prices: dict) -> dict:
+
+    order = np.lexsort((nyc_time, name_codes))
+    name_codes, nyc_time = name_codes[order], nyc_time[order]
+
+    day, hour = nyc_time // DAY_NS, nyc_time % DAY_NS // HOUR_NS
+    is_start = (np.diff(name_codes, prepend = -1) | np.diff(day, prepend = -1)) != 0
+    day_starts = np.flatnonzero(is_start)
+
+    return {
+        "names": np.asarray(names, dtype = object),
+        "day_names": name_codes[day_starts],
+        "days": day[day_starts],
+        "nyc_time": nyc_time,
+        "keys": (np.cumsum(is_start) - 1) * 24 + hour,
+        "prices": {column: np.asarray(values)[order] for column, values in prices.items()}}
+
+def _check_windows(windows: list, window_type: str):
+
+    if window_type not in WINDOW_TYPES: raise ValueError("window_type must be 'range' or 'ends'")
+
+    for nyc_hour1, nyc_hour2 in windows:
+
+        if window_type == "range" and (nyc_hour1 < 0 or nyc_hour2 > 24 or nyc_hour1 > nyc_hour2):
+            raise ValueError("range windows need 0 <= nyc_hour1 <= nyc_hour2 <= 24, got {}".format((nyc_hour1, nyc_hour2)))
+
+        if window_type == "ends" and (min(nyc_hour1, nyc_hour2) < 0 or max(nyc_hour1, nyc_hour2) > 23):
+            raise ValueError("ends windows need hours between 0 and 23, got {}".format((nyc_hour1, nyc_hour2)))
+
+# first and last row of every contract-day in each window as (windows, contract-days) arrays and
+# whether the window has a return there, i.e. its first and last bars are at different times
+def bounds(rows: dict, windows: list, window_type: str) -> tuple:
+
+    _check_windows(windows, window_type)
+
+    keys, nyc_time = rows["keys"], rows["nyc_time"]
+    base = np.arange(len(rows["days"]))[None, :] * 24
+    hour1 = np.array([window[0] for window in windows], dtype = np.int64)[:, None]
+    hour2 = np.array([window[1] for window in windows], dtype = np.int64)[:, None]
+
+    if window_type == "range":
+
+        first = np.searchsorted(keys, base + hour1, side = "left")
+        last = np.searchsorted(keys, base + hour2, side = "left") - 1
+        has_rows = last >= first
+
+    else:
+
+        low, high = np.minimum(hour1, hour2), np.maximum(hour1, hour2)
+        low_start, low_end = np.searchsorted(keys, base + low, side = "left"), np.searchsorted(keys, base + low + 1, side = "left")
+        high_start, high_end = np.searchsorted(keys, base + high, side = "left"), np.searchsorted(keys, base + high + 1, side = "left")
+
+        first = np.where(low_end > low_start, low_start, high_start)
+        last = np.where(high_end > high_start, high_end, low_end) - 1
+        has_rows = (low_end > low_start) | (high_end > high_start)
+
+    first, last = np.where(has_rows, first, 0), np.where(has_rows, last, 0)
+    if len(keys) == 0: return first, last, has_rows
+
+    return first, last, has_rows & (nyc_time[last] != nyc_time[first])
+
+# one row per window and contract-day that has a return, sorted by window then date then contract,
+# with the window's first and last bar and the start price, end price and return of each price column
+def window_returns(rows: dict, windows: list, window_type: str) -> pd.DataFrame:
+
+    windows = [tuple(window) for window in windows]
+    first, last, valid = bounds(rows, windows, window_type)
+
+    # contract-days in date then contract order
+    day_order = np.lexsort((rows["names"][rows["day_names"]], rows["days"]))
+    window_id, day_id = np.nonzero(valid[:, day_order])
+    day_id = day_order[day_id]
+    first, last = first[window_id, day_id], last[window_id, day_id]
+
+    df_out = pd.DataFrame({
+        "nyc_hour1": np.array([window[0] for window in windows], dtype = np.int64)[window_id],
+        "nyc_hour2": np.array([window[1] for window in windows], dtype = np.int64)[window_id],
+        "date": pd.Series((rows["days"][day_id] * DAY_NS).view("datetime64[ns]")).dt.date,
+        "contract_name": rows["names"][rows["day_names"][day_id]],
+        "start_time": rows["nyc_time"][first].view("datetime64[ns]"),
+        "end_time": rows["nyc_time"][last].view("datetime64[ns]")})
+
+    for column, values in rows["prices"].items():
+
+        df_out[column + "_start"] = values[first]
+        df_out[column + "_end"] = values[last]
+        df_out[column + "_rtn"] = values[last] / values[first] - 1
+
+    return df_out
+
+# every (nyc_hour1, nyc_hour2) pair of two sets of hours
+def grid(hours1: list, hours2: list) -> list:
+    return [(int(hour1), int(hour2)) for hour1 in hours1 for hour2 in hours2]
+
+# every window of a window type, the 300 range windows or the 576 hour pairs
+def all_windows(window_type: str) -> list:
+
+    if window_type == "range": return [(hour1, hour2) for hour1, hour2 in grid(range(24), range(25)) if hour1 < hour2]
+    return grid(range(24), range(24))
@@ -5,60 +5,227 @@ Created on Thu Nov 16 22:28:30 2023
 @author: Diego
 """
 
+# pipeline runner, the calendar, the prices and the samples are stages whose outputs are cached
+# artifacts. Each stage is keyed by a hash of its parameters and of the artifact it is built
+# from, the keys and artifact hashes are kept in data/_pipeline.json and a stage whose key
+# still matches and whose outputs are unchanged is skipped. A new price scale only reruns
+# the prices and the samples, and a calendar regenerated to the same bytes doesn't rerun
+# the prices at all
+#
+# $ python ./src/makeData.py
+# $ python ./src/makeData.py --scale 0.0004 --price-seed 7
+# $ python ./src/makeData.py --contracts NYC=2 London=1 --year-lookback 5 --end-date 2023-01-01 --data-path ../data
+# $ python ./src/makeData.py --force
+
 import os
-import pandas as pd
+import json
+import hashlib
+import argparse
+import datetime as dt
 
+import PriceSample
 from DateGenerator import DateGenerator
 from PriceGenerator import PriceGenerator
 
+STAGES = ["date", "prices", "sample"]
+MANIFEST_FILE = "_pipeline.json"
+
 def generate_data():
-    
+
     DateGenerator().save_data()
     PriceGenerator().save_data()
-    
-def save_sample(df: pd.DataFrame, data_path: str, file_name: str):
-    
-    parquet_path = os.path.join(data_path, "{}.parquet".format(file_name))
-    csv_path = os.path.join(data_path, "{}.csv".format(file_name))
-    
-    print("Writing Sample Parquet")
-    df.to_parquet(path = parquet_path, engine = "pyarrow")
-    print("writing Sample CSV")
-    df.to_csv(path_or_buf = csv_path)
-    
-def make_sample():
-
-    parent_path = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-    data_path = os.path.join(parent_path, "data")
-    prices_path = os.path.join(data_path, "prices.parquet")
-    
-    df_price = pd.read_parquet(path = prices_path, engine = "pyarrow")
-
-    df_sample = (df_price.assign(
-        date = lambda x: pd.to_datetime(x.local_time.dt.date),
-        year = lambda x: x.date.dt.year).
-        query("year == year.max()").
-        drop(columns = ["year"]))
-     
-    save_sample(
-        df = df_sample.drop(columns = ["date"]), 
-        data_path = data_path, 
-        file_name = "prices_sample")
-    
-    df_month = (df_sample.assign(
-        month = lambda x: x.date.dt.month).
-        query("month == month.min()").
-        drop(columns = ["month", "date"]))
-    
-    save_sample(
-        df = df_month,
-        data_path = data_path,
-        file_name = "prices1m_sample")
-    
+
+# sample specs make_sample writes, see PriceSample.py for the keys
+SAMPLES = {
+    "prices_sample": {"year": "last"},
+    "prices1m_sample": {"year": "last", "month": "first"}}
+
+def _default_data_path() -> str:
+    return os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir)), "data")
+
+# the hive copy is sampled when it was written since a year filter there skips whole partitions,
+# prices.parquet otherwise where the filter skips row groups by their local_time statistics
+def make_sample(samples: dict = SAMPLES, data_path: str = None, source: str = None):
+
+    if data_path == None: data_path = _default_data_path()
+
+    if source == None:
+
+        source = os.path.join(data_path, "prices_hive")
+        if os.path.exists(source) == False: source = os.path.join(data_path, "prices.parquet")
+
+    for file_name, spec in samples.items():
+
+        PriceSample.write_sample(
+            source = source,
+            data_path = data_path,
+            file_name = file_name,
+            spec = spec)
+
+# sha256 of files and directories, a directory hashes every file under it by relative path so a
+# dataset is one artifact
+def artifact_hash(paths: list) -> str:
+
+    digest = hashlib.sha256()
+
+    for path in paths:
+
+        if os.path.isdir(path) == True:
+            files = sorted(os.path.join(dir_path, file_name) for dir_path, dir_names, file_names in os.walk(path) for file_name in file_names)
+        else: files = [path]
+
+        for file in files:
+
+            digest.update(os.path.relpath(file, os.path.dirname(path)).encode())
+            with open(file, "rb") as handle:
+                for block in iter(lambda: handle.read(1 << 20), b""): digest.update(block)
+
+    return digest.hexdigest()
+
+def stage_key(params: dict, upstream: str) -> str:
+    return hashlib.sha256(json.dumps({"params": params, "upstream": upstream}, sort_keys = True, default = str).encode()).hexdigest()
+
+def _read_manifest(data_path: str) -> dict:
+
+    manifest_path = os.path.join(data_path, MANIFEST_FILE)
+    if os.path.exists(manifest_path) == False: return {}
+
+    with open(manifest_path, "r") as file: return json.load(file)
+
+def _write_manifest(data_path: str, manifest: dict):
+
+    manifest_path = os.path.join(data_path, MANIFEST_FILE)
+    tmp_path = "{}.tmp".format(manifest_path)
+
+    with open(tmp_path, "w") as file: json.dump(manifest, file, indent = 1)
+    os.replace(tmp_path, manifest_path)
+
+# a stage is current when it was last run with the same key and its outputs still hash to what
+# it wrote, so deleted or edited outputs are rebuilt
+def _is_current(entry: dict, key: str, outputs: list) -> bool:
+
+    if entry == None or entry["key"] != key: return False
+    if all(os.path.exists(output) for output in outputs) == False: return False
+
+    return artifact_hash(outputs) == entry["hash"]
+
+# runs the stages in order, each one only when it isn't current, and returns whether each ran
+def run_pipeline(
+        data_path: str = None,
+        country_contract: dict = None,
+        year_lookback: int = 10,
+        end_date: dt.datetime = dt.datetime(year = dt.date.today().year, month = 1, day = 1),
+        date_seed: int = 1234,
+        chunk: str = None,
+        n_jobs: int = 1,
+        scale: float = 0.0002,
+        loc: float = 0.000003,
+        price_seed: int = 123,
+        samples: dict = SAMPLES,
+        force: bool = False,
+        verbose: bool = True) -> dict:
+
+    if data_path == None: data_path = _default_data_path()
+    data_path = os.path.abspath(data_path)
+    if os.path.exists(data_path) == False: os.makedirs(data_path)
+
+    date_out = os.path.join(data_path, "date" if chunk != None else "date.parquet")
+    prices_out = os.path.join(data_path, "prices" if chunk != None else "prices.parquet")
+
+    stages = {
+        "date": {
+            "params": {
+                "country_contract": country_contract,
+                "year_lookback": year_lookback,
+                "end_date": end_date,
+                "seed": date_seed,
+                "chunk": chunk},
+            "outputs": [date_out],
+            "run": lambda: DateGenerator(
+                country_contract = country_contract,
+                end_date = end_date,
+                year_lookback = year_lookback,
+                chunk = chunk,
+                n_jobs = n_jobs,
+                seed = date_seed,
+                data_path = data_path,
+                verbose = verbose).save_data()},
+        "prices": {
+            "params": {"scale": scale, "loc": loc, "seed": price_seed, "chunk": chunk},
+            "outputs": [prices_out],
+            "run": lambda: PriceGenerator(
+                scale = scale,
+                loc = loc,
+                chunk = chunk,
+                seed = price_seed,
+                data_path = data_path,
+                verbose = verbose).save_data()},
+        "sample": {
+            "params": {"samples": samples},
+            "outputs": [os.path.join(data_path, "{}.{}".format(file_name, extension)) for file_name in samples.keys() for extension in ["parquet", "csv"]],
+            "run": lambda: make_sample(samples = samples, data_path = data_path, source = prices_out)}}
+
+    manifest = _read_manifest(data_path)
+    upstream, ran = None, {}
+
+    for name in STAGES:
+
+        stage = stages[name]
+        key = stage_key(stage["params"], upstream)
+
+        ran[name] = force == True or _is_current(manifest.get(name), key, stage["outputs"]) == False
+
+        if ran[name] == True:
+
+            if verbose == True: print("Running", name)
+            stage["run"]()
+
+            manifest[name] = {"key": key, "params": stage["params"], "upstream": upstream, "hash": artifact_hash(stage["outputs"])}
+            _write_manifest(data_path, json.loads(json.dumps(manifest, default = str)))
+
+        elif verbose == True: print(name, "is current, skipped")
+
+        upstream = manifest[name]["hash"]
+
+    return ran
+
+# NYC=2 London=1 style contract counts
+def _country_contract(values: list) -> dict:
+
+    if values == None: return None
+    return {value.split("=")[0]: int(value.split("=")[1]) for value in values}
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Generate the calendar, prices and samples, skipping stages that are current")
+    parser.add_argument("--data-path", help = "output directory, ../data from the working directory by default")
+    parser.add_argument("--contracts", nargs = "+", help = "contracts per zone as ZONE=N, e.g. NYC=2 London=1")
+    parser.add_argument("--year-lookback", type = int, default = 10)
+    parser.add_argument("--end-date", help = "YYYY-MM-DD, the first of the current year by default")
+    parser.add_argument("--date-seed", type = int, default = 1234)
+    parser.add_argument("--chunk", choices = ["year", "quarter"])
+    parser.add_argument("--n-jobs", type = int, default = 1)
+    parser.add_argument("--scale", type = float, default = 0.0002)
+    parser.add_argument("--loc", type = float, default = 0.000003)
+    parser.add_argument("--price-seed", type = int, default = 123)
+    parser.add_argument("--force", action = "store_true", help = "rerun every stage")
+    args = parser.parse_args()
+
+    end_date = dt.datetime(year = dt.date.today().year, month = 1, day = 1)
+    if args.end_date != None: end_date = dt.datetime.strptime(args.end_date, "%Y-%m-%d")
+
+    run_pipeline(
+        data_path = args.data_path,
+        country_contract = _country_contract(args.contracts),
+        year_lookback = args.year_lookback,
+        end_date = end_date,
+        date_seed = args.date_seed,
+        chunk = args.chunk,
+        n_jobs = args.n_jobs,
+        scale = args.scale,
+        loc = args.loc,
+        price_seed = args.price_seed,
+        force = args.force)
 
 if __name__ == "__main__":
-    
-    generate_data()
-    make_sample()
-    
-    
\ No newline at end of file
+    main()